@@ -1,66 +1,673 @@
 # api/main.py
 
-from fastapi import FastAPI, HTTPException
-from .models import Character, Scene, ChatRequest
+from fastapi import FastAPI, Header, HTTPException, Response, WebSocket
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from .middleware import CancellationMiddleware, MetricsMiddleware, SchedulingMiddleware
+from .models import Character, CharacterProfile, Scene, SceneProfile, ChatRequest, BatchChatRequest
+from .websocket import ChatConnection, ReplyFunc
 from service.ai_service import AIService
-from config.security import SecurityConfig
-from typing import List
+from service.moderation import ContentBlockedError
+from service.persona_registry import RegistryEntry, RegistryError
+from config import configure_logging
+from config.security import get_security_config, load_env
+from config.settings import Settings
+from core.ai.errors import OverloadedError
+from core.ai.scheduler import current_request, set_request_context
+from typing import Any, Dict, List, Optional, Tuple
 from prompts.chat.dialogue_control import DialogueControl
+from utils.json_codec import FastJSONResponse, dumps_str
+from utils.logging_pipeline import dropped_records
+from utils.metrics import REGISTRY, flatten_stats, stage
+import asyncio
 import logging
+import math
+import time
+import uuid
 from datetime import datetime
 
 app = FastAPI(
     title="AI RolePlay API",
     description="A simple AI roleplay service using Claude",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
-# 初始化服务
-security_config = SecurityConfig()
-ai_service = AIService()
+# 导入时只读取配置; 验证凭证、创建 AWS 客户端和服务对象放在 startup (lifespan) 中,
+# 使导入足够快, 缺少 .env 也不会在导入时失败
+load_env()
+# 按 .env 中的 LOG_* 重新配置日志
+configure_logging()
+settings = Settings()
+ai_service: Optional[AIService] = None
+
+# 客户端断开或超过截止时间时取消请求 (在指标中间件之内, 被取消的请求记为 499/504)
+app.add_middleware(CancellationMiddleware)
+# 请求指标 (/metrics) 和可选的 Server-Timing 响应头
+app.add_middleware(MetricsMiddleware, server_timing=settings.server_timing)
+# 模型调用的调度信息 (租户、优先级、截止时间)
+app.add_middleware(SchedulingMiddleware, settings=settings)
+
+
+def init_services():
+    """
+    创建服务对象 (验证凭证、创建 AWS 客户端、打开注册表等), 已创建时不重复创建
+
+    由 startup 调用; 直接使用 app 而不经过 lifespan 时 (例如测试) 需要先调用。
+
+    Raises:
+        FileNotFoundError, ValueError: .env 不存在或凭证无效
+    """
+    global ai_service
+    if ai_service is not None:
+        return
+    # 先单独验证凭证, 配置错误时给出明确的启动失败原因
+    get_security_config()
+    ai_service = AIService()
+
+
+def init_worker():
+    """
+    gunicorn 预加载应用后, 在每个 worker 进程中调用
+
+    fork 不会复制日志后台线程, 因此重新配置日志; 服务对象 (线程池和数据库连接)
+    在各 worker 的 lifespan 中创建, 不与父进程共用。
+    """
+    global ai_service
+    configure_logging()
+    ai_service = None
+
+
+# 预热状态: /health 在预热完成前返回 503
+readiness: Dict = {"ready": False, "warmup": None}
+warmup_task: Optional[asyncio.Task] = None
+
+
+async def startup():
+    """服务器启动时调用 (lifespan): 创建服务对象, 在后台预热, 完成后 /health 报告就绪"""
+    global warmup_task
+    readiness.update(ready=False, warmup=None)
+    init_services()
+    if not settings.warmup_enabled:
+        readiness["ready"] = True
+        return
+    warmup_task = asyncio.ensure_future(run_warmup())
+
+
+async def run_warmup():
+    """预热 (出错或超时也标记为就绪, 只是没有预热效果)"""
+    try:
+        readiness["warmup"] = await asyncio.wait_for(ai_service.warm_up(), settings.warmup_timeout)
+    except asyncio.TimeoutError:
+        logging.warning(f"Warm-up did not finish within {settings.warmup_timeout}s")
+        readiness["warmup"] = {"error": "timeout"}
+    except Exception as e:
+        logging.error(f"Warm-up failed: {str(e)}", exc_info=True)
+        readiness["warmup"] = {"error": str(e)}
+    finally:
+        readiness["ready"] = True
+
+
+async def shutdown():
+    """进程退出前调用: 等待在途的模型调用完成并释放资源"""
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    if ai_service is not None:
+        await ai_service.close()
+
+
+async def build_chat_prompt(request: ChatRequest) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    根据请求构建系统提示词和历史消息
+
+    Returns:
+        Tuple[str, List[Dict[str, str]]]: (系统提示词, 历史消息)
+    """
+    with stage("prompt"):
+        system_prompt = await compile_prompt(request)
+        messages = DialogueControl.format_messages(request.message_history)
+
+    return system_prompt, messages
+
+
+async def compile_prompt(request: ChatRequest) -> str:
+    """
+    编译请求的系统提示词
+
+    角色和场景都直接提供时按内容缓存; 引用注册表 ID 时使用各版本预先渲染好的片段,
+    以 ETag 作为缓存键, 命中时不做任何字符串格式化。
+
+    Raises:
+        RegistryError: 引用的 ID 或版本不存在
+    """
+    if request.character_id is None and request.scene_id is None:
+        # 系统提示词按角色+场景缓存, 相同角色的请求不再重复渲染模板
+        return DialogueControl.compile_system_prompt(
+            character=request.character,
+            scene=request.scene
+        )
+
+    if request.character_id is not None:
+        entry = await ai_service.registry.aget("character", request.character_id, request.character_version)
+        character_key, character_info = entry.etag, entry.fragment
+    else:
+        character = request.character
+        character_key = (character.name, character.background, character.personality)
+        character_info = DialogueControl.build_character_info(character)
+
+    if request.scene_id is not None:
+        entry = await ai_service.registry.aget("scene", request.scene_id, request.scene_version)
+        scene_key, context = entry.etag, entry.fragment
+    else:
+        scene_key = (request.scene.description, request.scene.mood or "")
+        context = DialogueControl.build_context(request.scene)
+
+    return DialogueControl.compile_from_fragments(character_key, character_info, scene_key, context)
+
+
+def sse_event(data: Dict, event: Optional[str] = None) -> str:
+    """格式化一条 Server-Sent Event"""
+    payload = dumps_str(data)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+
+async def run_chat(request: ChatRequest, system_prompt: Optional[str] = None) -> Dict:
+    """
+    处理单个聊天请求
+
+    Args:
+        request: 聊天请求
+        system_prompt: 已编译的系统提示词 (批量请求共享), 默认按请求构建
+
+    Returns:
+        Dict: 接口返回内容
+    """
+    started = time.perf_counter()
+    if system_prompt is None:
+        system_prompt, messages = await build_chat_prompt(request)
+    else:
+        messages = DialogueControl.format_messages(request.message_history)
+
+    # 调用 AI 服务
+    result = await ai_service.chat(
+        user_message=request.message,
+        system_prompt=system_prompt,
+        messages=messages,
+        session_id=request.session_id,
+        max_input_tokens=request.max_input_tokens,
+        use_cache=request.use_cache,
+        clear_history=request.clear_history
+    )
+    log_conversation(request, result["response"], result["prompt_tokens"], result["cached"], started)
+
+    return {
+        "response": result["response"],
+        "session_id": request.session_id,
+        "prompt_tokens": result["prompt_tokens"],
+        "cached": result["cached"],
+        "usage": result["usage"]
+    }
+
+
+def log_conversation(request: ChatRequest, response: str, prompt_tokens: Optional[int],
+                     cached: bool, started: float):
+    """写入对话记录 (启用 CONVERSATION_LOG_PATH 时; 只入队, 不等待写入)"""
+    if ai_service.conversations is None:
+        return
+    ai_service.conversations.append(
+        session_id=request.session_id,
+        message=request.message,
+        response=response,
+        prompt_tokens=prompt_tokens,
+        cached=cached,
+        latency=time.perf_counter() - started,
+        # 回放时使用的请求参数 (角色、场景等), 历史不记录
+        request=request.model_dump(exclude={"message", "message_history"}, exclude_none=True)
+    )
+
+
+def overloaded_exception(error: OverloadedError) -> HTTPException:
+    """过载错误转换为 429/503 响应, 并带上 Retry-After"""
+    logging.warning(f"Rejecting request: {str(error)}")
+    return HTTPException(
+        status_code=error.status_code,
+        detail=str(error),
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+    )
+
 
 @app.post("/chat")
 async def chat(request: ChatRequest):
     try:
-        prompt_data = DialogueControl.build_prompt(
-            character=request.character,
-            scene=request.scene,
-            message_history=request.message_history
+        return await run_chat(request)
+
+    except OverloadedError as e:
+        raise overloaded_exception(e)
+    except (RegistryError, ContentBlockedError) as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except KeyError as e:
+        logging.error(f"KeyError in chat endpoint: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=400,
+            detail=f"Missing required field: {str(e)}"
         )
+    except Exception as e:
+        logging.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Internal server error: {str(e)}"
+        )
+
+
+@app.post("/chat/batch")
+async def chat_batch(request: BatchChatRequest):
+    """
+    批量聊天
+
+    以有限并发处理多个请求, 按原顺序返回每一项的结果或错误;
+    stream=true 时以 NDJSON 格式在每一项完成时立即输出 (带 index)。
+    同一批中角色和场景相同的请求共享编译后的系统提示词。
+    批量请求的模型调用总是以 batch 优先级排队。
+    """
+    if len(request.requests) > settings.batch_max_size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many requests in batch (max {settings.batch_max_size})"
+        )
+
+    limit = min(request.max_concurrency or settings.batch_max_concurrency,
+                settings.batch_max_concurrency)
+    semaphore = asyncio.Semaphore(limit)
+    # 下面创建的任务继承当前上下文
+    set_request_context(current_request().replace(priority="batch"))
 
-        # 简化的prompt，更口语化和调情风格
-        system_prompt = f"""{prompt_data['character_info']}
+    async def run_item(index: int, item: ChatRequest) -> Dict:
+        async with semaphore:
+            try:
+                # 编译结果在提示词缓存中共享, 相同角色和场景只渲染一次
+                return {"index": index, **await run_chat(item, await compile_prompt(item))}
+            except Exception as e:
+                logging.error(f"Error in batch item {index}: {str(e)}")
+                return {"index": index, "error": str(e)}
 
-    {prompt_data['context']}
+    tasks = [asyncio.ensure_future(run_item(i, item)) for i, item in enumerate(request.requests)]
 
-    回复1条简短的约会应用信息（每条最多4个字），开玩笑调情。每条消息包含一个表情符号。保持它轻松愉快和有品位-没有角色扮演或动作描述。专注于巧妙的文字游戏和友好的玩笑，就像在Tinder或类似的应用程序上发信息一样。回答要简短、随意、吸引人.经常使用英文缩写。
-    用英文回复
+    if not request.stream:
+        return {"results": await asyncio.gather(*tasks)}
+
+    async def ndjson_stream():
+        try:
+            for future in asyncio.as_completed(tasks):
+                yield dumps_str(await future) + "\n"
+        finally:
+            # 客户端断开时取消尚未完成的项
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
     """
+    流式聊天 (Server-Sent Events)
 
-        # 调用 AI 服务
-        response = await ai_service.chat(
+    每个文本片段作为一条 data 事件发送, 结束时发送 end 事件 (包含完整回复),
+    出错时发送 error 事件。客户端断开时停止生成并释放连接。
+    第一个片段在返回响应前取得, 因此过载 (429/503) 等开始前的错误仍以 HTTP 状态码返回。
+    """
+    usage = {}
+    started = time.perf_counter()
+    try:
+        system_prompt, messages = await build_chat_prompt(request)
+        chunks = ai_service.chat_stream(
             user_message=request.message,
             system_prompt=system_prompt,
-            messages=prompt_data['messages']
+            messages=messages,
+            session_id=request.session_id,
+            max_input_tokens=request.max_input_tokens,
+            clear_history=request.clear_history,
+            usage=usage
         )
+        try:
+            with stage("first_token"):
+                first_chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            first_chunk = None
 
-        return {"response": response}
-
+    except OverloadedError as e:
+        raise overloaded_exception(e)
+    except (RegistryError, ContentBlockedError) as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except KeyError as e:
-        logging.error(f"KeyError in chat endpoint: {str(e)}", exc_info=True)
+        logging.error(f"KeyError in chat stream endpoint: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=400,
             detail=f"Missing required field: {str(e)}"
         )
     except Exception as e:
-        logging.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
+        logging.error(f"Error in chat stream endpoint: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Internal server error: {str(e)}"
         )
 
+    async def event_stream():
+        parts = []
+        try:
+            if first_chunk is not None:
+                parts.append(first_chunk)
+                yield sse_event({"delta": first_chunk})
+
+                async for chunk in chunks:
+                    parts.append(chunk)
+                    yield sse_event({"delta": chunk})
+
+            log_conversation(request, "".join(parts), usage.get("prompt_tokens"), False, started)
+            yield sse_event(
+                {
+                    "response": "".join(parts),
+                    "session_id": request.session_id,
+                    "prompt_tokens": usage.get("prompt_tokens"),
+                    "usage": usage.get("model_usage")
+                },
+                event="end"
+            )
+
+        except ContentBlockedError as e:
+            # 已输出的内容应由客户端撤回
+            logging.warning(f"Stream blocked: {str(e)}")
+            yield sse_event({"detail": str(e), "blocked": True}, event="error")
+        except Exception as e:
+            logging.error(f"Error in chat stream endpoint: {str(e)}", exc_info=True)
+            yield sse_event({"detail": f"Internal server error: {str(e)}"}, event="error")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """
+    WebSocket 聊天: 连接时绑定一次角色和场景, 之后只发送新消息, 回复逐段返回
+
+    协议见 api/roleplay-chat-api-cn.md。
+    """
+    await ChatConnection(
+        websocket,
+        bind_chat_connection,
+        max_connections=settings.ws_max_connections,
+        heartbeat_interval=settings.ws_heartbeat_interval,
+        max_pending=settings.ws_max_pending,
+        send_timeout=settings.ws_send_timeout
+    ).run()
+
+
+async def bind_chat_connection(frame: Dict[str, Any]) -> Tuple[Dict[str, Any], ReplyFunc]:
+    """
+    处理 WebSocket 的 bind 帧: 校验参数并编译系统提示词
+
+    字段与 ChatRequest 相同 (不含 message); 没有 session_id 时生成一个,
+    对话历史由服务端保存。message_history 和 clear_history 只用于第一条成功回复的消息。
+
+    Returns:
+        Tuple[Dict[str, Any], ReplyFunc]: (bound 帧内容, 回复函数)
+
+    Raises:
+        ValidationError: 参数无效
+        RegistryError: 引用的 ID 或版本不存在
+    """
+    fields = {key: value for key, value in frame.items() if key not in ("type", "message")}
+    request = ChatRequest(**fields, message="")
+    if not request.session_id:
+        request.session_id = uuid.uuid4().hex
+    system_prompt, history = await build_chat_prompt(request)
+    clear_history = request.clear_history
+
+    async def reply(content: str, usage: Dict[str, Any]):
+        nonlocal history, clear_history
+        started = time.perf_counter()
+        parts = []
+        chunks = ai_service.chat_stream(
+            user_message=content,
+            system_prompt=system_prompt,
+            messages=history,
+            session_id=request.session_id,
+            max_input_tokens=request.max_input_tokens,
+            clear_history=clear_history,
+            usage=usage
+        )
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        finally:
+            await chunks.aclose()
+        # 第一轮成功后绑定时的历史已写入会话; 失败或被取消时下一条消息重新使用
+        history, clear_history = None, False
+        log_conversation(request.model_copy(update={"message": content}), "".join(parts),
+                         usage.get("prompt_tokens"), False, started)
+
+    return {"session_id": request.session_id}, reply
+
+
+def service_metrics() -> List[Tuple[str, Dict[str, str], float]]:
+    """各组件已有的 stats, 在输出 /metrics 时展开为 gauge"""
+    samples = flatten_stats("prompt_cache", DialogueControl.prompt_cache().stats())
+    samples.append(("log_records_dropped", {}, dropped_records()))
+    if ai_service is None:
+        # 服务对象尚未创建 (启动中)
+        return samples
+    samples += flatten_stats("bedrock", ai_service.claude.resilience.stats())
+    samples += flatten_stats("bedrock_pool", ai_service.claude.pool.stats())
+    samples += flatten_stats("sessions", ai_service.sessions.stats())
+    samples += flatten_stats("registry", ai_service.registry.stats())
+    if ai_service.moderator is not None:
+        samples += flatten_stats("moderation", ai_service.moderator.stats())
+    if ai_service.conversations is not None:
+        samples += flatten_stats("conversation_log", ai_service.conversations.stats())
+    if ai_service.response_cache is not None:
+        samples += flatten_stats("response_cache", ai_service.response_cache.stats())
+    if ai_service.coalescer is not None:
+        samples += flatten_stats("coalescer", ai_service.coalescer.stats())
+    return samples
+
+
+REGISTRY.register_collector(service_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 格式的指标 (各阶段耗时、token 用量、在途请求、错误, 以及各组件 stats)"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/prompts/stats")
+async def prompt_stats():
+    """系统提示词编译缓存指标"""
+    return DialogueControl.prompt_cache().stats()
+
+
+@app.get("/cache/stats")
+async def response_cache_stats():
+    """回复缓存指标 (命中率、节省的模型耗时)"""
+    if ai_service.response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **ai_service.response_cache.stats()}
+
+
+@app.get("/coalescer/stats")
+async def coalescer_stats():
+    """在途请求合并指标"""
+    if ai_service.coalescer is None:
+        return {"enabled": False}
+    return {"enabled": True, **ai_service.coalescer.stats()}
+
+
+@app.get("/resilience/stats")
+async def resilience_stats():
+    """Bedrock 容错层指标 (自适应并发上限、排队、限流、重试、熔断状态)"""
+    return ai_service.claude.resilience.stats()
+
+
+@app.get("/endpoints/stats")
+async def endpoint_stats():
+    """各 Bedrock 端点的延迟、错误率和对冲统计"""
+    return ai_service.claude.pool.stats()
+
+
+@app.get("/moderation/stats")
+async def moderation_stats():
+    """内容审核指标 (审核次数、拒绝次数、出错次数、缓存命中率)"""
+    if ai_service.moderator is None:
+        return {"enabled": False}
+    return {"enabled": True, **ai_service.moderator.stats()}
+
+
+@app.get("/sessions/stats")
+async def session_stats():
+    """会话存储指标"""
+    return await ai_service.sessions.astats()
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """删除会话 (结束对话时释放服务端历史)"""
+    if not await ai_service.sessions.adelete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"session_id": session_id, "deleted": True}
+
+
+def registry_response(entry: RegistryEntry, response: Response, status_code: int = 200) -> Dict:
+    """注册表记录的响应 (带 ETag)"""
+    response.status_code = status_code
+    response.headers["ETag"] = entry.etag
+    return entry.to_dict()
+
+
+async def registry_get(kind: str, entry_id: str, version: Optional[int],
+                       if_none_match: Optional[str], response: Response):
+    """按 ID 读取, If-None-Match 与 ETag 相同时返回 304"""
+    try:
+        entry = await ai_service.registry.aget(kind, entry_id, version)
+    except RegistryError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if if_none_match is not None and entry.etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": entry.etag})
+    return registry_response(entry, response)
+
+
+async def registry_write(kind: str, entry_id: Optional[str], data: Dict, if_match: Optional[str],
+                         response: Response, create: bool):
+    """创建 (201) 或写入新版本"""
+    try:
+        if create:
+            entry = await ai_service.registry.acreate(kind, data, entry_id)
+        else:
+            entry = await ai_service.registry.aput(kind, entry_id, data, if_match=if_match)
+    except RegistryError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    logging.info(f"Registry {kind} {entry.entry_id} version {entry.version} saved")
+    return registry_response(entry, response, 201 if entry.version == 1 else 200)
+
+
+@app.post("/characters", status_code=201)
+async def create_character(character: CharacterProfile, response: Response):
+    """创建角色 (版本 1), ID 已存在时返回 409"""
+    return await registry_write("character", character.id, character.model_dump(exclude={"id"}, exclude_none=True),
+                                None, response, create=True)
+
+
+@app.put("/characters/{character_id}")
+async def update_character(character_id: str, character: CharacterProfile, response: Response,
+                           if_match: Optional[str] = Header(default=None)):
+    """写入角色的新版本 (不存在时创建); 带 If-Match 时只在其等于最新版本的 ETag 时写入, 否则返回 412"""
+    return await registry_write("character", character_id, character.model_dump(exclude={"id"}, exclude_none=True),
+                                if_match, response, create=False)
+
+
+@app.get("/characters")
+async def list_characters():
+    """所有角色的最新版本"""
+    return {"items": [entry.to_dict() for entry in await ai_service.registry.alist("character")]}
+
+
+@app.get("/characters/{character_id}")
+async def get_character(character_id: str, response: Response, version: Optional[int] = None,
+                        if_none_match: Optional[str] = Header(default=None)):
+    """读取角色 (默认最新版本), 支持 If-None-Match 条件请求"""
+    return await registry_get("character", character_id, version, if_none_match, response)
+
+
+@app.post("/scenes", status_code=201)
+async def create_scene(scene: SceneProfile, response: Response):
+    """创建场景 (版本 1), ID 已存在时返回 409"""
+    return await registry_write("scene", scene.id, scene.model_dump(exclude={"id"}), None, response, create=True)
+
+
+@app.put("/scenes/{scene_id}")
+async def update_scene(scene_id: str, scene: SceneProfile, response: Response,
+                       if_match: Optional[str] = Header(default=None)):
+    """写入场景的新版本 (不存在时创建), If-Match 语义同角色"""
+    return await registry_write("scene", scene_id, scene.model_dump(exclude={"id"}), if_match, response, create=False)
+
+
+@app.get("/scenes")
+async def list_scenes():
+    """所有场景的最新版本"""
+    return {"items": [entry.to_dict() for entry in await ai_service.registry.alist("scene")]}
+
+
+@app.get("/scenes/{scene_id}")
+async def get_scene(scene_id: str, response: Response, version: Optional[int] = None,
+                    if_none_match: Optional[str] = Header(default=None)):
+    """读取场景 (默认最新版本), 支持 If-None-Match 条件请求"""
+    return await registry_get("scene", scene_id, version, if_none_match, response)
+
+
+@app.post("/sessions/{session_id}/restore")
+async def restore_session(session_id: str, max_turns: int = 100):
+    """从对话记录恢复会话历史 (最近 max_turns 轮), 需启用 CONVERSATION_LOG_PATH"""
+    if ai_service.conversations is None:
+        raise HTTPException(status_code=404, detail="Conversation log is not enabled")
+    turns = await ai_service.restore_session(session_id, max_turns)
+    if not turns:
+        raise HTTPException(status_code=404, detail="No conversation log for session")
+    return {"session_id": session_id, "restored_turns": turns}
+
+
+@app.get("/conversations")
+async def read_conversations(session_id: Optional[str] = None, after_id: int = 0,
+                             since: Optional[float] = None, until: Optional[float] = None,
+                             limit: int = 1000):
+    """
+    按范围读取对话记录 (按 id 升序)
+
+    分页时把上一页返回的 next_after_id 作为 after_id; 最近几十毫秒内的记录可能尚未写入。
+    """
+    if ai_service.conversations is None:
+        raise HTTPException(status_code=404, detail="Conversation log is not enabled")
+    # 最多扫描 10000 行, 在线程中读取, 不阻塞事件循环
+    items = await asyncio.to_thread(ai_service.conversations.read, session_id=session_id, after_id=after_id,
+                                    since=since, until=until, limit=max(1, min(limit, 10000)))
+    return {"items": items, "next_after_id": items[-1]["id"] if items else after_id}
+
+
+@app.get("/conversations/stats")
+async def conversation_log_stats():
+    """对话记录写入指标 (队列长度、已写入、丢弃、批次数)"""
+    if ai_service.conversations is None:
+        return {"enabled": False}
+    return {"enabled": True, **ai_service.conversations.stats()}
+
 
 @app.get("/health")
 async def health_check():
-    """健康检查"""
-    return {"status": "healthy"}
\ No newline at end of file
+    """健康检查 (就绪探针): 启动预热完成前返回 503"""
+    if not readiness["ready"]:
+        return FastJSONResponse({"status": "starting"}, status_code=503)
+    return {"status": "healthy", "warmup": readiness["warmup"]}
\ No newline at end of file
@@ -0,0 +1,242 @@
+# api/middleware.py
+
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Dict, Optional
+
+from config.security import get_security_config
+from core.ai.scheduler import (
+    PRIORITIES,
+    RequestContext,
+    current_request,
+    reset_request_context,
+    set_request_context,
+)
+from utils.metrics import (
+    HTTP_IN_FLIGHT,
+    HTTP_REQUESTS,
+    HTTP_REQUEST_SECONDS,
+    server_timing_header,
+    start_timing,
+    stop_timing,
+)
+
+
+class MetricsMiddleware:
+    """
+    请求指标中间件 (纯 ASGI 实现, 不额外创建任务, 开销很小)
+
+    记录每个路由的请求数、状态码、耗时 (到响应体结束为止) 和在途请求数;
+    server_timing 为 True 时把请求各阶段的耗时写入 Server-Timing 响应头
+    (流式响应只包含响应头发送前完成的阶段)。
+    """
+
+    def __init__(self, app: Any, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings, token = start_timing() if self.server_timing else (None, None)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if timings:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing_header(timings).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # 使用路由模板作为标签, 避免 /sessions/{session_id} 之类的路径产生大量标签值
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, path=path)
+            HTTP_REQUESTS.inc(path=path, status=str(status))
+            if token is not None:
+                stop_timing(token)
+
+
+class SchedulingMiddleware:
+    """
+    为每个请求设置模型调用的调度信息 (纯 ASGI 实现, 对 HTTP 和 WebSocket 都生效)
+
+    - 租户: X-API-Key 头 (或 Authorization: Bearer) 对应的租户, 权重按 TENANT_WEIGHTS
+    - 优先级: X-Priority 头, interactive (默认) 或 batch
+    - 截止时间: X-Request-Timeout 头 (秒, 从收到请求时开始计算), 只对 HTTP 请求生效
+
+    无效的头部按默认值处理。API 密钥到租户的映射和租户权重在第一个请求时解析一次并缓存
+    (修改 API_KEYS / TENANT_WEIGHTS 后需要重启进程)。
+    """
+
+    def __init__(self, app: Any, settings: Any, security_config: Any = None):
+        """
+        Args:
+            app: ASGI 应用
+            settings: 运行参数 (TENANT_WEIGHTS)
+            security_config: API 密钥配置, 默认使用进程内共享的配置 (第一个请求时取得)
+        """
+        self.app = app
+        self.settings = settings
+        self.security_config = security_config
+        self._tenants: Optional[Dict[str, str]] = None
+        self._weights: Dict[str, float] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        token = set_request_context(self.context(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset_request_context(token)
+
+    def context(self, scope) -> RequestContext:
+        """根据请求头构建调度信息"""
+        headers = {}
+        for name, value in scope.get("headers", []):
+            if name in (b"x-api-key", b"authorization", b"x-priority", b"x-request-timeout"):
+                headers[name] = value.decode("latin-1").strip()
+
+        api_key = headers.get(b"x-api-key")
+        authorization = headers.get(b"authorization", "")
+        if not api_key and authorization.lower().startswith("bearer "):
+            api_key = authorization[7:].strip()
+        if self._tenants is None:
+            self._resolve()
+        tenant = self._tenants.get(api_key, "anonymous") if api_key else "anonymous"
+
+        priority = headers.get(b"x-priority", "").lower()
+        if priority not in PRIORITIES:
+            priority = PRIORITIES[0]
+
+        deadline = None
+        if scope["type"] == "http" and b"x-request-timeout" in headers:
+            try:
+                timeout = float(headers[b"x-request-timeout"])
+                if math.isfinite(timeout):
+                    deadline = time.monotonic() + timeout
+            except ValueError:
+                pass
+
+        return RequestContext(
+            tenant=tenant,
+            weight=self._weights.get(tenant, 1.0),
+            priority=priority,
+            deadline=deadline
+        )
+
+    def _resolve(self):
+        """解析 API 密钥到租户的映射和租户权重 (第一个请求时调用一次)"""
+        self.security_config = self.security_config or get_security_config()
+        self._weights = self.settings.tenant_weights
+        self._tenants = self.security_config.api_keys
+
+
+class CancellationMiddleware:
+    """
+    客户端断开或超过截止时间时取消请求的处理 (纯 ASGI 实现, 只处理 HTTP)
+
+    服务器在客户端断开后不会取消正在执行的路由函数, 例如非流式的 /chat 会一直等到模型返回。
+    这里在单独的任务中运行应用, 由本中间件读取 receive (请求体照常转交给应用):
+    收到 http.disconnect 时取消应用任务, 取消沿 await 链传到模型调用 (排队中的调用移出队列,
+    不会再发给 Bedrock; 流式调用停止读取并关闭流)。超过截止时间 (X-Request-Timeout) 时同样取消,
+    响应尚未开始时返回 504, 已经开始的流式响应直接结束。
+
+    被取消的请求在请求指标中记为 499 (客户端断开) 或 504。
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        messages: asyncio.Queue = asyncio.Queue()
+        response = {"started": False, "finished": False}
+
+        async def listen():
+            """读取客户端的消息直到断开"""
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        async def receive_wrapper():
+            message = await messages.get()
+            if message["type"] == "http.disconnect":
+                # 之后的 receive 调用都返回断开
+                messages.put_nowait(message)
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response["finished"] = True
+            await send(message)
+
+        app_task = asyncio.ensure_future(self.app(scope, receive_wrapper, send_wrapper))
+        listener = asyncio.ensure_future(listen())
+        try:
+            done, _ = await asyncio.wait(
+                {app_task, listener},
+                timeout=current_request().remaining(),
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if app_task in done:
+                app_task.result()
+                return
+
+            disconnected = listener in done
+            if disconnected and listener.exception() is not None:
+                logging.warning(f"Failed to read from client: {listener.exception()!r}")
+            app_task.cancel()
+            await asyncio.wait({app_task})
+            if not app_task.cancelled() and app_task.exception() is not None:
+                logging.debug(f"Cancelled request raised: {app_task.exception()!r}")
+
+            path = scope.get("path")
+            if disconnected:
+                logging.info(f"Client disconnected, cancelled {path}")
+                status, detail = 499, "Client closed request"
+            else:
+                logging.warning(f"Request deadline exceeded, cancelled {path}")
+                status, detail = 504, "Request deadline exceeded"
+
+            try:
+                if not response["started"]:
+                    await send({
+                        "type": "http.response.start",
+                        "status": status,
+                        "headers": [(b"content-type", b"application/json")]
+                    })
+                    await send({"type": "http.response.body", "body": f'{{"detail":"{detail}"}}'.encode()})
+                elif not response["finished"]:
+                    await send({"type": "http.response.body", "body": b""})
+            except (OSError, RuntimeError):
+                # 连接已关闭
+                pass
+
+        finally:
+            if not app_task.done():
+                app_task.cancel()
+            listener.cancel()
@@ -2,7 +2,7 @@
 from pydantic import BaseModel
 from typing import List, Optional,Any,Dict
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Optional
 
 class Character(BaseModel):
@@ -14,15 +14,48 @@ class Scene(BaseModel):
     description: str
     mood: Optional[str] = None
 
+class CharacterProfile(Character):
+    # 注册表 ID, 创建时不提供则自动生成
+    id: Optional[str] = Field(default=None, pattern=r"^[A-Za-z0-9_.-]{1,64}$")
+    greeting: Optional[str] = None
+
+class SceneProfile(Scene):
+    id: Optional[str] = Field(default=None, pattern=r"^[A-Za-z0-9_.-]{1,64}$")
+
 class Message(BaseModel):
     role: str
     content: str
 
 class ChatRequest(BaseModel):
-    character: Character
-    scene: Scene
+    # 角色和场景: 直接提供内容, 或引用注册表中的 ID (可指定版本, 默认最新版本)
+    character: Optional[Character] = None
+    scene: Optional[Scene] = None
+    character_id: Optional[str] = None
+    character_version: Optional[int] = Field(default=None, gt=0)
+    scene_id: Optional[str] = None
+    scene_version: Optional[int] = Field(default=None, gt=0)
     message: str
     message_history: Optional[List[Message]] = []
-
-
-
+    # 会话 ID: 提供时历史由服务端保存, 客户端只需发送新消息
+    session_id: Optional[str] = None
+    # 输入 token 预算: 超出时只保留最近的对话
+    max_input_tokens: Optional[int] = Field(default=None, gt=0)
+    # 设为 false 时跳过回复缓存, 总是请求模型
+    use_cache: bool = True
+    # 设为 true 时先清除会话 (session_id) 在服务端保存的历史
+    clear_history: bool = False
+
+    @model_validator(mode="after")
+    def check_persona(self):
+        if self.character is None and self.character_id is None:
+            raise ValueError("character or character_id is required")
+        if self.scene is None and self.scene_id is None:
+            raise ValueError("scene or scene_id is required")
+        return self
+
+class BatchChatRequest(BaseModel):
+    requests: List[ChatRequest]
+    # 最大并发数, 不超过服务端配置的 BATCH_MAX_CONCURRENCY
+    max_concurrency: Optional[int] = Field(default=None, gt=0)
+    # 为 true 时以 NDJSON 流式返回, 每项完成即输出
+    stream: bool = False
@@ -0,0 +1,289 @@
+# api/websocket.py
+
+import asyncio
+import logging
+import math
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from pydantic import ValidationError
+from starlette.websockets import WebSocket, WebSocketDisconnect, WebSocketState
+
+from core.ai.errors import OverloadedError
+from service.moderation import ContentBlockedError
+from utils.json_codec import dumps_str, loads
+from utils.metrics import WS_CONNECTIONS, WS_MESSAGES
+
+# 关闭码 (RFC 6455)
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+
+# reply(content, usage): 返回回复文本片段的异步迭代器, 可在 usage 中回填 prompt_tokens
+ReplyFunc = Callable[[str, Dict[str, Any]], AsyncIterator[str]]
+# bind(frame): 协程, 返回 (bound 帧的附加内容, reply)
+BindFunc = Callable[[Dict[str, Any]], Awaitable[Tuple[Dict[str, Any], ReplyFunc]]]
+
+
+class ConnectionClosed(Exception):
+    """发送失败 (客户端已断开或读取过慢), 连接需要关闭"""
+
+    def __init__(self, code: int = CLOSE_NORMAL):
+        super().__init__(f"WebSocket closed ({code})")
+        self.code = code
+
+
+class ChatConnection:
+    """
+    WebSocket 聊天连接
+
+    客户端连接后先发送 bind 帧绑定角色和场景 (只在此时编译一次系统提示词),
+    之后只发送新消息; 每条消息的回复以 delta 帧逐段返回, 以 end 帧结束。
+
+    - 消息按收到的顺序逐条处理, 排队的消息超过 max_pending 时直接返回 429 错误帧
+    - 每帧发送有超时: 客户端读取过慢时断开连接, 而不是在服务端无限缓冲
+    - 每隔 heartbeat_interval 发送 ping, 连续两个间隔没有收到任何帧时断开连接
+    - 客户端断开时取消正在生成的回复, 模型调用随之停止
+    """
+
+    # 当前进程的连接数
+    active = 0
+
+    def __init__(self,
+                 websocket: WebSocket,
+                 bind: BindFunc,
+                 max_connections: int = 1000,
+                 heartbeat_interval: float = 20.0,
+                 max_pending: int = 4,
+                 send_timeout: float = 10.0):
+        """
+        Args:
+            websocket: WebSocket 连接
+            bind: 处理 bind 帧, 出错时抛出异常 (返回错误帧后以 1008 关闭连接)
+            max_connections: 每个进程的最大连接数, 超出时以 1013 关闭新连接
+            heartbeat_interval: 心跳间隔 (秒)
+            max_pending: 排队等待回复的最大消息数
+            send_timeout: 发送一帧的最长时间 (秒)
+        """
+        self.websocket = websocket
+        self.bind = bind
+        self.max_connections = max_connections
+        self.heartbeat_interval = heartbeat_interval
+        self.send_timeout = send_timeout
+
+        self._pending: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._send_lock = asyncio.Lock()
+        self._last_seen = time.monotonic()
+        self._close_code = CLOSE_NORMAL
+        self._reply: Optional[ReplyFunc] = None
+
+    async def run(self):
+        """处理连接直到断开"""
+        await self.websocket.accept()
+        if ChatConnection.active >= self.max_connections:
+            logging.warning(f"Rejecting WebSocket connection: {ChatConnection.active} connections open")
+            await self._send_quietly(self._error_frame(None, 503, "Too many connections"))
+            await self._close(CLOSE_TRY_AGAIN_LATER)
+            return
+
+        ChatConnection.active += 1
+        WS_CONNECTIONS.inc()
+        try:
+            if await self._bind():
+                await self._serve()
+        except ConnectionClosed as e:
+            self._close_code = e.code
+        finally:
+            ChatConnection.active -= 1
+            WS_CONNECTIONS.dec()
+            await self._close(self._close_code)
+
+    async def _bind(self) -> bool:
+        """等待并处理 bind 帧, 成功时返回 True"""
+        try:
+            frame = await asyncio.wait_for(self._receive(), 2 * self.heartbeat_interval)
+        except (asyncio.TimeoutError, WebSocketDisconnect):
+            return False
+        if frame is None or frame.get("type") != "bind":
+            await self.send(self._error_frame(None, 400, "The first frame must be a bind frame"))
+            self._close_code = CLOSE_POLICY_VIOLATION
+            return False
+
+        try:
+            bound, self._reply = await self.bind(frame)
+        except Exception as e:
+            await self.send(self._exception_frame(None, e))
+            self._close_code = CLOSE_POLICY_VIOLATION
+            return False
+
+        await self.send(dict(bound, type="bound"))
+        return True
+
+    async def _serve(self):
+        """读取、处理消息和心跳并行运行, 任何一个结束时关闭连接"""
+        tasks = [
+            asyncio.ensure_future(self._read()),
+            asyncio.ensure_future(self._work()),
+            asyncio.ensure_future(self._heartbeat())
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # 取消正在生成的回复 (关闭流式生成器, 停止模型调用)
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    async def _read(self):
+        """读取客户端的帧, 消息放入队列"""
+        while True:
+            try:
+                frame = await self._receive()
+            except WebSocketDisconnect:
+                return
+            if frame is None:
+                await self.send(self._error_frame(None, 400, "Invalid JSON frame"))
+                continue
+
+            frame_type = frame.get("type")
+            if frame_type == "ping":
+                await self.send({"type": "pong"})
+            elif frame_type == "pong":
+                continue
+            elif frame_type == "message":
+                message_id, content = frame.get("id"), frame.get("content")
+                if not isinstance(content, str) or not content.strip():
+                    await self.send(self._error_frame(message_id, 400, "content must be a non-empty string"))
+                    continue
+                try:
+                    self._pending.put_nowait((message_id, content))
+                except asyncio.QueueFull:
+                    WS_MESSAGES.inc(result="rejected")
+                    await self.send(self._error_frame(
+                        message_id, 429, "Too many pending messages on this connection", retry_after=1
+                    ))
+            else:
+                await self.send(self._error_frame(None, 400, f"Unknown frame type: {frame_type}"))
+
+    async def _work(self):
+        """按顺序回复队列中的消息"""
+        while True:
+            message_id, content = await self._pending.get()
+            await self._turn(message_id, content)
+
+    async def _turn(self, message_id: Any, content: str):
+        """生成一条消息的回复, 以 delta 帧逐段发送"""
+        usage: Dict[str, Any] = {}
+        parts = []
+        chunks = self._reply(content, usage)
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                await self.send({"type": "delta", "id": message_id, "delta": chunk})
+        except (ConnectionClosed, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            WS_MESSAGES.inc(result="error")
+            await self.send(self._exception_frame(message_id, e))
+            return
+        finally:
+            await chunks.aclose()
+
+        WS_MESSAGES.inc(result="ok")
+        await self.send({
+            "type": "end",
+            "id": message_id,
+            "response": "".join(parts),
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "usage": usage.get("model_usage")
+        })
+
+    async def _heartbeat(self):
+        """定时发送 ping, 长时间没有收到任何帧时结束 (关闭连接)"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            idle = time.monotonic() - self._last_seen
+            if idle > 2 * self.heartbeat_interval:
+                logging.info(f"Closing idle WebSocket connection ({idle:.0f}s without frames)")
+                self._close_code = CLOSE_GOING_AWAY
+                return
+            await self.send({"type": "ping"})
+
+    async def _receive(self) -> Optional[Dict[str, Any]]:
+        """
+        读取一帧 (文本或二进制 JSON)
+
+        Returns:
+            Optional[Dict[str, Any]]: 解析后的帧, 不是 JSON 对象时为 None
+
+        Raises:
+            WebSocketDisconnect: 客户端已断开
+        """
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", CLOSE_NORMAL))
+        self._last_seen = time.monotonic()
+        data = message.get("text")
+        if data is None:
+            data = message.get("bytes") or b""
+        try:
+            frame = loads(data)
+        except ValueError:
+            return None
+        return frame if isinstance(frame, dict) else None
+
+    async def send(self, frame: Dict[str, Any]):
+        """
+        发送一帧
+
+        Raises:
+            ConnectionClosed: 客户端已断开, 或在 send_timeout 内没有读取 (1013)
+        """
+        async with self._send_lock:
+            try:
+                await asyncio.wait_for(self.websocket.send_text(dumps_str(frame)), self.send_timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"WebSocket client too slow, closing after {self.send_timeout}s send timeout")
+                raise ConnectionClosed(CLOSE_TRY_AGAIN_LATER)
+            except (WebSocketDisconnect, RuntimeError, OSError):
+                raise ConnectionClosed()
+
+    async def _send_quietly(self, frame: Dict[str, Any]):
+        try:
+            await self.send(frame)
+        except ConnectionClosed:
+            pass
+
+    async def _close(self, code: int):
+        if (self.websocket.application_state == WebSocketState.CONNECTED
+                and self.websocket.client_state == WebSocketState.CONNECTED):
+            try:
+                await self.websocket.close(code)
+            except (RuntimeError, OSError):
+                pass
+
+    @staticmethod
+    def _error_frame(message_id: Any, status: int, detail: str, **extra) -> Dict[str, Any]:
+        return dict({"type": "error", "id": message_id, "status": status, "detail": detail}, **extra)
+
+    def _exception_frame(self, message_id: Any, error: Exception) -> Dict[str, Any]:
+        """异常转换为错误帧 (状态码与 HTTP 接口一致)"""
+        if isinstance(error, OverloadedError):
+            logging.warning(f"Rejecting WebSocket message: {str(error)}")
+            return self._error_frame(message_id, error.status_code, str(error),
+                                     retry_after=max(1, math.ceil(error.retry_after)))
+        if isinstance(error, ContentBlockedError):
+            logging.warning(f"WebSocket message blocked: {str(error)}")
+            return self._error_frame(message_id, error.status_code, str(error), blocked=True)
+        if isinstance(error, ValidationError):
+            return self._error_frame(message_id, 422, str(error))
+        status = getattr(error, "status_code", None)
+        if isinstance(status, int):
+            return self._error_frame(message_id, status, str(error))
+        logging.error(f"Error in WebSocket chat: {str(error)}", exc_info=error)
+        return self._error_frame(message_id, 500, f"Internal server error: {str(error)}")
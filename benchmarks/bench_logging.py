@@ -0,0 +1,93 @@
+# benchmarks/bench_logging.py
+"""
+每个请求的日志开销对比 (调用方线程的耗时, 即阻塞事件循环的时间)
+
+before: basicConfig(DEBUG) + 同步 StreamHandler, 每个请求 f-string 格式化消息列表、
+        json.dumps 请求体和完整响应 (旧实现)
+after:  队列 + 后台线程输出, 内容日志按类别采样、延迟序列化
+
+输出写到 os.devnull, 只比较格式化和写入本身的开销。
+
+用法: python -m benchmarks.bench_logging [--history 100] [--requests 2000]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.logging_pipeline import TEXT_FORMAT, log_payload, setup_logging, shutdown_logging  # noqa: E402
+
+
+def make_request(history: int):
+    messages = []
+    for i in range(history):
+        messages.append({"role": "user", "content": f"message {i}: what are you up to tonight? 😉"})
+        messages.append({"role": "assistant", "content": f"reply {i}: just chilling, wbu? ✨"})
+    body = {"anthropic_version": "bedrock-2023-05-31", "messages": messages, "max_tokens": 52}
+    response = {"content": [{"type": "text", "text": "hey there 😉"}], "usage": {"input_tokens": 900}}
+    return body, response
+
+
+def request_before(body, response):
+    logging.debug(f"Formatted messages: {body['messages']}")
+    logging.debug(f"Request body: {json.dumps(body, ensure_ascii=False)}")
+    logging.debug(f"Full response: {response}")
+    logging.info("Chat completed")
+
+
+def request_after(body, response):
+    log_payload("request", "Request body", body)
+    log_payload("response", "Full response", response)
+    logging.info("Chat completed")
+
+
+def measure(func, body, response, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        func(body, response)
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request logging overhead")
+    parser.add_argument("--history", type=int, default=100, help="历史轮数")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    body, response = make_request(args.history)
+    devnull = open(os.devnull, "w")
+    root = logging.getLogger()
+
+    # 旧实现: 同步输出, DEBUG
+    shutdown_logging()
+    root.handlers = []
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    before = measure(request_before, body, response, args.requests)
+    root.removeHandler(handler)
+
+    results = [("before (sync, DEBUG)", before)]
+    for label, level, rate in [
+        ("after (queue, DEBUG, sample 100%)", "DEBUG", 1.0),
+        ("after (queue, DEBUG, sample 1%)", "DEBUG", 0.01),
+        ("after (queue, INFO)", "INFO", 1.0),
+    ]:
+        setup_logging(level=level, queue_size=args.requests * 4, payload_default_rate=rate, stream=devnull)
+        results.append((label, measure(request_after, body, response, args.requests)))
+        shutdown_logging()
+
+    print(f"history {args.history} turns, {args.requests} requests")
+    for label, elapsed in results:
+        print(f"  {label:<36} {elapsed * 1e6:9.1f} µs/request  ({before / elapsed:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
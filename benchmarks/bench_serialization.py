@@ -0,0 +1,100 @@
+# benchmarks/bench_serialization.py
+"""
+长历史请求的序列化耗时对比
+
+before: format_messages 复制一次, build_body 再逐条复制, json.dumps 请求体,
+        json.loads 响应, 标准库 JSONResponse 渲染接口响应 (旧实现)
+after:  build_body 直接引用历史中的消息, json_codec (有 orjson 时使用 orjson)
+
+用法: python -m benchmarks.bench_serialization [--messages 100 200 400] [--requests 2000]
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from starlette.responses import JSONResponse  # noqa: E402
+
+from api.models import Message  # noqa: E402
+from prompts.chat.dialogue_control import DialogueControl  # noqa: E402
+from utils import json_codec  # noqa: E402
+
+RESPONSE = json.dumps({
+    "id": "msg_bench",
+    "content": [{"type": "text", "text": "hey there 😉 what are you up to tonight?"}],
+    "usage": {"input_tokens": 4000, "output_tokens": 20}
+}).encode("utf-8")
+
+
+def make_history(count: int):
+    history = []
+    for i in range(count):
+        role = "user" if i % 2 == 0 else "assistant"
+        history.append(Message(role=role, content=f"message {i}: haha ok, see you at the café later? ✨"))
+    return history
+
+
+def build_body_before(system_prompt, user_message, messages):
+    formatted_messages = []
+    for msg in messages:
+        if msg["role"] in ["user", "assistant"]:
+            formatted_messages.append({"role": msg["role"], "content": msg["content"]})
+    formatted_messages.append({"role": "user", "content": f"{system_prompt}\n\n{user_message}"})
+    return {"anthropic_version": "bedrock-2023-05-31", "messages": formatted_messages, "max_tokens": 52}
+
+
+def build_body_after(system_prompt, user_message, messages):
+    formatted_messages = []
+    for msg in messages:
+        if msg["role"] in ("user", "assistant"):
+            formatted_messages.append(msg if len(msg) == 2 else {"role": msg["role"], "content": msg["content"]})
+    formatted_messages.append({"role": "user", "content": f"{system_prompt}\n\n{user_message}"})
+    return {"anthropic_version": "bedrock-2023-05-31", "messages": formatted_messages, "max_tokens": 52}
+
+
+def request_before(history):
+    messages = [{"role": m.role, "content": m.content} for m in history]
+    body = build_body_before("persona", "hi", messages)
+    payload = json.dumps(body)
+    response = json.loads(RESPONSE)
+    JSONResponse({"response": response["content"][0]["text"], "prompt_tokens": 4000})
+    return payload
+
+
+def request_after(history):
+    messages = DialogueControl.format_messages(history)
+    body = build_body_after("persona", "hi", messages)
+    payload = json_codec.dumps(body)
+    response = json_codec.loads(RESPONSE)
+    json_codec.FastJSONResponse({"response": response["content"][0]["text"], "prompt_tokens": 4000})
+    return payload
+
+
+def measure(func, history, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        func(history)
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serialization cost on long histories")
+    parser.add_argument("--messages", type=int, nargs="+", default=[100, 200, 400])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"json backend: {json_codec.BACKEND}")
+    for count in args.messages:
+        history = make_history(count)
+        before = measure(request_before, history, args.requests)
+        after = measure(request_after, history, args.requests)
+        print(f"  {count:4d} messages: before {before * 1e6:8.1f} µs, "
+              f"after {after * 1e6:8.1f} µs ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
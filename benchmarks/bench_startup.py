@@ -0,0 +1,123 @@
+# benchmarks/bench_startup.py
+"""
+冷启动耗时 (扩容时新实例多久能接流量)
+
+- import: 在新的解释器中导入 api.main 的耗时, 以及是否导入了 boto3 / gradio
+- listening: 启动 uvicorn 到端口开始响应 (/api/v1/health 返回任意状态码) 的耗时
+- ready: 启动 uvicorn 到 /api/v1/health 返回 200 (lifespan 创建服务对象并完成预热) 的耗时
+
+使用离线 Bedrock 模拟, 不需要网络; 每项取 --runs 次的中位数。
+
+用法: python -m benchmarks.bench_startup [--runs 5] [--port 8766] [--greetings]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import api.main
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "boto3": "boto3" in sys.modules, "gradio": "gradio" in sys.modules}))
+"""
+
+
+def make_env(workdir: Path, greetings: bool) -> dict:
+    env_file = workdir / ".env"
+    env_file.write_text(
+        "AWS_ACCESS_KEY_ID=AKIAFAKEFAKEFAKE0000\n"
+        "AWS_SECRET_ACCESS_KEY=fakefakefakefakefakefake\n"
+        "AWS_REGION=us-west-2\n"
+    )
+    return {
+        **os.environ,
+        "ENV_FILE": str(env_file),
+        "BEDROCK_BACKEND": "fake",
+        "FAKE_BEDROCK_LATENCY": "0.05",
+        "REGISTRY_SQLITE_PATH": str(workdir / "registry.db"),
+        "RESPONSE_CACHE_ENABLED": "true" if greetings else os.getenv("RESPONSE_CACHE_ENABLED", "false"),
+        "WARMUP_GREETINGS": "true" if greetings else "false",
+        "LOG_LEVEL": "WARNING",
+    }
+
+
+def measure_import(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_ready(env: dict, port: int, timeout: float = 60) -> tuple:
+    """启动 uvicorn, 返回 (开始响应的耗时, 就绪的耗时)"""
+    url = f"http://127.0.0.1:{port}/api/v1/health"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    listening = None
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with code {server.returncode}")
+            try:
+                status = httpx.get(url, timeout=1).status_code
+            except httpx.HTTPError:
+                time.sleep(0.01)
+                continue
+            if listening is None:
+                listening = time.perf_counter() - start
+            if status == 200:
+                return listening, time.perf_counter() - start
+            time.sleep(0.01)
+        raise RuntimeError("server did not become ready")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start time of the API process")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--greetings", action="store_true", help="预热时生成开场白 (WARMUP_GREETINGS)")
+    args = parser.parse_args()
+
+    imports, listening, ready = [], [], []
+    modules = {}
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            env = make_env(Path(workdir), args.greetings)
+            result = measure_import(env)
+            imports.append(result["seconds"])
+            modules = {"boto3": result["boto3"], "gradio": result["gradio"]}
+
+            first, done = measure_ready(env, args.port)
+            listening.append(first)
+            ready.append(done)
+
+    print(f"runs {args.runs}, greetings {args.greetings}")
+    print(f"  import api.main  {statistics.median(imports) * 1000:>8.1f} ms   "
+          f"(boto3 imported: {modules['boto3']}, gradio imported: {modules['gradio']})")
+    print(f"  listening        {statistics.median(listening) * 1000:>8.1f} ms")
+    print(f"  ready            {statistics.median(ready) * 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
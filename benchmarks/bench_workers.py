@@ -0,0 +1,102 @@
+# benchmarks/bench_workers.py
+"""
+吞吐随 worker 数的变化
+
+对每个 worker 数用 gunicorn.conf.py 启动服务 (离线 Bedrock 模拟, 会话保存在共享的 SQLite 文件),
+用 load_test 以固定 RPS 压测, 输出吞吐和延迟分位数; 结束时发送 SIGTERM 检查优雅关闭。
+目标 RPS 应高于单个 worker 的处理能力, 否则各行结果相同。
+
+用法: python -m benchmarks.bench_workers [--workers 1 2 4 8] [--rps 1500] [--duration 20]
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+
+from benchmarks.load_test import run_load  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def start_server(workers: int, port: int, workdir: Path, latency: float) -> subprocess.Popen:
+    env_file = workdir / ".env"
+    env_file.write_text(
+        "AWS_ACCESS_KEY_ID=AKIAFAKEFAKEFAKE0000\n"
+        "AWS_SECRET_ACCESS_KEY=fakefakefakefakefakefake\n"
+        "AWS_REGION=us-west-2\n"
+    )
+    env = {
+        **os.environ,
+        "ENV_FILE": str(env_file),
+        "BEDROCK_BACKEND": "fake",
+        "FAKE_BEDROCK_LATENCY": str(latency),
+        "SESSION_SQLITE_PATH": str(workdir / "sessions.db"),
+        "LOG_LEVEL": "WARNING",
+        "WORKERS": str(workers),
+        "BIND": f"127.0.0.1:{port}",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/api/v1/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+async def drive(url: str, args: argparse.Namespace):
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=url, limits=limits) as client:
+        return await run_load(client, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput vs. gunicorn worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--rps", type=float, default=1500)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="离线模拟的延迟 (秒)")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    load_args = argparse.Namespace(path="/api/v1/chat", rps=args.rps, duration=args.duration,
+                                   timeout=60, seed=0)
+
+    print(f"cpus {os.cpu_count()}, target rps {args.rps}, fake latency {args.latency}s")
+    print(f"  {'workers':>7} {'throughput':>10} {'errors':>7} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'drain':>6}")
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as workdir:
+            url = f"http://127.0.0.1:{args.port}"
+            server = start_server(workers, args.port, Path(workdir), args.latency)
+            try:
+                wait_ready(url)
+                result = asyncio.run(drive(url, load_args))
+            finally:
+                server.send_signal(signal.SIGTERM)
+                start = time.monotonic()
+                server.wait(timeout=60)
+                drain = time.monotonic() - start
+        print(f"  {workers:>7} {result['throughput']:>10} {result['error_rate']:>7} "
+              f"{result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} {drain:>5.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# benchmarks/load_test.py
+"""
+/api/v1/chat 端到端压测
+
+以目标 RPS 开环发送请求 (到达时间服从泊松分布, 不因响应变慢而降速),
+请求在多个角色和不同长度的历史之间随机混合, 统计 p50/p95/p99 延迟、吞吐和错误率。
+
+默认在进程内启动服务并使用离线 Bedrock 模拟 (BEDROCK_BACKEND=fake), 不需要网络和 AWS 账号;
+指定 --url 时压测已启动的服务 (例如 http://localhost:8000)。
+指定 --replay 时按顺序循环发送对话记录 (CONVERSATION_LOG_PATH) 中的请求, 代替随机生成。
+
+用法:
+    python -m benchmarks.load_test [--rps 200] [--duration 30] [--latency 0.5 --sigma 0.4]
+    python -m benchmarks.load_test --output after.json --baseline before.json
+    python -m benchmarks.load_test --replay conversations.db
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+
+PERSONAS = [
+    ("Kai", "Professional surfer and ocean conservationist", "Adventurous, charming, playful"),
+    ("Luna", "Night-shift barista who writes poetry", "Dreamy, witty, a little sarcastic"),
+    ("Jake", "Bass player in a local band", "Spontaneous, flirty"),
+    ("Mia", "Medical student studying for finals", "Smart, caring, easily flustered"),
+    ("Leo", "Chef running a tiny ramen shop", "Warm, teasing, confident"),
+    ("Zoe", "Game streamer with a big following", "Chaotic, funny, competitive"),
+]
+
+SCENES = [
+    ("a beach bonfire at sunset", "relaxed"),
+    ("a rainy café after closing", "cozy"),
+    ("backstage after a gig", "excited"),
+    ("a late-night library", "tired"),
+]
+
+LINES = [
+    "hey, what are you up to?",
+    "lol that's so you",
+    "wanna grab food later?",
+    "i can't stop thinking about last night",
+    "tell me something nobody knows about you",
+    "ok that made me blush",
+    "you're trouble, aren't you",
+    "what's your favorite song rn?",
+]
+
+# 历史长度 (轮数) 及其权重: 多数是新对话或短对话, 少数长对话
+HISTORY_TURNS = [0, 2, 6, 20, 60]
+HISTORY_WEIGHTS = [35, 30, 20, 10, 5]
+
+
+def make_payload(rng: random.Random) -> Dict[str, Any]:
+    """随机生成一个聊天请求"""
+    name, background, personality = rng.choice(PERSONAS)
+    description, mood = rng.choice(SCENES)
+    turns = rng.choices(HISTORY_TURNS, weights=HISTORY_WEIGHTS)[0]
+
+    history = []
+    for _ in range(turns):
+        history.append({"role": "user", "content": rng.choice(LINES)})
+        history.append({"role": "assistant", "content": rng.choice(LINES)})
+
+    return {
+        "character": {"name": name, "background": background, "personality": personality},
+        "scene": {"description": description, "mood": mood},
+        "message": rng.choice(LINES),
+        "message_history": history,
+        "use_cache": False
+    }
+
+
+def load_replay(path: str, limit: int = 0) -> List[Dict[str, Any]]:
+    """读取对话记录, 还原为请求 (按记录顺序)"""
+    from service.conversation_log import ConversationLog
+
+    log = ConversationLog(path)
+    payloads: List[Dict[str, Any]] = []
+    after_id = 0
+    while not limit or len(payloads) < limit:
+        records = log.read(after_id=after_id, limit=1000)
+        if not records:
+            break
+        for record in records:
+            if record["request"]:
+                payloads.append(dict(record["request"], message=record["message"], use_cache=False))
+        after_id = records[-1]["id"]
+    log.close()
+    if not payloads:
+        raise SystemExit(f"no replayable records in {path}")
+    return payloads[:limit] if limit else payloads
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+def prepare_in_process(args: argparse.Namespace) -> Any:
+    """配置离线模拟并在进程内加载服务"""
+    os.environ.setdefault("BEDROCK_BACKEND", "fake")
+    os.environ["FAKE_BEDROCK_LATENCY"] = str(args.latency)
+    os.environ["FAKE_BEDROCK_LATENCY_SIGMA"] = str(args.sigma)
+    os.environ["FAKE_BEDROCK_THROTTLE_RATE"] = str(args.throttle_rate)
+
+    if "ENV_FILE" not in os.environ and not Path(".env").exists():
+        # 离线模拟不会使用凭证, 但 SecurityConfig 要求配置存在
+        env_file = Path(tempfile.mkdtemp()) / ".env"
+        env_file.write_text(
+            "AWS_ACCESS_KEY_ID=AKIAFAKEFAKEFAKE0000\n"
+            "AWS_SECRET_ACCESS_KEY=fakefakefakefakefakefake\n"
+            "AWS_REGION=us-west-2\n"
+        )
+        os.environ["ENV_FILE"] = str(env_file)
+
+    from fastapi import FastAPI
+    from api import main as api_main
+    from api.main import app as api_app
+
+    # 进程内运行不经过 lifespan, 直接创建服务对象
+    api_main.init_services()
+
+    # 与 main.py 相同的挂载方式
+    app = FastAPI()
+    app.mount("/api/v1", api_app)
+
+    # 每个请求的调试日志会明显拖慢压测
+    logging.getLogger().setLevel(logging.WARNING)
+    return app
+
+
+async def run_load(client: httpx.AsyncClient, args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    replay = load_replay(args.replay) if getattr(args, "replay", "") else None
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    tasks = []
+
+    async def one(payload: Dict[str, Any]):
+        start = time.perf_counter()
+        try:
+            response = await client.post(args.path, json=payload, timeout=args.timeout)
+            statuses[str(response.status_code)] += 1
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            statuses[type(e).__name__] += 1
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    next_at = start
+    end = start + args.duration
+    while next_at < end:
+        delay = next_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        payload = replay[len(tasks) % len(replay)] if replay else make_payload(rng)
+        tasks.append(asyncio.ensure_future(one(payload)))
+        next_at += rng.expovariate(args.rps)
+
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - start
+
+    total = len(tasks)
+    ok = statuses.get("200", 0)
+    return {
+        "target_rps": args.rps,
+        "duration": round(elapsed, 2),
+        "requests": total,
+        "throughput": round(ok / elapsed, 2),
+        "error_rate": round((total - ok) / total, 4) if total else 0.0,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        "statuses": dict(statuses)
+    }
+
+
+def print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    keys = ["requests", "throughput", "error_rate", "p50_ms", "p95_ms", "p99_ms"]
+    print(f"target rps {result['target_rps']}, duration {result['duration']}s")
+    for key in keys:
+        line = f"  {key:<11} {result[key]}"
+        if baseline and baseline.get(key) is not None and result[key] is not None:
+            line += f"  (baseline {baseline[key]}, {result[key] - baseline[key]:+.4g})"
+        print(line)
+    print(f"  statuses    {result['statuses']}")
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, limits=limits)
+    else:
+        app = prepare_in_process(args)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                   base_url="http://test", limits=limits)
+    async with client:
+        return await run_load(client, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/v1/chat")
+    parser.add_argument("--url", default="", help="压测已启动的服务, 默认进程内 + 离线模拟")
+    parser.add_argument("--path", default="/api/v1/chat")
+    parser.add_argument("--rps", type=float, default=100)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--latency", type=float, default=0.5, help="离线模拟的延迟中位数 (秒)")
+    parser.add_argument("--sigma", type=float, default=0.4, help="离线模拟延迟的对数正态 sigma")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="离线模拟的限流比例")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", default="", help="回放对话记录 (SQLite 文件) 中的请求")
+    parser.add_argument("--output", default="", help="把结果写入 JSON 文件 (作为之后的基线)")
+    parser.add_argument("--baseline", default="", help="与之前的结果对比")
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    print_report(result, baseline)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
 # config/__init__.py
 
-import logging
+from utils.logging_pipeline import setup_logging
+from .settings import Settings
+
+
+def configure_logging():
+    """按 LOG_* 配置日志 (队列 + 后台线程输出, 不阻塞请求)"""
+    settings = Settings()
+    setup_logging(
+        level=settings.log_level,
+        fmt=settings.log_format,
+        queue_size=settings.log_queue_size,
+        payload_max_chars=settings.log_payload_max_chars,
+        payload_sampling=settings.log_payload_sampling,
+        payload_default_rate=settings.log_payload_sample_rate
+    )
+
 
 # 配置日志
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()  # 输出到控制台
-    ]
-)
\ No newline at end of file
+configure_logging()
@@ -1,17 +1,34 @@
 import os
 from dotenv import load_dotenv
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 import logging
 
 
+def load_env() -> bool:
+    """
+    加载 .env 中的环境变量 (路径规则与 SecurityConfig 相同), 文件不存在时不报错
+
+    只读取配置, 不验证凭证; 用于在导入时尽早读取 Settings (例如中间件的开关)。
+
+    Returns:
+        bool: 是否找到并加载了 .env 文件
+    """
+    env_path = os.getenv('ENV_FILE') or Path(__file__).resolve().parent.parent / '.env'
+    if not Path(env_path).exists():
+        return False
+    load_dotenv(env_path)
+    return True
+
+
 class SecurityConfig:
     def __init__(self, env_path: Optional[str] = None):
         """
         初始化安全配置
         Args:
-            env_path: .env 文件路径，默认为项目根目录的 .env 文件
+            env_path: .env 文件路径，默认读取环境变量 ENV_FILE，否则为项目根目录的 .env 文件
         """
+        env_path = env_path or os.getenv('ENV_FILE')
         if env_path:
             load_dotenv(env_path)
         else:
@@ -77,9 +94,36 @@ class SecurityConfig:
         """API 访问密钥"""
         return os.getenv('API_KEY', '')
 
+    @property
+    def api_keys(self) -> Dict[str, str]:
+        """
+        API 密钥到租户名的映射
+
+        API_KEYS 为逗号分隔的 "租户:密钥"; 单独配置的 API_KEY 对应租户 "default"。
+        """
+        tenants = {}
+        if self.api_key:
+            tenants[self.api_key] = "default"
+        for entry in os.getenv('API_KEYS', '').split(','):
+            tenant, _, key = entry.partition(':')
+            if tenant.strip() and key.strip():
+                tenants[key.strip()] = tenant.strip()
+        return tenants
+
     def __str__(self) -> str:
         """安全地打印配置信息"""
         return (
             f"AWS Region: {self.aws_region}\n"
             f"AWS Access Key ID: {self.aws_access_key_id[:4]}..."
-        )
\ No newline at end of file
+        )
+
+
+_security_config: Optional[SecurityConfig] = None
+
+
+def get_security_config() -> SecurityConfig:
+    """进程内共享的安全配置 (首次调用时加载 .env 并验证凭证)"""
+    global _security_config
+    if _security_config is None:
+        _security_config = SecurityConfig()
+    return _security_config
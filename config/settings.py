@@ -0,0 +1,400 @@
+import os
+from typing import Dict, List, Tuple
+
+
+class Settings:
+    """
+    运行参数配置
+
+    所有参数都从环境变量读取 (.env 由 load_env 或 SecurityConfig 加载), 每次访问时实时读取,
+    方便在测试或运行中调整。
+    """
+
+    @property
+    def log_level(self) -> str:
+        """日志级别"""
+        return os.getenv('LOG_LEVEL', 'INFO')
+
+    @property
+    def log_format(self) -> str:
+        """日志格式: "text" 或 "json" (每行一条 JSON 记录)"""
+        return os.getenv('LOG_FORMAT', 'text').lower()
+
+    @property
+    def log_queue_size(self) -> int:
+        """日志队列长度, 满时丢弃新记录而不阻塞请求"""
+        return int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+    @property
+    def log_payload_max_chars(self) -> int:
+        """请求体/响应日志的最大字符数, 0 表示不截断"""
+        return int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '2000'))
+
+    @property
+    def log_payload_sample_rate(self) -> float:
+        """请求体/响应日志的默认采样比例"""
+        return float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '1.0'))
+
+    @property
+    def log_payload_sampling(self) -> Dict[str, float]:
+        """
+        各类别请求体/响应日志的采样比例
+
+        LOG_PAYLOAD_SAMPLING 为逗号分隔的 "类别=比例", 例如 "request=0.01,response=0.05";
+        类别有 request (请求体)、response (模型响应)、stream_request (流式请求体)。
+        """
+        rates = {}
+        for entry in os.getenv('LOG_PAYLOAD_SAMPLING', '').split(','):
+            category, _, rate = entry.partition('=')
+            if category.strip() and rate.strip():
+                rates[category.strip()] = float(rate)
+        return rates
+
+    @property
+    def bedrock_max_concurrency(self) -> int:
+        """单个 worker 内同时在途的 Bedrock 调用上限"""
+        return int(os.getenv('BEDROCK_MAX_CONCURRENCY', '256'))
+
+    @property
+    def bedrock_model_id(self) -> str:
+        """默认模型 ID"""
+        return os.getenv('BEDROCK_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0')
+
+    def bedrock_endpoints(self, default_region: str) -> List[Tuple[str, str]]:
+        """
+        Bedrock 端点列表
+
+        BEDROCK_ENDPOINTS 为逗号分隔的 "区域" 或 "区域=模型ID",
+        例如 "us-west-2,us-east-1=us.anthropic.claude-3-haiku-20240307-v1:0"。
+        未配置时只使用 default_region 和默认模型。
+
+        Returns:
+            List[Tuple[str, str]]: [(区域, 模型 ID)]
+        """
+        endpoints = []
+        for entry in os.getenv('BEDROCK_ENDPOINTS', '').split(','):
+            entry = entry.strip()
+            if not entry:
+                continue
+            region, _, model_id = entry.partition('=')
+            endpoints.append((region.strip(), model_id.strip() or self.bedrock_model_id))
+        return endpoints or [(default_region, self.bedrock_model_id)]
+
+    @property
+    def prompt_caching(self) -> str:
+        """Bedrock 提示词缓存: auto (模型支持时开启), true (总是开启), false (关闭)"""
+        return os.getenv('PROMPT_CACHING', 'auto').lower()
+
+    @property
+    def bedrock_endpoint_url(self) -> str:
+        """自定义 bedrock-runtime 地址 (例如本地模拟服务), 为空时使用 AWS 默认地址"""
+        return os.getenv('BEDROCK_ENDPOINT_URL', '')
+
+    @property
+    def bedrock_backend(self) -> str:
+        """模型后端: "bedrock" 调用 AWS, "fake" 使用进程内的离线模拟 (压测用)"""
+        return os.getenv('BEDROCK_BACKEND', 'bedrock').lower()
+
+    @property
+    def fake_bedrock_latency(self) -> float:
+        """离线模拟的延迟中位数 (秒), 流式调用时为首个 token 的延迟"""
+        return float(os.getenv('FAKE_BEDROCK_LATENCY', '0.5'))
+
+    @property
+    def fake_bedrock_latency_sigma(self) -> float:
+        """离线模拟延迟的对数正态 sigma, 0 表示固定延迟"""
+        return float(os.getenv('FAKE_BEDROCK_LATENCY_SIGMA', '0'))
+
+    @property
+    def fake_bedrock_throttle_rate(self) -> float:
+        """离线模拟返回 ThrottlingException 的概率"""
+        return float(os.getenv('FAKE_BEDROCK_THROTTLE_RATE', '0'))
+
+    @property
+    def fake_bedrock_token_delay(self) -> float:
+        """离线模拟流式输出每个片段之间的延迟 (秒)"""
+        return float(os.getenv('FAKE_BEDROCK_TOKEN_DELAY', '0.02'))
+
+    @property
+    def hedge_requests(self) -> bool:
+        """首选端点超过 p95 未返回时是否向次优端点发送对冲请求"""
+        return os.getenv('HEDGE_REQUESTS', 'false').lower() in ('1', 'true', 'yes')
+
+    @property
+    def hedge_min_delay(self) -> float:
+        """发送对冲请求前的最短等待时间 (秒)"""
+        return float(os.getenv('HEDGE_MIN_DELAY', '0.05'))
+
+    @property
+    def bedrock_min_concurrency(self) -> int:
+        """限流时自适应并发上限可缩减到的最小值"""
+        return int(os.getenv('BEDROCK_MIN_CONCURRENCY', '4'))
+
+    @property
+    def bedrock_max_queue(self) -> int:
+        """等待并发名额的最大排队数, 超出时返回 429"""
+        return int(os.getenv('BEDROCK_MAX_QUEUE', '1000'))
+
+    @property
+    def bedrock_batch_max_queue(self) -> int:
+        """排队数达到多少时拒绝 batch 优先级的调用 (为 interactive 保留排队空间)"""
+        return int(os.getenv('BEDROCK_BATCH_MAX_QUEUE', str(self.bedrock_max_queue // 2)))
+
+    @property
+    def tenant_weights(self) -> Dict[str, float]:
+        """
+        各租户的调度权重
+
+        TENANT_WEIGHTS 为逗号分隔的 "租户=权重", 例如 "web=4,partner=1"; 未列出的租户权重为 1。
+        """
+        weights = {}
+        for entry in os.getenv('TENANT_WEIGHTS', '').split(','):
+            tenant, _, weight = entry.partition('=')
+            if tenant.strip() and weight.strip():
+                weights[tenant.strip()] = float(weight)
+        return weights
+
+    @property
+    def bedrock_max_retries(self) -> int:
+        """限流等暂时性错误的最大重试次数"""
+        return int(os.getenv('BEDROCK_MAX_RETRIES', '3'))
+
+    @property
+    def bedrock_retry_base_delay(self) -> float:
+        """重试退避的基础时间 (秒)"""
+        return float(os.getenv('BEDROCK_RETRY_BASE_DELAY', '0.25'))
+
+    @property
+    def bedrock_retry_max_delay(self) -> float:
+        """单次重试退避的最长时间 (秒)"""
+        return float(os.getenv('BEDROCK_RETRY_MAX_DELAY', '8'))
+
+    @property
+    def circuit_failure_threshold(self) -> int:
+        """连续失败多少次后熔断"""
+        return int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '20'))
+
+    @property
+    def circuit_reset_seconds(self) -> float:
+        """熔断后多久放行试探请求 (秒)"""
+        return float(os.getenv('CIRCUIT_RESET_SECONDS', '30'))
+
+    @property
+    def server_timing(self) -> bool:
+        """是否在响应中附带各阶段耗时的 Server-Timing 头"""
+        return os.getenv('SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes')
+
+    @property
+    def session_max_count(self) -> int:
+        """服务端保存的最大会话数"""
+        return int(os.getenv('SESSION_MAX_COUNT', '10000'))
+
+    @property
+    def session_max_bytes(self) -> int:
+        """所有会话历史的总大小上限 (字节)"""
+        return int(os.getenv('SESSION_MAX_BYTES', str(64 * 1024 * 1024)))
+
+    @property
+    def session_ttl_seconds(self) -> float:
+        """会话空闲过期时间 (秒)"""
+        return float(os.getenv('SESSION_TTL_SECONDS', '1800'))
+
+    @property
+    def session_sqlite_path(self) -> str:
+        """会话存储的 SQLite 文件路径 (多个 worker 共享), 为空时保存在进程内存中"""
+        return os.getenv('SESSION_SQLITE_PATH', '')
+
+    @property
+    def shutdown_timeout(self) -> float:
+        """关闭时等待在途 Bedrock 调用完成的最长时间 (秒)"""
+        return float(os.getenv('SHUTDOWN_TIMEOUT', '25'))
+
+    @property
+    def max_input_tokens(self) -> int:
+        """默认输入 token 预算 (系统提示词 + 历史 + 当前消息)"""
+        return int(os.getenv('MAX_INPUT_TOKENS', '8000'))
+
+    @property
+    def prompt_cache_size(self) -> int:
+        """编译后系统提示词的缓存条数 (按角色+场景)"""
+        return int(os.getenv('PROMPT_CACHE_SIZE', '1024'))
+
+    @property
+    def response_cache_enabled(self) -> bool:
+        """是否启用模型回复缓存"""
+        return os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+    @property
+    def response_cache_size(self) -> int:
+        """内存中缓存的回复键数"""
+        return int(os.getenv('RESPONSE_CACHE_SIZE', '10000'))
+
+    @property
+    def response_cache_ttl_seconds(self) -> float:
+        """回复缓存过期时间 (秒)"""
+        return float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+
+    @property
+    def response_cache_variants(self) -> int:
+        """每个缓存键保存的回复条数"""
+        return int(os.getenv('RESPONSE_CACHE_VARIANTS', '3'))
+
+    @property
+    def response_cache_sqlite_path(self) -> str:
+        """回复缓存的 SQLite 文件路径, 为空时只使用内存"""
+        return os.getenv('RESPONSE_CACHE_SQLITE_PATH', '')
+
+    @property
+    def conversation_log_path(self) -> str:
+        """对话记录的 SQLite 文件路径, 为空时不记录"""
+        return os.getenv('CONVERSATION_LOG_PATH', '')
+
+    @property
+    def conversation_log_queue_size(self) -> int:
+        """等待写入的最大对话记录数, 超出时丢弃"""
+        return int(os.getenv('CONVERSATION_LOG_QUEUE_SIZE', '10000'))
+
+    @property
+    def conversation_log_batch_size(self) -> int:
+        """对话记录单个事务写入的最大条数"""
+        return int(os.getenv('CONVERSATION_LOG_BATCH_SIZE', '256'))
+
+    @property
+    def moderation_backend(self) -> str:
+        """内容审核后端: 为空不审核, "keyword" 本地关键词/正则, "aliyun" 阿里云内容安全"""
+        return os.getenv('MODERATION_BACKEND', '').lower()
+
+    @property
+    def moderation_patterns(self) -> List[str]:
+        """关键词审核的正则表达式 (MODERATION_KEYWORDS 逗号分隔, 或 MODERATION_KEYWORDS_FILE 每行一条)"""
+        patterns = [p.strip() for p in os.getenv('MODERATION_KEYWORDS', '').split(',') if p.strip()]
+        path = os.getenv('MODERATION_KEYWORDS_FILE', '')
+        if path:
+            with open(path, encoding='utf-8') as f:
+                patterns += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        return patterns
+
+    @property
+    def moderation_check_output(self) -> bool:
+        """是否审核模型输出 (流式输出边生成边审核)"""
+        return os.getenv('MODERATION_CHECK_OUTPUT', 'true').lower() in ('1', 'true', 'yes')
+
+    @property
+    def moderation_timeout(self) -> float:
+        """单次审核的超时时间 (秒)"""
+        return float(os.getenv('MODERATION_TIMEOUT', '2'))
+
+    @property
+    def moderation_fail_open(self) -> bool:
+        """审核服务出错或超时时是否放行"""
+        return os.getenv('MODERATION_FAIL_OPEN', 'true').lower() in ('1', 'true', 'yes')
+
+    @property
+    def moderation_cache_size(self) -> int:
+        """缓存的审核结果条数"""
+        return int(os.getenv('MODERATION_CACHE_SIZE', '10000'))
+
+    @property
+    def moderation_cache_ttl_seconds(self) -> float:
+        """审核结果缓存时间 (秒)"""
+        return float(os.getenv('MODERATION_CACHE_TTL_SECONDS', '3600'))
+
+    @property
+    def moderation_stream_interval(self) -> int:
+        """流式输出每新增多少字符审核一次已生成的内容 (结束时总会审核完整回复)"""
+        return int(os.getenv('MODERATION_STREAM_INTERVAL', '200'))
+
+    @property
+    def aliyun_access_key_id(self) -> str:
+        """阿里云 AccessKey ID (内容安全)"""
+        return os.getenv('ALIBABA_CLOUD_ACCESS_KEY_ID', '')
+
+    @property
+    def aliyun_access_key_secret(self) -> str:
+        """阿里云 AccessKey Secret (内容安全)"""
+        return os.getenv('ALIBABA_CLOUD_ACCESS_KEY_SECRET', '')
+
+    @property
+    def aliyun_green_region(self) -> str:
+        """阿里云内容安全的服务区域"""
+        return os.getenv('ALIYUN_GREEN_REGION', 'cn-shanghai')
+
+    @property
+    def registry_sqlite_path(self) -> str:
+        """角色/场景注册表的 SQLite 文件路径 (多个 worker 共享), 为空时保存在进程内存中"""
+        return os.getenv('REGISTRY_SQLITE_PATH', '')
+
+    @property
+    def registry_cache_size(self) -> int:
+        """进程内缓存的注册表记录条数"""
+        return int(os.getenv('REGISTRY_CACHE_SIZE', '1024'))
+
+    @property
+    def registry_cache_ttl_seconds(self) -> float:
+        """注册表缓存过期时间 (秒), 即其他 worker 写入的新版本最多延迟多久可见"""
+        return float(os.getenv('REGISTRY_CACHE_TTL_SECONDS', '5'))
+
+    @property
+    def warmup_enabled(self) -> bool:
+        """启动时是否预热 (建立连接、渲染提示词、可选的开场白)"""
+        return os.getenv('WARMUP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+    @property
+    def warmup_connections(self) -> int:
+        """预热时向每个 Bedrock 端点预先建立的连接数"""
+        return int(os.getenv('WARMUP_CONNECTIONS', '4'))
+
+    @property
+    def warmup_greetings(self) -> bool:
+        """预热时是否为每个角色+场景预先生成开场白 (写入回复缓存, 需启用 RESPONSE_CACHE_ENABLED)"""
+        return os.getenv('WARMUP_GREETINGS', 'false').lower() in ('1', 'true', 'yes')
+
+    @property
+    def warmup_greeting_message(self) -> str:
+        """开场白对应的用户消息 (与 Web 界面开始对话时发送的相同)"""
+        return os.getenv('WARMUP_GREETING_MESSAGE', '你好')
+
+    @property
+    def warmup_concurrency(self) -> int:
+        """预热生成开场白的并发数"""
+        return int(os.getenv('WARMUP_CONCURRENCY', '4'))
+
+    @property
+    def warmup_timeout(self) -> float:
+        """预热的最长时间 (秒), 超时后仍标记为就绪"""
+        return float(os.getenv('WARMUP_TIMEOUT', '60'))
+
+    @property
+    def ws_max_connections(self) -> int:
+        """每个 worker 进程的最大 WebSocket 连接数, 超出时以 1013 关闭新连接"""
+        return int(os.getenv('WS_MAX_CONNECTIONS', '1000'))
+
+    @property
+    def ws_heartbeat_interval(self) -> float:
+        """WebSocket 心跳间隔 (秒), 连续两个间隔没有收到任何消息时断开连接"""
+        return float(os.getenv('WS_HEARTBEAT_INTERVAL', '20'))
+
+    @property
+    def ws_max_pending(self) -> int:
+        """每个 WebSocket 连接排队等待回复的最大消息数, 超出时返回 429 错误帧"""
+        return int(os.getenv('WS_MAX_PENDING', '4'))
+
+    @property
+    def ws_send_timeout(self) -> float:
+        """向 WebSocket 客户端发送一帧的最长时间 (秒), 超时视为客户端过慢并断开"""
+        return float(os.getenv('WS_SEND_TIMEOUT', '10'))
+
+    @property
+    def batch_max_size(self) -> int:
+        """单个批量请求的最大条数"""
+        return int(os.getenv('BATCH_MAX_SIZE', '1000'))
+
+    @property
+    def batch_max_concurrency(self) -> int:
+        """单个批量请求的最大并发数"""
+        return int(os.getenv('BATCH_MAX_CONCURRENCY', '32'))
+
+    @property
+    def coalesce_requests(self) -> bool:
+        """是否合并完全相同的在途请求 (只调用一次模型)"""
+        return os.getenv('COALESCE_REQUESTS', 'false').lower() in ('1', 'true', 'yes')
@@ -1,112 +1,454 @@
 # core/ai/claude_client.py
 
-import boto3
-import json
+import asyncio
 import logging
-from typing import List, Dict, Optional
-from config.security import SecurityConfig
+import re
+import threading
+from botocore.exceptions import ClientError
+from typing import Any, AsyncIterator, Callable, Iterator, List, Dict, Optional, Tuple
+from config.security import get_security_config
+from config.settings import Settings
+from utils import json_codec
+from utils.logging_pipeline import log_payload
+from utils.metrics import CHAT_ERRORS, record_usage, stage
+from .client_pool import ClientPool, Endpoint
+from .errors import ClaudeError, OverloadedError
+from .executor import BoundedExecutor
+from .fake_bedrock import FakeBedrockRuntime
+from .resilience import AdaptiveLimiter, CircuitBreaker, ResilientInvoker, error_code, is_throttling_error
+from .streaming import StopSequenceFilter, parse_stream_event
+
+STOP_SEQUENCE = "[END]"
+
+# 提示词缓存检查点: 请求中到此为止的前缀写入缓存 (约 5 分钟), 之后前缀相同的请求直接读取
+CACHE_CHECKPOINT = {"type": "ephemeral"}
+
+# Bedrock 上支持提示词缓存的模型 (Claude 3.5 Haiku、3.7 Sonnet 以及 Claude 4 之后的模型)
+PROMPT_CACHING_MODELS = re.compile(r"claude-(3-5-haiku|3-7-sonnet|(sonnet|opus|haiku)-\d)")
 
 
 class ClaudeClient:
-    def __init__(self):
-        """初始化 Claude 客户端"""
+    def __init__(self,
+                 bedrock: Optional[Any] = None,
+                 max_concurrency: Optional[int] = None,
+                 endpoints: Optional[List[Endpoint]] = None):
+        """
+        初始化 Claude 客户端
+
+        Args:
+            bedrock: 自定义 bedrock-runtime 客户端 (单端点), 默认按配置创建 boto3 客户端
+            max_concurrency: 同时在途的调用上限, 默认读取 BEDROCK_MAX_CONCURRENCY
+            endpoints: 自定义端点列表 (多区域), 优先于 bedrock
+        """
         try:
-            self.security_config = SecurityConfig()
-
-            # 初始化 AWS 客户端
-            self.bedrock = boto3.client(
-                service_name="bedrock-runtime",
-                aws_access_key_id=self.security_config.aws_access_key_id,
-                aws_secret_access_key=self.security_config.aws_secret_access_key,
-                region_name=self.security_config.aws_region,
+            # 与 API 层共享同一份安全配置 (只加载并验证一次)
+            self.security_config = get_security_config()
+            self.settings = Settings()
+
+            if max_concurrency is None:
+                max_concurrency = self.settings.bedrock_max_concurrency
+
+            # boto3 是同步接口, 通过有界线程池执行, 避免阻塞事件循环
+            self.executor = BoundedExecutor(max_concurrency)
+
+            # 容错层: 自适应并发 (限流时收缩, 排队按优先级和租户公平调度) + 退避重试 + 熔断
+            self.resilience = ResilientInvoker(
+                limiter=AdaptiveLimiter(
+                    initial_limit=max_concurrency,
+                    min_limit=min(self.settings.bedrock_min_concurrency, max_concurrency),
+                    max_queue=self.settings.bedrock_max_queue,
+                    batch_max_queue=self.settings.bedrock_batch_max_queue
+                ),
+                breaker=CircuitBreaker(
+                    failure_threshold=self.settings.circuit_failure_threshold,
+                    reset_timeout=self.settings.circuit_reset_seconds
+                ),
+                max_retries=self.settings.bedrock_max_retries,
+                base_delay=self.settings.bedrock_retry_base_delay,
+                max_delay=self.settings.bedrock_retry_max_delay
             )
 
-            self.model_id = "anthropic.claude-3-haiku-20240307-v1:0"
+            # 初始化端点池 (每个区域一个 AWS 客户端, 按延迟和错误率路由)
+            if endpoints is None:
+                if bedrock is not None:
+                    endpoints = [Endpoint(bedrock, self.security_config.aws_region,
+                                          self.settings.bedrock_model_id)]
+                else:
+                    endpoints = [
+                        Endpoint(self._create_bedrock(region, max_concurrency), region, model_id)
+                        for region, model_id in self.settings.bedrock_endpoints(
+                            self.security_config.aws_region
+                        )
+                    ]
+            self.pool = ClientPool(
+                endpoints,
+                hedge=self.settings.hedge_requests,
+                hedge_min_delay=self.settings.hedge_min_delay
+            )
+
+            # 按模型和 PROMPT_CACHING 决定各端点是否使用提示词缓存
+            for endpoint in endpoints:
+                endpoint.prompt_caching = self.supports_prompt_caching(endpoint.model_id)
+
+            # 主端点 (第一个配置的端点) 的客户端和模型
+            self.bedrock = self.pool.primary.client
+            self.model_id = self.pool.primary.model_id
+
+            # 采样参数 (也是响应缓存键的一部分)
+            self.sampling = {
+                "max_tokens": 52,
+                "temperature": 0.7,
+                "top_p": 0.9,
+                "stop_sequences": [STOP_SEQUENCE]
+            }
             logging.info("Claude Client initialized successfully")
 
         except Exception as e:
             logging.error(f"Failed to initialize Claude Client: {str(e)}")
             raise
 
-    async def chat(self,
+    def supports_prompt_caching(self, model_id: str) -> bool:
+        """按 PROMPT_CACHING 配置判断是否对该模型使用提示词缓存 (auto 时按模型 ID 判断)"""
+        mode = self.settings.prompt_caching
+        if mode in ("1", "true", "yes"):
+            return True
+        if mode in ("0", "false", "no"):
+            return False
+        return PROMPT_CACHING_MODELS.search(model_id) is not None
+
+    def build_body(self,
                    system_prompt: Optional[str] = None,
                    user_message: str = "",
-                   messages: Optional[List[Dict[str, str]]] = None) -> str:
+                   messages: Optional[List[Dict[str, str]]] = None,
+                   prompt_caching: bool = False) -> Dict:
         """
-        与 Claude 进行对话
+        构建 Bedrock 请求体
+
+        系统提示词放在 system 字段, 对话的开头在同一会话的各轮请求之间保持不变。
+        prompt_caching 为 True 时设置三个缓存检查点: 系统提示词 (角色、场景和回复要求)、
+        历史的最后一条和当前用户消息。下一轮请求的前缀与本轮相同, 直到本轮用户消息为止的
+        部分从缓存读取, 只有新增的消息需要处理。前缀短于模型的最小缓存长度时检查点不生效。
 
         Args:
             system_prompt: 系统提示词
             user_message: 用户消息
             messages: 历史消息列表
+            prompt_caching: 是否设置缓存检查点 (模型需要支持)
 
         Returns:
-            str: Claude 的回复
+            Dict: 请求体
         """
-        try:
-            # 准备消息列表
-            formatted_messages = []
-
-            # 处理历史消息
-            if messages:
-                for msg in messages:
-                    # 只添加 user 和 assistant 角色的消息
-                    if msg["role"] in ["user", "assistant"]:
+        # 准备消息列表
+        formatted_messages = []
+
+        # 处理历史消息 (只包含 role/content 的消息直接引用, 不再逐条复制)
+        if messages:
+            for msg in messages:
+                # 只添加 user 和 assistant 角色的消息
+                if msg["role"] in ("user", "assistant"):
+                    if len(msg) == 2:
+                        formatted_messages.append(msg)
+                    else:
                         formatted_messages.append({
                             "role": msg["role"],
                             "content": msg["content"]
                         })
 
-            # 如果有系统提示词，将其添加到用户消息中
-            current_message = user_message
-            if system_prompt:
-                current_message = f"{system_prompt}\n\n{user_message}"
+        if prompt_caching and formatted_messages:
+            # 检查点需要内容块格式, 复制最后一条历史消息而不修改会话中保存的消息
+            last = formatted_messages[-1]
+            formatted_messages[-1] = {"role": last["role"], "content": self._checkpoint(last["content"])}
 
-            # 添加当前用户消息
-            formatted_messages.append({
-                "role": "user",
-                "content": current_message
-            })
+        # 添加当前用户消息
+        formatted_messages.append({
+            "role": "user",
+            "content": self._checkpoint(user_message) if prompt_caching else user_message
+        })
 
-            # 调试日志
-            logging.debug(f"Formatted messages: {formatted_messages}")
+        # 准备请求体
+        body: Dict[str, Any] = {"anthropic_version": "bedrock-2023-05-31"}
+        if system_prompt:
+            body["system"] = self._checkpoint(system_prompt) if prompt_caching else system_prompt
+        body["messages"] = formatted_messages
+        body.update(self.sampling)
+        return body
 
-            # 准备请求体
-            body = {
-                "anthropic_version": "bedrock-2023-05-31",
-                "messages": formatted_messages,
-                "max_tokens": 52,
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "stop_sequences": ["[END]"]
-            }
+    @staticmethod
+    def _checkpoint(content: Any) -> List[Dict[str, Any]]:
+        """把消息内容转换为内容块, 并在最后一块设置缓存检查点"""
+        if isinstance(content, str):
+            return [{"type": "text", "text": content, "cache_control": CACHE_CHECKPOINT}]
+        blocks = [dict(block) for block in content]
+        blocks[-1]["cache_control"] = CACHE_CHECKPOINT
+        return blocks
 
-            # 调试信息
-            logging.debug(f"Request body: {json.dumps(body, ensure_ascii=False)}")
+    def serialize(self,
+                  system_prompt: Optional[str],
+                  user_message: str,
+                  messages: Optional[List[Dict[str, str]]]) -> Tuple[Dict, Dict[bool, bytes]]:
+        """
+        构建并序列化请求体
 
-            # 调用 API
-            response = self.bedrock.invoke_model(
-                body=json.dumps(body),
-                modelId=self.model_id,
-                accept="application/json",
-                contentType="application/json"
-            )
+        各端点的模型不一定都支持提示词缓存, 需要时分别序列化带和不带检查点的请求体。
+
+        Returns:
+            Tuple[Dict, Dict[bool, bytes]]: (请求体, {是否使用提示词缓存: 序列化后的请求体})
+        """
+        body: Dict = {}
+        payloads: Dict[bool, bytes] = {}
+        for endpoint in self.pool.endpoints:
+            if endpoint.prompt_caching not in payloads:
+                body = self.build_body(system_prompt, user_message, messages, endpoint.prompt_caching)
+                payloads[endpoint.prompt_caching] = json_codec.dumps(body)
+        return body, payloads
+
+    async def chat(self,
+                   system_prompt: Optional[str] = None,
+                   user_message: str = "",
+                   messages: Optional[List[Dict[str, str]]] = None,
+                   usage: Optional[Dict[str, Any]] = None) -> str:
+        """
+        与 Claude 进行对话
+
+        Args:
+            system_prompt: 系统提示词
+            user_message: 用户消息
+            messages: 历史消息列表
+            usage: 可选, 用于回填 Bedrock 返回的 token 用量 (包括提示词缓存的读写)
+
+        Returns:
+            str: Claude 的回复
+        """
+        try:
+            with stage("serialize"):
+                body, payloads = self.serialize(system_prompt, user_message, messages)
+
+            # 调试信息 (采样, 在日志线程中序列化)
+            with stage("log"):
+                log_payload("request", "Request body", body)
 
-            # 解析响应
-            response_body = json.loads(response.get("body").read())
-            logging.debug(f"Full response: {response_body}")
+            # 调用 API (在线程池中执行, 读取响应体也会阻塞, 一并放入线程)
+            response_body = await self.resilience.call(
+                lambda: self.pool.call(lambda endpoint: self.executor.run(
+                    self._invoke, endpoint, payloads[endpoint.prompt_caching]
+                ))
+            )
+            with stage("log"):
+                log_payload("response", "Full response", response_body)
+            if usage is not None:
+                usage.update(response_body.get("usage") or {})
 
             # 提取回复内容
             content = response_body.get("content", [{}])[0].get("text", "")
 
-            # 删除可能的停止序列
-            if content.endswith("[END]"):
-                content = content[:-5].strip()
+            # 删除可能的停止序列和结尾的空白 (与流式输出一致)
+            if content.endswith(STOP_SEQUENCE):
+                content = content[:-len(STOP_SEQUENCE)].strip()
+            content = content.rstrip()
 
             return content
 
+        except OverloadedError as e:
+            CHAT_ERRORS.inc(type=type(e).__name__)
+            raise
         except Exception as e:
+            CHAT_ERRORS.inc(type=error_code(e) or type(e).__name__)
             logging.error(f"Error in Claude chat: {str(e)}")
             if hasattr(e, 'response'):
                 logging.error(f"Response: {e.response}")
-            raise Exception(f"Claude error: {str(e)}")
\ No newline at end of file
+            raise ClaudeError(f"Claude error: {str(e)}") from e
+
+    async def chat_stream(self,
+                          system_prompt: Optional[str] = None,
+                          user_message: str = "",
+                          messages: Optional[List[Dict[str, str]]] = None,
+                          usage: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        与 Claude 进行流式对话, 逐段返回生成的文本
+
+        建立流的调用经过容错层 (限流时重试); 读取事件流的工作在线程池中进行
+        (整个流占用一个线程名额), 文本片段通过队列交给事件循环。自适应并发的名额
+        从建立流开始一直占用到流读完或关闭, 流式调用同样受并发上限和公平排队的约束。
+        调用方提前关闭生成器时 (例如客户端断开), 工作线程会在下一个事件处停止并关闭连接。
+
+        Args:
+            system_prompt: 系统提示词
+            user_message: 用户消息
+            messages: 历史消息列表
+            usage: 可选, 流结束时回填 Bedrock 返回的 token 用量
+
+        Yields:
+            str: 文本片段 (已去除停止序列)
+        """
+        with stage("serialize"):
+            body, payloads = self.serialize(system_prompt, user_message, messages)
+        with stage("log"):
+            log_payload("stream_request", "Stream request body", body)
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        release: Optional[Callable[[str], None]] = None
+
+        def on_done(t: asyncio.Future):
+            # 读取线程结束: 归还并发名额, 标记异常已读取 (需要时在下方 await task 重新抛出),
+            # 并通知读取结束
+            error = None if t.cancelled() else t.exception()
+            if error is None:
+                release("success")
+            else:
+                release("throttled" if is_throttling_error(error) else "neutral")
+            queue.put_nowait(None)
+
+        stop_filter = StopSequenceFilter(STOP_SEQUENCE)
+        try:
+            # 流式调用不对冲 (会重复生成整段回复)
+            (stream, stream_model_id), release = await self.resilience.call_and_hold(
+                lambda: self.pool.call(
+                    lambda endpoint: self.executor.run(
+                        self._open_stream, endpoint, payloads[endpoint.prompt_caching]
+                    ),
+                    hedge=False
+                )
+            )
+
+            def pump():
+                for text in self._read_stream(stream, stop, stream_model_id, usage):
+                    loop.call_soon_threadsafe(queue.put_nowait, text)
+
+            try:
+                task = asyncio.ensure_future(self.executor.run(pump))
+            except BaseException:
+                release("neutral")
+                raise
+            task.add_done_callback(on_done)
+
+            while True:
+                text = await queue.get()
+                if text is None:
+                    break
+                output = stop_filter.feed(text)
+                if output:
+                    yield output
+                if stop_filter.stopped:
+                    break
+
+            if not stop_filter.stopped:
+                # 读取结束, 检查工作线程是否出错
+                await task
+                tail = stop_filter.flush()
+                if tail:
+                    yield tail
+
+        except OverloadedError as e:
+            CHAT_ERRORS.inc(type=type(e).__name__)
+            raise
+        except Exception as e:
+            CHAT_ERRORS.inc(type=error_code(e) or type(e).__name__)
+            logging.error(f"Error in Claude chat stream: {str(e)}")
+            if hasattr(e, 'response'):
+                logging.error(f"Response: {e.response}")
+            raise ClaudeError(f"Claude error: {str(e)}") from e
+
+        finally:
+            stop.set()
+
+    async def warm_up(self, connections: int = 4) -> int:
+        """
+        预先建立到各端点的 TLS 连接
+
+        向每个端点并发发送 connections 个无效请求 (空请求体): Bedrock 立即返回
+        ValidationException, 不调用模型, 但连接留在连接池中供之后的请求复用。
+        不经过容错层, 不计入端点统计。
+
+        Returns:
+            int: 成功建立的连接数
+        """
+        results = await asyncio.gather(
+            *(self.executor.run(self._ping, endpoint)
+              for endpoint in self.pool.endpoints for _ in range(connections)),
+            return_exceptions=True
+        )
+        return sum(1 for result in results if result is True)
+
+    def _ping(self, endpoint: Endpoint) -> bool:
+        """发送一个无效请求 (在工作线程中执行), 收到服务端响应即说明连接已建立"""
+        try:
+            endpoint.client.invoke_model(
+                body=b"{}",
+                modelId=endpoint.model_id,
+                accept="application/json",
+                contentType="application/json"
+            )
+        except ClientError:
+            return True
+        except Exception as e:
+            logging.warning(f"Failed to warm up connection to {endpoint.name}: {str(e)}")
+            return False
+        return True
+
+    def _create_bedrock(self, region: str, max_concurrency: int) -> Any:
+        """创建 bedrock-runtime 客户端 (连接池大小与并发上限一致, 重试由容错层负责)"""
+        if self.settings.bedrock_backend == "fake":
+            logging.warning(f"Using offline fake Bedrock backend for {region}")
+            return FakeBedrockRuntime.from_settings(self.settings)
+
+        # boto3 导入较慢 (约 0.2s), 只在真正创建客户端时导入
+        import boto3
+        from botocore.config import Config as BotoConfig
+
+        return boto3.client(
+            service_name="bedrock-runtime",
+            aws_access_key_id=self.security_config.aws_access_key_id,
+            aws_secret_access_key=self.security_config.aws_secret_access_key,
+            region_name=region,
+            endpoint_url=self.settings.bedrock_endpoint_url or None,
+            config=BotoConfig(
+                max_pool_connections=max_concurrency,
+                retries={"mode": "standard", "max_attempts": 1}
+            ),
+        )
+
+    def _invoke(self, endpoint: Endpoint, payload: bytes) -> Dict:
+        """同步调用 invoke_model 并解析响应体 (在工作线程中执行)"""
+        with stage("bedrock"):
+            response = endpoint.client.invoke_model(
+                body=payload,
+                modelId=endpoint.model_id,
+                accept="application/json",
+                contentType="application/json"
+            )
+        with stage("parse"):
+            response_body = json_codec.loads(response.get("body").read())
+        record_usage(endpoint.model_id, response_body.get("usage"))
+        return response_body
+
+    def _open_stream(self, endpoint: Endpoint, payload: bytes) -> Any:
+        """同步调用 invoke_model_with_response_stream, 返回 (事件流, 模型 ID) (在工作线程中执行)"""
+        with stage("bedrock"):
+            response = endpoint.client.invoke_model_with_response_stream(
+                body=payload,
+                modelId=endpoint.model_id,
+                accept="application/json",
+                contentType="application/json"
+            )
+        return response.get("body"), endpoint.model_id
+
+    def _read_stream(self, stream: Any, stop: threading.Event, model_id: str = "",
+                     usage: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """逐个产出事件流中的文本, 结束或停止时关闭流并记录 token 用量 (在工作线程中执行)"""
+        stream_usage: Dict[str, int] = {}
+        try:
+            for event in stream:
+                if stop.is_set():
+                    break
+                text = parse_stream_event(event, stream_usage)
+                if text:
+                    yield text
+        finally:
+            record_usage(model_id, stream_usage)
+            if usage is not None:
+                usage.update(stream_usage)
+            if hasattr(stream, "close"):
+                stream.close()
\ No newline at end of file
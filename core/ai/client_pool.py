@@ -0,0 +1,211 @@
+# core/ai/client_pool.py
+
+import asyncio
+import logging
+import math
+import random
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+
+class Endpoint:
+    """
+    一个 Bedrock 调用端点 (区域 + 模型 ID + 对应的 bedrock-runtime 客户端)
+
+    记录最近的延迟和错误率 (EWMA) 以及最近 window 次成功调用的延迟 (用于估算 p95)。
+    """
+
+    def __init__(self, client: Any, region: str, model_id: str,
+                 alpha: float = 0.2, window: int = 200):
+        """
+        Args:
+            client: bedrock-runtime 客户端 (或测试用的替身)
+            region: 区域
+            model_id: 模型 ID
+            alpha: EWMA 平滑系数
+            window: 用于估算分位数的样本数
+        """
+        self.client = client
+        self.region = region
+        self.model_id = model_id
+        self.alpha = alpha
+        # 是否在请求中设置提示词缓存检查点 (由 ClaudeClient 按模型和配置设置)
+        self.prompt_caching = False
+
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self._latencies: Deque[float] = deque(maxlen=window)
+
+    @property
+    def name(self) -> str:
+        return f"{self.region}/{self.model_id}"
+
+    def record_success(self, latency: float):
+        self.requests += 1
+        self._latencies.append(latency)
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += self.alpha * (latency - self.latency_ewma)
+        self.error_ewma *= 1 - self.alpha
+
+    def record_error(self):
+        self.requests += 1
+        self.errors += 1
+        self.error_ewma += self.alpha * (1 - self.error_ewma)
+
+    def percentile(self, q: float, min_samples: int = 20) -> Optional[float]:
+        """最近延迟的分位数, 样本不足时返回 None"""
+        if len(self._latencies) < min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[index]
+
+    def score(self, error_penalty: float) -> float:
+        """路由评分, 越小越好 (没有样本的端点为 0, 会被优先尝试)"""
+        return (self.latency_ewma or 0.0) + self.error_ewma * error_penalty
+
+    def stats(self) -> Dict[str, Any]:
+        p50 = self.percentile(0.5, min_samples=1)
+        p95 = self.percentile(0.95, min_samples=1)
+        return {
+            "region": self.region,
+            "model_id": self.model_id,
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "latency_ewma": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+            "error_rate_ewma": round(self.error_ewma, 4),
+            "latency_p50": round(p50, 4) if p50 is not None else None,
+            "latency_p95": round(p95, 4) if p95 is not None else None
+        }
+
+
+class ClientPool:
+    """
+    多区域/多模型端点池
+
+    每次调用选择评分最好 (延迟 EWMA + 错误率惩罚) 的端点, 以 explore_ratio 的概率
+    随机选择其他端点以刷新统计。开启 hedge 时, 如果首选端点在其 p95 延迟内没有返回,
+    再向次优端点发送同样的请求, 采用先成功返回的结果。
+    """
+
+    def __init__(self,
+                 endpoints: List[Endpoint],
+                 hedge: bool = False,
+                 hedge_min_delay: float = 0.05,
+                 error_penalty: float = 10.0,
+                 explore_ratio: float = 0.02,
+                 rng: Optional[random.Random] = None):
+        """
+        Args:
+            endpoints: 端点列表
+            hedge: 是否启用对冲请求
+            hedge_min_delay: 对冲前的最短等待时间 (秒)
+            error_penalty: 错误率惩罚 (秒), 错误率 100% 相当于多出这么多延迟
+            explore_ratio: 随机探索的概率
+            rng: 随机数生成器, 便于测试
+        """
+        if not endpoints:
+            raise ValueError("ClientPool requires at least one endpoint")
+
+        self.endpoints = endpoints
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.error_penalty = error_penalty
+        self.explore_ratio = explore_ratio
+        self._rng = rng or random.Random()
+
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    @property
+    def primary(self) -> Endpoint:
+        """配置中的第一个端点"""
+        return self.endpoints[0]
+
+    def choose(self, exclude: Optional[Endpoint] = None) -> Optional[Endpoint]:
+        """选择端点"""
+        candidates = [e for e in self.endpoints if e is not exclude]
+        if not candidates:
+            return None
+        if len(candidates) > 1 and self._rng.random() < self.explore_ratio:
+            return self._rng.choice(candidates)
+        return min(candidates, key=lambda e: e.score(self.error_penalty))
+
+    async def call(self,
+                   func: Callable[[Endpoint], Awaitable[Any]],
+                   hedge: Optional[bool] = None) -> Any:
+        """
+        在选出的端点上执行调用
+
+        Args:
+            func: 接收端点并发起调用的函数
+            hedge: 是否对冲, 默认使用池的配置 (流式调用应关闭)
+
+        Returns:
+            Any: 调用结果
+        """
+        primary = self.choose()
+        if hedge is None:
+            hedge = self.hedge
+
+        delay = primary.percentile(0.95) if hedge else None
+        secondary = self.choose(exclude=primary) if delay is not None else None
+        if secondary is None:
+            return await self._attempt(primary, func)
+
+        first = asyncio.ensure_future(self._attempt(primary, func))
+        done, _ = await asyncio.wait({first}, timeout=max(delay, self.hedge_min_delay))
+        if done:
+            return first.result()
+
+        # 首选端点超过 p95 仍未返回, 向次优端点对冲
+        self.hedged += 1
+        logging.debug("Hedging request from %s to %s", primary.name, secondary.name)
+        second = asyncio.ensure_future(self._attempt(secondary, func))
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedge": self.hedge,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "endpoints": [e.stats() for e in self.endpoints]
+        }
+
+    async def _attempt(self, endpoint: Endpoint, func: Callable[[Endpoint], Awaitable[Any]]) -> Any:
+        """调用一次并记录端点统计"""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        endpoint.in_flight += 1
+        try:
+            result = await func(endpoint)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            endpoint.record_error()
+            raise
+        else:
+            endpoint.record_success(loop.time() - start)
+            return result
+        finally:
+            endpoint.in_flight -= 1
@@ -0,0 +1,39 @@
+# core/ai/errors.py
+
+
+class ClaudeError(Exception):
+    """Claude 调用失败"""
+
+
+class OverloadedError(ClaudeError):
+    """
+    服务暂时无法处理请求, 客户端应在 retry_after 秒后重试
+
+    API 层据此返回 status_code 和 Retry-After 响应头。
+    """
+
+    status_code = 429
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFullError(OverloadedError):
+    """本地等待队列已满"""
+
+
+class ThrottledError(OverloadedError):
+    """Bedrock 限流, 重试后仍然失败"""
+
+
+class CircuitOpenError(OverloadedError):
+    """熔断器打开, 暂停调用 Bedrock"""
+
+    status_code = 503
+
+
+class DeadlineExceededError(OverloadedError):
+    """请求的截止时间已过, 调用在排队中被丢弃"""
+
+    status_code = 504
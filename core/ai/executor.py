@@ -0,0 +1,84 @@
+# core/ai/executor.py
+
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class BoundedExecutor:
+    """
+    有界异步执行器
+
+    boto3 只提供同步接口, 直接在协程里调用会阻塞整个事件循环。
+    这里把阻塞调用放进专用线程池执行, 并用信号量限制同时在途的调用数,
+    超出上限的请求在事件循环上排队等待, 不占用线程。
+    """
+
+    def __init__(self, max_concurrency: int, thread_name_prefix: str = "bedrock"):
+        """
+        Args:
+            max_concurrency: 最大并发调用数 (同时也是线程池大小)
+            thread_name_prefix: 线程名前缀
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be >= 1")
+
+        self.max_concurrency = max_concurrency
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix=thread_name_prefix
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        """当前正在执行的调用数"""
+        return self._in_flight
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        在线程池中执行同步函数
+
+        调用方被取消时, 尚未开始执行的调用直接取消; 已经在线程中执行的同步调用无法中断,
+        名额保留到线程返回为止 (提前归还会让线程池在信号量之外积压任务, 并发上限失效)。
+
+        Args:
+            func: 同步函数
+            *args, **kwargs: 传给 func 的参数
+
+        Returns:
+            Any: func 的返回值
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        await self._semaphore.acquire()
+        self._in_flight += 1
+        loop = asyncio.get_running_loop()
+        try:
+            # 在调用方的 contextvars 上下文中执行 (与 asyncio.to_thread 相同)
+            future = self._pool.submit(contextvars.copy_context().run, func, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+
+        # 线程返回 (或调用被取消) 后归还名额
+        future.add_done_callback(lambda _: self._release_threadsafe(loop))
+        return await asyncio.wrap_future(future, loop=loop)
+
+    def _release(self):
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    def _release_threadsafe(self, loop: asyncio.AbstractEventLoop):
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def shutdown(self, wait: bool = True):
+        """关闭线程池"""
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,235 @@
+# core/ai/fake_bedrock.py
+
+import hashlib
+import io
+import json
+import math
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from botocore.exceptions import ClientError
+
+
+class FakeEventStream:
+    """模拟 invoke_model_with_response_stream 返回的 EventStream"""
+
+    def __init__(self, events: List[Dict], token_delay: float):
+        self._events = events
+        self._token_delay = token_delay
+        self.closed = False
+
+    def __iter__(self) -> Iterator[Dict]:
+        for event in self._events:
+            if self.closed:
+                return
+            if self._token_delay:
+                time.sleep(self._token_delay)
+            yield event
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBedrockRuntime:
+    """
+    离线的 bedrock-runtime 替身
+
+    实现 ClaudeClient 用到的 invoke_model 和 invoke_model_with_response_stream,
+    可以配置延迟分布 (固定或对数正态)、限流比例和流式输出的逐 token 延迟,
+    用于在没有网络和 AWS 账号的情况下做压测和测试。
+    请求中有缓存检查点 (cache_control) 时模拟提示词缓存, 在 usage 中返回缓存读写的 token 数。
+    """
+
+    # 模拟的提示词缓存最多保存的前缀数
+    PROMPT_CACHE_SIZE = 10000
+
+    REPLIES = [
+        "hey there 😉",
+        "hi cutie ✨",
+        "what's up? 😏",
+        "heyyy 💋",
+        "lol u wish 😜",
+        "omg same 😂"
+    ]
+
+    # 流式输出时每个片段的字符数
+    CHUNK_SIZE = 4
+
+    def __init__(self,
+                 latency: float = 0.5,
+                 latency_sigma: float = 0.0,
+                 throttle_rate: float = 0.0,
+                 token_delay: float = 0.0,
+                 text: Optional[str] = None,
+                 seed: Optional[int] = None):
+        """
+        Args:
+            latency: 延迟 (秒), 流式调用时为首个 token 的延迟; latency_sigma > 0 时为中位数
+            latency_sigma: 对数正态分布的 sigma, 0 表示固定延迟
+            throttle_rate: 返回 ThrottlingException 的概率
+            token_delay: 流式输出每个片段之间的延迟 (秒)
+            text: 固定回复, 默认从 REPLIES 中随机选择
+            seed: 随机种子
+        """
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.throttle_rate = throttle_rate
+        self.token_delay = token_delay
+        self.text = text
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.throttled = 0
+        self.last_body: Optional[Dict] = None
+        self._prompt_cache: Set[str] = set()
+
+    @classmethod
+    def from_settings(cls, settings: Any) -> "FakeBedrockRuntime":
+        """按 FAKE_BEDROCK_* 配置创建"""
+        return cls(
+            latency=settings.fake_bedrock_latency,
+            latency_sigma=settings.fake_bedrock_latency_sigma,
+            throttle_rate=settings.fake_bedrock_throttle_rate,
+            token_delay=settings.fake_bedrock_token_delay
+        )
+
+    def invoke_model(self, body: str, modelId: str,
+                     accept: str = "application/json",
+                     contentType: str = "application/json") -> Dict[str, Any]:
+        request, latency, text = self._begin(body)
+        time.sleep(latency)
+        payload = {
+            "id": f"msg_fake_{self.calls}",
+            "type": "message",
+            "role": "assistant",
+            "model": modelId,
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": self._usage(request, body, text)
+        }
+        return {
+            "body": io.BytesIO(json.dumps(payload, ensure_ascii=False).encode("utf-8")),
+            "contentType": "application/json"
+        }
+
+    def invoke_model_with_response_stream(self, body: str, modelId: str,
+                                          accept: str = "application/json",
+                                          contentType: str = "application/json") -> Dict[str, Any]:
+        request, latency, text = self._begin(body)
+        time.sleep(latency)
+
+        usage = self._usage(request, body, text)
+        output_tokens = usage.pop("output_tokens")
+        events = [self._chunk({
+            "type": "message_start",
+            "message": {"model": modelId, "usage": dict(usage, output_tokens=1)}
+        })]
+        for i in range(0, len(text), self.CHUNK_SIZE):
+            events.append(self._chunk({
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": text[i:i + self.CHUNK_SIZE]}
+            }))
+        events.append(self._chunk({
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn"},
+            "usage": {"output_tokens": output_tokens}
+        }))
+        events.append(self._chunk({"type": "message_stop"}))
+        return {"body": FakeEventStream(events, self.token_delay)}
+
+    def _begin(self, body: str):
+        """记录调用, 按配置限流, 返回 (请求体, 本次延迟, 回复)"""
+        request = json.loads(body)
+        if not request.get("messages"):
+            # 与 Bedrock 相同: 请求体无效时立即返回 ValidationException (预热连接时使用)
+            raise ClientError(
+                {"Error": {"Code": "ValidationException", "Message": "messages: field required"}},
+                "InvokeModel"
+            )
+        with self._lock:
+            self.calls += 1
+            self.last_body = request
+            throttled = self._rng.random() < self.throttle_rate
+            if throttled:
+                self.throttled += 1
+            latency = self.latency
+            if self.latency_sigma > 0:
+                latency *= math.exp(self._rng.gauss(0, self.latency_sigma))
+            text = self.text or self._rng.choice(self.REPLIES)
+
+        if throttled:
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}},
+                "InvokeModel"
+            )
+        return request, latency, text
+
+    def _usage(self, request: Dict, body: str, text: str) -> Dict[str, int]:
+        """
+        token 用量 (按 4 字符 1 token 估算), 有缓存检查点时拆分出缓存读写的部分
+
+        与 Bedrock 相同, 读取时在最后一个检查点及其之前的每个块边界上查找已缓存的前缀
+        (取最长的), 写入时缓存每个检查点处的前缀。
+        """
+        usage = {"input_tokens": max(1, len(body) // 4), "output_tokens": max(1, len(text) // 3)}
+        prefixes = self._cached_prefixes(request)
+        checkpoints = [(key, chars) for key, chars, checkpoint in prefixes if checkpoint]
+        if not checkpoints:
+            return usage
+
+        read = written = 0
+        last_key, last_chars = checkpoints[-1]
+        with self._lock:
+            for key, chars, _ in prefixes:
+                if key in self._prompt_cache:
+                    read = chars // 4
+                if key == last_key:
+                    break
+            if last_key not in self._prompt_cache:
+                written = last_chars // 4 - read
+            if len(self._prompt_cache) >= self.PROMPT_CACHE_SIZE:
+                self._prompt_cache.clear()
+            self._prompt_cache.update(key for key, _ in checkpoints)
+
+        usage["input_tokens"] = max(1, usage["input_tokens"] - read - written)
+        usage["cache_read_input_tokens"] = read
+        usage["cache_creation_input_tokens"] = written
+        return usage
+
+    @staticmethod
+    def _cached_prefixes(request: Dict) -> List[Tuple[str, int, bool]]:
+        """
+        请求在每个块边界处的前缀, 按顺序返回 (缓存键, 前缀字符数, 是否为检查点)
+
+        缓存键是前缀内容 (不含 cache_control) 的累积哈希; 字符串内容与等价的 text 块相同
+        (当前消息带检查点时是 text 块, 下一轮作为历史发送时是字符串)。
+        """
+        digest = hashlib.sha256()
+        chars = 0
+        prefixes = []
+        system = request.get("system")
+        sections = [("system", system if isinstance(system, list) else [system] if system else [])]
+        for message in request.get("messages", []):
+            content = message["content"]
+            sections.append((message["role"], content if isinstance(content, list) else [content]))
+
+        for role, content in sections:
+            for block in content:
+                checkpoint = isinstance(block, dict) and "cache_control" in block
+                if isinstance(block, dict):
+                    block = {k: v for k, v in block.items() if k != "cache_control"}
+                else:
+                    block = {"type": "text", "text": block}
+                part = json.dumps([role, block], ensure_ascii=False)
+                digest.update(part.encode("utf-8"))
+                chars += len(part)
+                prefixes.append((digest.hexdigest(), chars, checkpoint))
+        return prefixes
+
+    @staticmethod
+    def _chunk(data: Dict) -> Dict:
+        return {"chunk": {"bytes": json.dumps(data, ensure_ascii=False).encode("utf-8")}}
@@ -0,0 +1,406 @@
+# core/ai/resilience.py
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from botocore.exceptions import (
+    ConnectionClosedError,
+    EndpointConnectionError,
+    ReadTimeoutError,
+)
+
+from utils.metrics import QUEUE_WAIT_SECONDS, SHED_CALLS, stage
+from .errors import CircuitOpenError, DeadlineExceededError, QueueFullError, ThrottledError
+from .scheduler import PRIORITIES, FairQueue, current_request
+
+# Bedrock 限流错误码
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException"}
+
+# 可以重试的错误码 (服务端暂时性错误)
+RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES | {
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+}
+
+# 可以重试的网络错误
+RETRYABLE_EXCEPTIONS = (ConnectionClosedError, EndpointConnectionError, ReadTimeoutError)
+
+
+def error_code(error: BaseException) -> Optional[str]:
+    """取得 botocore ClientError 的错误码"""
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code")
+    return None
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    """是否为限流错误"""
+    return error_code(error) in THROTTLING_ERROR_CODES
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """是否为可重试的暂时性错误"""
+    return error_code(error) in RETRYABLE_ERROR_CODES or isinstance(error, RETRYABLE_EXCEPTIONS)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 自适应并发限制
+
+    每次成功把上限加 1/limit (约每轮加 1), 遇到限流时把上限乘以 backoff_ratio
+    (decrease_interval 内最多减一次, 避免同一波限流把上限压到最低)。
+
+    超出上限的请求进入加权公平队列 (FairQueue), 按当前请求的 RequestContext 排序:
+    interactive 优先于 batch, 同一优先级内按租户权重公平分配。
+    按队列深度削减负载: 排队数达到 max_queue 时拒绝新调用, batch 调用在排队数达到
+    batch_max_queue 时就被拒绝 (QueueFullError), 为 interactive 保留排队空间。
+    过了截止时间的调用不再等待, 直接丢弃 (DeadlineExceededError)。
+    """
+
+    def __init__(self,
+                 initial_limit: int,
+                 min_limit: int = 1,
+                 max_limit: Optional[int] = None,
+                 max_queue: int = 1000,
+                 batch_max_queue: Optional[int] = None,
+                 backoff_ratio: float = 0.5,
+                 decrease_interval: float = 1.0,
+                 queue_retry_after: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            initial_limit: 初始并发上限
+            min_limit: 并发上限的下限
+            max_limit: 并发上限的上限, 默认等于 initial_limit
+            max_queue: 最大排队数
+            batch_max_queue: batch 调用可以排队时的最大排队数, 默认为 max_queue 的一半
+            backoff_ratio: 限流时的缩减比例
+            decrease_interval: 两次缩减之间的最小间隔 (秒)
+            queue_retry_after: 队列满时建议客户端的重试间隔 (秒)
+            clock: 时钟函数, 便于测试
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit or initial_limit
+        self.limit = float(initial_limit)
+        self.max_queue = max_queue
+        self.batch_max_queue = max_queue // 2 if batch_max_queue is None else batch_max_queue
+        self.backoff_ratio = backoff_ratio
+        self.decrease_interval = decrease_interval
+        self.queue_retry_after = queue_retry_after
+        self._clock = clock
+        self._last_decrease = float("-inf")
+        self._waiters = FairQueue()
+
+        self.in_flight = 0
+        self.throttles = 0
+        self.rejected = 0
+        self.expired = 0
+
+    @property
+    def queued(self) -> int:
+        """排队中的请求数"""
+        return len(self._waiters)
+
+    async def acquire(self):
+        """
+        取得一个并发名额 (必要时排队)
+
+        Raises:
+            QueueFullError: 排队数超过该优先级允许的深度
+            DeadlineExceededError: 截止时间已过, 或排队到截止时间仍未取得名额
+        """
+        context = current_request()
+        priority = context.priority
+        remaining = context.remaining()
+        if remaining is not None and remaining <= 0:
+            self._shed(priority, "deadline")
+
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            QUEUE_WAIT_SECONDS.observe(0.0, priority=priority)
+            return
+
+        max_queue = self.max_queue if priority == PRIORITIES[0] else min(self.max_queue, self.batch_max_queue)
+        if len(self._waiters) >= max_queue:
+            self._shed(priority, "queue_full")
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.push(waiter, context)
+        timer = None
+        if remaining is not None:
+            timer = loop.call_later(remaining, self._expire, waiter)
+        start = loop.time()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if (not self._waiters.remove(waiter) and waiter.done()
+                    and not waiter.cancelled() and waiter.exception() is None):
+                # 名额已分配但调用方已取消, 归还名额
+                self.release("neutral")
+            raise
+        except DeadlineExceededError:
+            SHED_CALLS.inc(priority=priority, reason="deadline")
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            QUEUE_WAIT_SECONDS.observe(loop.time() - start, priority=priority)
+
+    def _shed(self, priority: str, reason: str):
+        """丢弃调用 (不排队)"""
+        SHED_CALLS.inc(priority=priority, reason=reason)
+        if reason == "deadline":
+            self.expired += 1
+            raise DeadlineExceededError("Request deadline exceeded before the model call started")
+        self.rejected += 1
+        raise QueueFullError(f"Too many pending model calls ({priority})", retry_after=self.queue_retry_after)
+
+    def _expire(self, waiter: asyncio.Future):
+        """排队到截止时间仍未取得名额"""
+        if self._waiters.remove(waiter) and not waiter.done():
+            self.expired += 1
+            waiter.set_exception(DeadlineExceededError("Request deadline exceeded while queued for the model"))
+
+    def release(self, outcome: str = "success"):
+        """
+        归还名额并调整上限
+
+        Args:
+            outcome: "success" 增加上限, "throttled" 缩减上限, "neutral" 不调整
+        """
+        self.in_flight -= 1
+
+        if outcome == "success":
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        elif outcome == "throttled":
+            self.throttles += 1
+            now = self._clock()
+            if now - self._last_decrease >= self.decrease_interval:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                self._last_decrease = now
+                logging.warning(f"Bedrock throttled, concurrency limit reduced to {int(self.limit)}")
+
+        self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "queued_by_priority": {p: self._waiters.depth(p) for p in PRIORITIES},
+            "throttles": self.throttles,
+            "rejected": self.rejected,
+            "expired": self.expired
+        }
+
+    def _wake(self):
+        """按优先级和租户公平顺序唤醒排队的请求"""
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.pop()
+            if waiter is not None and not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续 failure_threshold 次失败后打开, reset_timeout 秒内直接拒绝调用;
+    之后进入半开状态放行一次试探调用, 成功则关闭, 失败则重新打开。
+    """
+
+    def __init__(self,
+                 failure_threshold: int = 20,
+                 reset_timeout: float = 30,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def before_call(self):
+        """调用前检查, 熔断时抛出 CircuitOpenError"""
+        if self.state == "open":
+            remaining = self._opened_at + self.reset_timeout - self._clock()
+            if remaining > 0:
+                raise CircuitOpenError("Model backend temporarily unavailable", retry_after=remaining)
+            self.state = "half_open"
+            self._trial_in_flight = False
+
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                raise CircuitOpenError("Model backend temporarily unavailable", retry_after=1.0)
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self.state = "closed"
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logging.error(f"Circuit breaker opened after {self.failures} failures")
+                self.opened += 1
+            self.state = "open"
+            self._opened_at = self._clock()
+
+    def record_neutral(self):
+        """调用结果不说明后端是否健康 (限流、取消), 只释放试探名额"""
+        self._trial_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "failures": self.failures, "opened": self.opened}
+
+
+class ResilientInvoker:
+    """
+    Bedrock 调用的容错层: 熔断 -> 自适应并发 -> 调用 -> 失败时指数退避重试
+
+    重试使用 full jitter: 第 n 次重试前等待 uniform(0, min(max_delay, base_delay * 2^n)) 秒;
+    请求有截止时间且等待后已经超时的, 不再重试 (抛出 DeadlineExceededError)。
+    """
+
+    def __init__(self,
+                 limiter: AdaptiveLimiter,
+                 breaker: CircuitBreaker,
+                 max_retries: int = 3,
+                 base_delay: float = 0.25,
+                 max_delay: float = 8.0,
+                 rng: Optional[random.Random] = None):
+        """
+        Args:
+            limiter: 自适应并发限制
+            breaker: 熔断器
+            max_retries: 最大重试次数
+            base_delay: 退避基础时间 (秒)
+            max_delay: 单次退避的最长时间 (秒)
+            rng: 随机数生成器, 便于测试
+        """
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = rng or random.Random()
+
+        self.retries = 0
+
+    async def call(self, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行调用
+
+        Args:
+            func: 创建一次调用的函数 (每次重试重新调用)
+
+        Returns:
+            Any: 调用结果
+        """
+        result, _ = await self._call(func, hold=False)
+        return result
+
+    async def call_and_hold(self, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, Callable[[str], None]]:
+        """
+        执行调用, 成功后继续占用并发名额 (用于流式调用: 名额一直占用到流读完或关闭)
+
+        Args:
+            func: 创建一次调用的函数 (每次重试重新调用)
+
+        Returns:
+            Tuple[Any, Callable[[str], None]]: (调用结果, release(outcome)); release 必须调用一次,
+            outcome 同 AdaptiveLimiter.release
+        """
+        return await self._call(func, hold=True)
+
+    async def _call(self, func: Callable[[], Awaitable[Any]],
+                    hold: bool) -> Tuple[Any, Optional[Callable[[str], None]]]:
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                with stage("queue"):
+                    await self.limiter.acquire()
+            except BaseException:
+                self.breaker.record_neutral()
+                raise
+
+            try:
+                result = await func()
+            except asyncio.CancelledError:
+                self.limiter.release("neutral")
+                self.breaker.record_neutral()
+                raise
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                retryable = is_retryable_error(e)
+                self.limiter.release("throttled" if throttled else "neutral")
+
+                if throttled:
+                    self.breaker.record_neutral()
+                elif retryable:
+                    self.breaker.record_failure()
+                else:
+                    # 请求本身的问题 (参数错误等), 后端是正常的
+                    self.breaker.record_success()
+
+                if not retryable:
+                    raise
+                if attempt >= self.max_retries:
+                    if throttled:
+                        raise ThrottledError(
+                            f"Bedrock throttled after {attempt + 1} attempts: {str(e)}",
+                            retry_after=self.max_delay
+                        ) from e
+                    raise
+
+                delay = self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                remaining = current_request().remaining()
+                if remaining is not None and remaining <= delay:
+                    # 等到重试时已经超过截止时间, 调用方不会再使用结果
+                    raise DeadlineExceededError(
+                        "Request deadline exceeded before the model call could be retried"
+                    ) from e
+                logging.warning(f"Retrying Bedrock call in {delay:.2f}s ({error_code(e) or type(e).__name__})")
+                attempt += 1
+                self.retries += 1
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                if not hold:
+                    self.limiter.release("success")
+                    return result, None
+                return result, self._releaser()
+
+    def _releaser(self) -> Callable[[str], None]:
+        """只生效一次的名额释放函数"""
+        released = False
+
+        def release(outcome: str = "success"):
+            nonlocal released
+            if not released:
+                released = True
+                self.limiter.release(outcome)
+
+        return release
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limiter": self.limiter.stats(),
+            "breaker": self.breaker.stats(),
+            "retries": self.retries
+        }
@@ -0,0 +1,145 @@
+# core/ai/scheduler.py
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+# 优先级类别, 靠前的优先 (严格优先: 有 interactive 排队时 batch 不会被调度)
+PRIORITIES = ("interactive", "batch")
+
+
+class RequestContext:
+    """调用方信息 (租户、权重、优先级、截止时间), 决定模型调用在排队时的顺序"""
+
+    __slots__ = ("tenant", "weight", "priority", "deadline")
+
+    def __init__(self,
+                 tenant: str = "anonymous",
+                 weight: float = 1.0,
+                 priority: str = "interactive",
+                 deadline: Optional[float] = None):
+        """
+        Args:
+            tenant: 租户 (按 API key 区分)
+            weight: 租户权重, 同时排队时按权重比例分配并发名额
+            priority: 优先级类别, PRIORITIES 之一
+            deadline: 截止时间 (time.monotonic), 过了截止时间仍未开始的调用直接丢弃
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        self.tenant = tenant
+        self.weight = weight if weight > 0 else 1.0
+        self.priority = priority
+        self.deadline = deadline
+
+    def remaining(self) -> Optional[float]:
+        """距截止时间的秒数, 没有截止时间时为 None"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def replace(self, **changes) -> "RequestContext":
+        """复制并修改部分字段"""
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return RequestContext(**fields)
+
+    def __repr__(self) -> str:
+        return (f"RequestContext(tenant={self.tenant!r}, weight={self.weight}, "
+                f"priority={self.priority!r}, deadline={self.deadline})")
+
+
+DEFAULT_CONTEXT = RequestContext()
+
+# 当前请求的调度信息 (API 层设置; 请求中创建的任务会继承)
+_request_context: ContextVar[RequestContext] = ContextVar("request_context", default=DEFAULT_CONTEXT)
+
+
+def current_request() -> RequestContext:
+    """当前请求的调度信息, 未设置时为默认值 (anonymous / interactive / 无截止时间)"""
+    return _request_context.get()
+
+
+def set_request_context(context: RequestContext) -> Any:
+    """设置当前请求的调度信息, 返回用于 reset_request_context 的 token"""
+    return _request_context.set(context)
+
+
+def reset_request_context(token: Any):
+    _request_context.reset(token)
+
+
+class FairQueue:
+    """
+    加权公平队列
+
+    不同优先级之间严格按优先级出队; 同一优先级内按租户做加权公平排队
+    (start-time fair queuing): 每个调用的虚拟完成时间为
+    max(当前虚拟时间, 该租户上一个调用的虚拟完成时间) + 1 / 权重,
+    出队时取最小者。因此一个租户一次提交大量调用, 也只是排在自己之前的调用后面,
+    其他租户的新调用仍能按权重比例及时得到名额。
+    """
+
+    def __init__(self):
+        self._heaps: Dict[str, List[Tuple[float, int, asyncio.Future]]] = {p: [] for p in PRIORITIES}
+        self._virtual_time: Dict[str, float] = {p: 0.0 for p in PRIORITIES}
+        # (优先级, 租户) -> 最近一个调用的虚拟完成时间
+        self._finish: Dict[Tuple[str, str], float] = {}
+        self._counts: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self._entries: Dict[asyncio.Future, str] = {}
+        self._sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def depth(self, priority: str) -> int:
+        """某个优先级排队中的调用数"""
+        return self._counts[priority]
+
+    def push(self, waiter: asyncio.Future, context: RequestContext):
+        """加入队列"""
+        priority = context.priority
+        key = (priority, context.tenant)
+        start = max(self._virtual_time[priority], self._finish.get(key, 0.0))
+        finish = start + 1.0 / context.weight
+        self._finish[key] = finish
+        heapq.heappush(self._heaps[priority], (finish, next(self._sequence), waiter))
+        self._entries[waiter] = priority
+        self._counts[priority] += 1
+
+    def pop(self) -> Optional[asyncio.Future]:
+        """取出下一个调用, 队列为空时返回 None"""
+        for priority in PRIORITIES:
+            heap = self._heaps[priority]
+            while heap:
+                finish, _, waiter = heapq.heappop(heap)
+                if waiter not in self._entries:
+                    # 已被移除 (取消或超时)
+                    continue
+                self._forget(waiter)
+                self._virtual_time[priority] = finish
+                self._prune(priority)
+                return waiter
+        return None
+
+    def remove(self, waiter: asyncio.Future) -> bool:
+        """移除排队中的调用 (堆中的条目在出队时跳过), 不在队列中时返回 False"""
+        if waiter not in self._entries:
+            return False
+        self._forget(waiter)
+        return True
+
+    def _forget(self, waiter: asyncio.Future):
+        priority = self._entries.pop(waiter)
+        self._counts[priority] -= 1
+
+    def _prune(self, priority: str):
+        """清理虚拟完成时间已落后的租户记录, 避免租户很多时无限增长"""
+        if len(self._finish) < 4096:
+            return
+        now = self._virtual_time[priority]
+        for key in [k for k, v in self._finish.items() if k[0] == priority and v <= now]:
+            del self._finish[key]
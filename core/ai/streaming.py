@@ -0,0 +1,93 @@
+# core/ai/streaming.py
+
+import logging
+from typing import Dict, Optional
+
+from utils import json_codec
+
+
+def parse_stream_event(event: Dict, usage: Optional[Dict[str, int]] = None) -> Optional[str]:
+    """
+    解析 invoke_model_with_response_stream 的单个事件
+
+    Args:
+        event: 事件流中的事件, 形如 {"chunk": {"bytes": b"..."}}
+        usage: 可选, 用于回填 message_start / message_delta 中的 token 用量
+
+    Returns:
+        Optional[str]: 文本增量, 非文本事件返回 None
+    """
+    chunk = event.get("chunk")
+    if not chunk:
+        # 流内错误事件 (如 throttlingException) 直接抛出
+        for key, value in event.items():
+            if key.endswith("Exception"):
+                raise Exception(f"{key}: {value.get('message', value)}")
+        return None
+
+    data = json_codec.loads(chunk.get("bytes"))
+    if data.get("type") == "content_block_delta":
+        return data.get("delta", {}).get("text")
+
+    if usage is not None:
+        if data.get("type") == "message_start":
+            usage.update(data.get("message", {}).get("usage") or {})
+        elif data.get("type") == "message_delta":
+            usage.update(data.get("usage") or {})
+
+    logging.debug("Stream event: %s", data.get("type"))
+    return None
+
+
+class StopSequenceFilter:
+    """
+    增量去除停止序列
+
+    与非流式接口一致: 遇到停止序列时丢弃它以及其后的内容, 并去除它前面的空白。
+    可能是停止序列前缀的尾部 (以及尾部空白) 会暂存, 直到能确定是否需要输出。
+    """
+
+    def __init__(self, stop_sequence: str):
+        self.stop_sequence = stop_sequence
+        self.stopped = False
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        """
+        输入一段文本, 返回可以安全输出的部分
+
+        Args:
+            text: 新的文本片段
+
+        Returns:
+            str: 可以输出的文本 (可能为空)
+        """
+        if self.stopped:
+            return ""
+
+        self._pending += text
+        index = self._pending.find(self.stop_sequence)
+        if index != -1:
+            self.stopped = True
+            output = self._pending[:index].rstrip()
+            self._pending = ""
+            return output
+
+        # 暂存可能构成停止序列开头的尾部
+        keep = self._partial_match_length(self._pending)
+        head = self._pending[:len(self._pending) - keep]
+        output = head.rstrip()
+        self._pending = self._pending[len(output):]
+        return output
+
+    def flush(self) -> str:
+        """流结束时取出暂存的文本 (去掉结尾的空白, 与非流式回复一致)"""
+        output, self._pending = self._pending, ""
+        return "" if self.stopped else output.rstrip()
+
+    def _partial_match_length(self, text: str) -> int:
+        """text 尾部与停止序列开头重合的最大长度"""
+        for size in range(min(len(text), len(self.stop_sequence) - 1), 0, -1):
+            if text.endswith(self.stop_sequence[:size]):
+                return size
+        return 0
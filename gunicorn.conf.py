@@ -0,0 +1,50 @@
+# gunicorn.conf.py
+"""
+生产环境启动配置: gunicorn 管理多个 uvicorn worker
+
+用法: gunicorn -c gunicorn.conf.py main:app
+
+- 预加载应用 (preload_app): 依赖和代码只在主进程导入一次, worker 通过 fork 共享内存页,
+  启动更快 (API 模块延迟导入的 boto3 也在主进程预先导入); post_fork 中为每个 worker
+  重新创建日志线程, 服务对象在各 worker 的 lifespan 中创建
+- 优雅关闭: 收到 SIGTERM 后 worker 停止接收新连接, 等待现有请求和在途的 Bedrock 调用
+  (SHUTDOWN_TIMEOUT) 完成, 超过 graceful_timeout 后强制退出
+- worker 回收: 处理 max_requests (加随机抖动) 个请求后重启, 避免内存缓慢增长
+- 需要在 worker 之间保持一致的状态 (会话、回复缓存) 通过 SESSION_SQLITE_PATH /
+  RESPONSE_CACHE_SQLITE_PATH 放在共享的 SQLite (WAL) 文件中
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WORKERS", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("PRELOAD_APP", "true").lower() in ("1", "true", "yes")
+
+# 连接
+backlog = int(os.getenv("BACKLOG", "2048"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+# 超时: worker 无响应 timeout 秒后重启; 关闭时最多等待 graceful_timeout 秒
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+# worker 回收
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+
+accesslog = os.getenv("ACCESS_LOG") or None
+
+
+def on_starting(server):
+    """预加载时在主进程导入 boto3 (API 只在创建客户端时导入), worker 通过 fork 共享"""
+    if preload_app:
+        import boto3  # noqa: F401
+
+
+def post_fork(server, worker):
+    """worker 启动后为本进程重新初始化 (仅预加载时需要)"""
+    if preload_app:
+        from api import main as api_main
+        api_main.init_worker()
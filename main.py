@@ -1,10 +1,22 @@
 # main.py
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from api import main as api_main
 from api.main import app as api_app
 import uvicorn
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 后台预热 (建立 Bedrock 连接、渲染提示词、可选的开场白), 完成前 /health 返回 503
+    await api_main.startup()
+    yield
+    # 服务器已停止接收新请求并等待现有请求结束, 这里再等待后台的模型调用完成
+    await api_main.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 添加带前缀的子应用
 app.mount("/api/v1", api_app)
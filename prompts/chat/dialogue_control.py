@@ -1,7 +1,17 @@
 
+import hashlib
 from api.models import Character,Scene,Message
-from typing import List, Dict, Optional
+from config.settings import Settings
+from typing import Dict, Hashable, List, Optional
+from utils.lru_cache import LRUCache
+from .templates import PromptTemplates
+
+
 class DialogueControl:
+   # Compiled system prompts, keyed by persona fields (created lazily so that
+   # PROMPT_CACHE_SIZE from .env is already loaded)
+   _prompt_cache: Optional[LRUCache] = None
+
    @staticmethod
    def build_prompt(
            character: Character,
@@ -19,30 +29,129 @@ class DialogueControl:
        Returns:
            Dict: Processed prompt info
        """
-       # Build character info
-       character_info = (
+       return {
+           "character_info": DialogueControl.build_character_info(character),
+           "context": DialogueControl.build_context(scene),
+           "messages": DialogueControl.format_messages(message_history)
+       }
+
+   @staticmethod
+   def build_character_info(character: Character) -> str:
+       """Build character info"""
+       return (
            f"The role you play is {character.name}\n"
            f"Background Information: {character.background}\n"
            f"personality: {character.personality}"
        )
 
-       # Build scene context
-       context = (
+   @staticmethod
+   def build_context(scene: Scene) -> str:
+       """Build scene context"""
+       return (
            f"scene: {scene.description}\n"
            f"vibe: {scene.mood if scene.mood else 'normal'}"
        )
 
-       # Process message history with defaults
-       messages = []
-       if message_history:
-           for msg in message_history:
-               messages.append({
-                   "role": msg.role,
-                   "content": msg.content
-               })
+   @staticmethod
+   def format_messages(message_history: Optional[List[Message]] = None) -> List[Dict[str, str]]:
+       """Process message history with defaults"""
+       if not message_history:
+           return []
+       return [{"role": msg.role, "content": msg.content} for msg in message_history]
 
-       return {
-           "character_info": character_info,
-           "context": context,
-           "messages": messages
-       }
\ No newline at end of file
+   @staticmethod
+   def persona_key(
+           character: Character,
+           scene: Scene,
+           template_name: str = "roleplay_system"
+   ) -> str:
+       """
+       Stable hash of character + scene + template version
+
+       The same persona and scene always map to the same key, across requests
+       and processes, so it can be used to share compiled prompts.
+       """
+       parts = DialogueControl._persona_fields(character, scene, template_name)
+       return hashlib.sha256("\x1f".join(map(str, parts)).encode("utf-8")).hexdigest()
+
+   @staticmethod
+   def _persona_fields(character: Character, scene: Scene, template_name: str) -> tuple:
+       """Fields identifying a compiled prompt (also the in-process cache key)"""
+       version = PromptTemplates.get(template_name)[0]
+       return (
+           template_name, version,
+           character.name, character.background, character.personality,
+           scene.description, scene.mood or ""
+       )
+
+   @staticmethod
+   def compile_system_prompt(
+           character: Character,
+           scene: Scene,
+           template_name: str = "roleplay_system"
+   ) -> str:
+       """
+       Render the system prompt for a persona/scene, using the compiled prompt cache
+
+       Args:
+           character: Character info
+           scene: Scene info
+           template_name: Registered template to render
+
+       Returns:
+           str: Rendered system prompt
+       """
+       cache = DialogueControl.prompt_cache()
+       # Tuple keys avoid hashing the whole persona text with sha256 on the hot path
+       key = DialogueControl._persona_fields(character, scene, template_name)
+
+       system_prompt = cache.get(key)
+       if system_prompt is None:
+           system_prompt = PromptTemplates.render(
+               template_name,
+               character_info=DialogueControl.build_character_info(character),
+               context=DialogueControl.build_context(scene)
+           )
+           cache.put(key, system_prompt)
+       return system_prompt
+
+   @staticmethod
+   def compile_from_fragments(
+           character_key: Hashable,
+           character_info: str,
+           scene_key: Hashable,
+           context: str,
+           template_name: str = "roleplay_system"
+   ) -> str:
+       """
+       Render the system prompt from pre-rendered fragments (registry entries)
+
+       Args:
+           character_key: Identifies the character fragment (e.g. registry ETag)
+           character_info: Pre-rendered character info
+           scene_key: Identifies the scene fragment
+           context: Pre-rendered scene context
+           template_name: Registered template to render
+
+       Returns:
+           str: Rendered system prompt
+       """
+       cache = DialogueControl.prompt_cache()
+       key = (template_name, PromptTemplates.get(template_name)[0], character_key, scene_key)
+
+       system_prompt = cache.get(key)
+       if system_prompt is None:
+           system_prompt = PromptTemplates.render(
+               template_name,
+               character_info=character_info,
+               context=context
+           )
+           cache.put(key, system_prompt)
+       return system_prompt
+
+   @staticmethod
+   def prompt_cache() -> LRUCache:
+       """Compiled prompt cache (bounded by PROMPT_CACHE_SIZE)"""
+       if DialogueControl._prompt_cache is None:
+           DialogueControl._prompt_cache = LRUCache(max_size=Settings().prompt_cache_size)
+       return DialogueControl._prompt_cache
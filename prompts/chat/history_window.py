@@ -0,0 +1,62 @@
+# prompts/chat/history_window.py
+
+from typing import Dict, List, Tuple
+from utils.token_counter import TokenCounter
+
+# 截断历史时每次丢弃的块大小 (占历史可用预算的比例)
+TRIM_BLOCK_RATIO = 0.5
+
+
+def window_history(
+        messages: List[Dict[str, str]],
+        budget: int,
+        counter: TokenCounter,
+        reserved_tokens: int = 0,
+        block_ratio: float = TRIM_BLOCK_RATIO
+) -> Tuple[List[Dict[str, str]], int]:
+    """
+    按 token 预算截取历史消息
+
+    历史放得下时全部保留。放不下时按块丢弃最早的消息: 历史可用的预算为
+    budget - reserved_tokens, 截断点是从历史开头起每累计 (可用预算 * block_ratio) 个 token
+    后的第一条 user 消息, 选择之后的历史放得下的最早截断点。截断点的位置只取决于之前的消息,
+    所以窗口的开头在之后的多轮对话中保持不变 (提示词缓存的前缀一直有效),
+    直到再次超出预算才跳到下一个截断点 (此时保留的历史约为可用预算的 1 - block_ratio)。
+    单条消息过大、没有可用的截断点时, 从最新的消息往前保留到预算为止。
+    窗口总是从 user 消息开始, 保证是完整的一轮对话。
+
+    Args:
+        messages: 历史消息列表 (按时间顺序)
+        budget: 输入 token 预算
+        counter: token 计数器
+        reserved_tokens: 已被系统提示词和当前消息占用的 token 数
+        block_ratio: 每次丢弃的块大小占历史可用预算的比例
+
+    Returns:
+        Tuple[List[Dict[str, str]], int]: (保留的历史消息, 保留的历史 token 数)
+    """
+    remaining = budget - reserved_tokens
+    counts = [counter.count_message(message) for message in messages]
+    total = sum(counts)
+    if total <= remaining:
+        return messages, total
+
+    block = max(1, int(remaining * block_ratio))
+    dropped = 0
+    mark = block
+    for index, message in enumerate(messages):
+        if dropped >= mark and message["role"] == "user":
+            if total - dropped <= remaining:
+                return messages[index:], total - dropped
+            mark = dropped + block
+        dropped += counts[index]
+
+    used = 0
+    start = len(messages)
+    while start > 0 and used + counts[start - 1] <= remaining:
+        used += counts[start - 1]
+        start -= 1
+    while start < len(messages) and messages[start]["role"] != "user":
+        used -= counts[start]
+        start += 1
+    return messages[start:], used
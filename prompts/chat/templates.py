@@ -0,0 +1,56 @@
+# prompts/chat/templates.py
+
+from typing import Dict, Tuple
+
+
+# 角色扮演系统提示词: 角色信息 + 场景 + 回复风格说明
+ROLEPLAY_SYSTEM_TEMPLATE = """{character_info}
+
+    {context}
+
+    回复1条简短的约会应用信息（每条最多4个字），开玩笑调情。每条消息包含一个表情符号。保持它轻松愉快和有品位-没有角色扮演或动作描述。专注于巧妙的文字游戏和友好的玩笑，就像在Tinder或类似的应用程序上发信息一样。回答要简短、随意、吸引人.经常使用英文缩写。
+    用英文回复
+    """
+
+
+class PromptTemplates:
+    """
+    提示词模板注册表
+
+    模板使用 str.format 占位符。每次注册都会递增版本号,
+    编译缓存以 (模板名, 版本) 作为键的一部分, 重新注册后旧的缓存自动失效。
+    """
+
+    _templates: Dict[str, Tuple[int, str]] = {}
+
+    @classmethod
+    def register(cls, name: str, template: str):
+        """
+        注册 (或替换) 模板
+
+        Args:
+            name: 模板名称
+            template: 模板文本
+        """
+        version = cls._templates.get(name, (0, ""))[0] + 1
+        cls._templates[name] = (version, template)
+
+    @classmethod
+    def get(cls, name: str) -> Tuple[int, str]:
+        """
+        获取模板
+
+        Returns:
+            Tuple[int, str]: (版本号, 模板文本)
+        """
+        if name not in cls._templates:
+            raise KeyError(f"Prompt template not registered: {name}")
+        return cls._templates[name]
+
+    @classmethod
+    def render(cls, name: str, **kwargs) -> str:
+        """渲染模板"""
+        return cls.get(name)[1].format(**kwargs)
+
+
+PromptTemplates.register("roleplay_system", ROLEPLAY_SYSTEM_TEMPLATE)
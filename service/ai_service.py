@@ -1,8 +1,24 @@
 # service/ai_service.py
 
 from core.ai.claude_client import ClaudeClient
-from typing import Optional, Dict, List
+from core.ai.errors import OverloadedError
+from core.ai.scheduler import current_request, reset_request_context, set_request_context
+from config.settings import Settings
+from prompts.chat.history_window import window_history
+from prompts.chat.dialogue_control import DialogueControl
+from prompts.chat.presets import PRESET_CHARACTERS, PRESET_SCENES
+from utils.metrics import stage
+from utils.token_counter import TokenCounter
+from .coalescer import RequestCoalescer
+from .conversation_log import ConversationLog
+from .moderation import ContentBlockedError, create_moderator
+from .persona_registry import PersonaRegistry
+from .response_cache import ResponseCache
+from .session_store import Session, SessionStore, SqliteSessionStore
+from typing import Any, AsyncIterator, Awaitable, Optional, Dict, List, Tuple
+import asyncio
 import logging
+import time
 
 
 class AIService:
@@ -10,7 +26,59 @@ class AIService:
         """初始化 AI 服务"""
         try:
             self.claude = ClaudeClient()
-            self._chat_history: List[Dict[str, str]] = []
+            self.settings = Settings()
+
+            # 服务端会话历史 (按 session_id 隔离); 配置 SQLite 文件时多个 worker 共享
+            if self.settings.session_sqlite_path:
+                self.sessions = SqliteSessionStore(
+                    self.settings.session_sqlite_path,
+                    max_sessions=self.settings.session_max_count,
+                    max_bytes=self.settings.session_max_bytes,
+                    ttl_seconds=self.settings.session_ttl_seconds
+                )
+            else:
+                self.sessions = SessionStore(
+                    max_sessions=self.settings.session_max_count,
+                    max_bytes=self.settings.session_max_bytes,
+                    ttl_seconds=self.settings.session_ttl_seconds
+                )
+            self.token_counter = TokenCounter()
+
+            # 角色/场景注册表 (请求按 ID 引用), 首次启动时写入预设角色和场景
+            self.registry = PersonaRegistry(
+                self.settings.registry_sqlite_path,
+                cache_size=self.settings.registry_cache_size,
+                cache_ttl_seconds=self.settings.registry_cache_ttl_seconds
+            )
+            self.registry.seed("character", PRESET_CHARACTERS)
+            self.registry.seed("scene", PRESET_SCENES)
+
+            # 可选: 内容审核 (与模型调用并发进行)
+            self.moderator = create_moderator(self.settings)
+
+            # 可选: 持久化的对话记录 (后台线程批量写入)
+            self.conversations: Optional[ConversationLog] = None
+            if self.settings.conversation_log_path:
+                self.conversations = ConversationLog(
+                    self.settings.conversation_log_path,
+                    queue_size=self.settings.conversation_log_queue_size,
+                    batch_size=self.settings.conversation_log_batch_size
+                )
+
+            # 可选: 合并相同的在途请求
+            self.coalescer: Optional[RequestCoalescer] = None
+            if self.settings.coalesce_requests:
+                self.coalescer = RequestCoalescer()
+
+            # 可选的模型回复缓存
+            self.response_cache: Optional[ResponseCache] = None
+            if self.settings.response_cache_enabled:
+                self.response_cache = ResponseCache(
+                    max_size=self.settings.response_cache_size,
+                    ttl_seconds=self.settings.response_cache_ttl_seconds,
+                    variants=self.settings.response_cache_variants,
+                    sqlite_path=self.settings.response_cache_sqlite_path or None
+                )
             logging.info("AI Service initialized successfully")
         except Exception as e:
             logging.error(f"Failed to initialize AI Service: {str(e)}")
@@ -19,41 +87,469 @@ class AIService:
     async def chat(self,
                    user_message: str,
                    system_prompt: Optional[str] = None,
-                   messages: Optional[List[Dict[str, str]]] = None,  # 新增参数
-                   clear_history: bool = False) -> str:
+                   messages: Optional[List[Dict[str, str]]] = None,
+                   session_id: Optional[str] = None,
+                   max_input_tokens: Optional[int] = None,
+                   use_cache: bool = True,
+                   clear_history: bool = False) -> Dict[str, Any]:
         """
         处理聊天请求
 
         Args:
             user_message: 用户消息
             system_prompt: 系统提示词
-            messages: 历史消息列表  # 新增参数说明
-            clear_history: 是否清除对话历史
+            messages: 历史消息列表, 提供 session_id 时用于覆盖服务端保存的历史
+            session_id: 会话 ID, 提供时使用服务端保存的对话历史
+            max_input_tokens: 输入 token 预算, 默认读取 MAX_INPUT_TOKENS
+            use_cache: 是否允许使用回复缓存 (需启用 RESPONSE_CACHE_ENABLED)
+            clear_history: 是否清除会话的对话历史
 
         Returns:
-            str: AI 的回复
+            Dict[str, Any]: {"response": AI 的回复, "prompt_tokens": 发送的输入 token 数,
+                             "cached": 是否来自缓存, "usage": Bedrock 返回的 token 用量 (命中缓存时为空)}
         """
+        usage: Dict[str, Any] = {}
         try:
-            if clear_history:
-                self._chat_history = []
-
-            # 如果提供了历史消息,使用提供的历史
-            if messages is not None:
-                self._chat_history = messages.copy()
-
-            # 调用 Claude
-            response = await self.claude.chat(
-                system_prompt=system_prompt,
-                user_message=user_message,
-                messages=self._chat_history  # 传递历史消息给 Claude
-            )
+            # 无会话: 完全由客户端提供历史
+            if session_id is None:
+                history, prompt_tokens = await self._window(
+                    messages or [], system_prompt, user_message, max_input_tokens
+                )
+                response, cached = await self._moderated(
+                    user_message, self._generate(system_prompt, user_message, history, use_cache, usage)
+                )
+                return {"response": response, "prompt_tokens": prompt_tokens, "cached": cached, "usage": usage}
 
-            # 更新对话历史
-            self._chat_history.append({"role": "user", "content": user_message})
-            self._chat_history.append({"role": "assistant", "content": response})
+            async with self.sessions.alocked(session_id) as session:
+                history, prompt_tokens = await self._window(
+                    await self._session_history(session, messages, clear_history),
+                    system_prompt, user_message, max_input_tokens
+                )
 
-            return response
+                # 调用 Claude (启用审核时同时审核用户消息)
+                response, cached = await self._moderated(
+                    user_message, self._generate(system_prompt, user_message, history, use_cache, usage)
+                )
 
+                # 更新对话历史
+                await self.sessions.aappend(session, [
+                    {"role": "user", "content": user_message},
+                    {"role": "assistant", "content": response}
+                ])
+
+            return {"response": response, "prompt_tokens": prompt_tokens, "cached": cached, "usage": usage}
+
+        except (OverloadedError, ContentBlockedError):
+            # 过载和审核拒绝原样抛出, 由 API 层返回 429/503 (带 Retry-After) 或 400
+            raise
         except Exception as e:
             logging.error(f"Error in chat: {str(e)}")
-            raise Exception(f"Chat error: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Chat error: {str(e)}")
+
+    async def chat_stream(self,
+                          user_message: str,
+                          system_prompt: Optional[str] = None,
+                          messages: Optional[List[Dict[str, str]]] = None,
+                          session_id: Optional[str] = None,
+                          max_input_tokens: Optional[int] = None,
+                          clear_history: bool = False,
+                          usage: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        流式处理聊天请求, 逐段透传模型输出
+
+        Args:
+            user_message: 用户消息
+            system_prompt: 系统提示词
+            messages: 历史消息列表, 提供 session_id 时用于覆盖服务端保存的历史
+            session_id: 会话 ID, 提供时使用服务端保存的对话历史
+            max_input_tokens: 输入 token 预算, 默认读取 MAX_INPUT_TOKENS
+            clear_history: 是否清除会话的对话历史
+            usage: 可选, 用于回填统计信息的字典: prompt_tokens, 以及流结束后 Bedrock 返回的
+                   token 用量 model_usage
+
+        Yields:
+            str: 回复的文本片段
+        """
+        if usage is None:
+            usage = {}
+        model_usage = usage.setdefault("model_usage", {})
+
+        try:
+            if session_id is None:
+                history, usage["prompt_tokens"] = await self._window(
+                    messages or [], system_prompt, user_message, max_input_tokens
+                )
+                async for chunk in self._moderate_stream(user_message, self.claude.chat_stream(
+                    system_prompt=system_prompt,
+                    user_message=user_message,
+                    messages=history,
+                    usage=model_usage
+                )):
+                    yield chunk
+                return
+
+            async with self.sessions.alocked(session_id) as session:
+                history, usage["prompt_tokens"] = await self._window(
+                    await self._session_history(session, messages, clear_history),
+                    system_prompt, user_message, max_input_tokens
+                )
+                parts: List[str] = []
+
+                async for chunk in self._moderate_stream(user_message, self.claude.chat_stream(
+                    system_prompt=system_prompt,
+                    user_message=user_message,
+                    messages=history,
+                    usage=model_usage
+                )):
+                    parts.append(chunk)
+                    yield chunk
+
+                # 只有完整生成的回复才记入对话历史
+                await self.sessions.aappend(session, [
+                    {"role": "user", "content": user_message},
+                    {"role": "assistant", "content": "".join(parts)}
+                ])
+
+        except (OverloadedError, ContentBlockedError):
+            raise
+        except Exception as e:
+            logging.error(f"Error in chat stream: {str(e)}")
+            raise Exception(f"Chat error: {str(e)}")
+
+    async def warm_up(self) -> Dict[str, Any]:
+        """
+        启动预热
+
+        - 预先建立到各 Bedrock 端点的连接 (WARMUP_CONNECTIONS), 同时在线程中加载 tiktoken 编码
+        - 读取注册表中所有角色和场景 (填充注册表缓存), 渲染每个组合的系统提示词
+        - WARMUP_GREETINGS=true 时, 为每个组合生成开场白 (回复池大小为 RESPONSE_CACHE_VARIANTS)
+          并写入回复缓存; 之后以 WARMUP_GREETING_MESSAGE 开始的新对话直接命中缓存。
+          共享 SQLite 回复缓存时, 已经生成过的组合会跳过
+
+        Returns:
+            Dict[str, Any]: 预热结果
+        """
+        report: Dict[str, Any] = {}
+        start = time.perf_counter()
+
+        tokenizer = asyncio.ensure_future(asyncio.to_thread(self.token_counter.load))
+        report["connections"] = await self.claude.warm_up(self.settings.warmup_connections)
+        report["tiktoken"] = await tokenizer
+
+        characters = await self.registry.alist("character")
+        scenes = await self.registry.alist("scene")
+        prompts = []
+        for character in characters:
+            for scene in scenes:
+                await self.registry.aget("character", character.entry_id)
+                await self.registry.aget("scene", scene.entry_id)
+                prompts.append(DialogueControl.compile_from_fragments(
+                    character.etag, character.fragment, scene.etag, scene.fragment
+                ))
+        report["prompts"] = len(prompts)
+
+        report["greetings"] = 0
+        if self.settings.warmup_greetings:
+            if self.response_cache is None:
+                logging.warning("WARMUP_GREETINGS requires RESPONSE_CACHE_ENABLED, skipping greetings")
+            else:
+                report["greetings"] = await self._pregenerate_greetings(prompts)
+
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        logging.info(f"Warm-up finished: {report}")
+        return report
+
+    async def _pregenerate_greetings(self, prompts: List[str]) -> int:
+        """为每个系统提示词生成开场白, 填满回复缓存的回复池"""
+        cache = self.response_cache
+        message = self.settings.warmup_greeting_message
+        semaphore = asyncio.Semaphore(self.settings.warmup_concurrency)
+        generated = 0
+        # 预热调用不应挤占已开始的交互请求
+        token = set_request_context(current_request().replace(tenant="warmup", priority="batch"))
+
+        async def fill(system_prompt: str):
+            nonlocal generated
+            key = ResponseCache.make_key(self.claude.model_id, system_prompt, [], message, self.claude.sampling)
+            while await cache.apool_size(key) < cache.variants:
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await self._call_model(system_prompt, message, [])
+                    cache.put(key, response, time.perf_counter() - start)
+                    generated += 1
+
+        try:
+            results = await asyncio.gather(*(fill(prompt) for prompt in prompts), return_exceptions=True)
+        finally:
+            reset_request_context(token)
+        failed = [r for r in results if isinstance(r, Exception)]
+        if failed:
+            logging.warning(f"Failed to pregenerate greetings for {len(failed)} personas: {str(failed[0])}")
+        return generated
+
+    async def restore_session(self, session_id: str, max_turns: int = 100) -> int:
+        """
+        从对话记录恢复会话历史 (例如会话已过期或服务重启后)
+
+        Args:
+            session_id: 会话 ID
+            max_turns: 最多恢复的轮数 (最近的)
+
+        Returns:
+            int: 恢复的轮数
+        """
+        if self.conversations is None:
+            raise ValueError("Conversation log is not enabled")
+        records = await asyncio.to_thread(self.conversations.read, session_id=session_id,
+                                          limit=max_turns, latest=True)
+        messages: List[Dict[str, str]] = []
+        for record in records:
+            messages.append({"role": "user", "content": record["message"]})
+            messages.append({"role": "assistant", "content": record["response"]})
+        if messages:
+            # 持有会话锁替换, 不与同一会话正在进行的对话交错
+            async with self.sessions.alocked(session_id) as session:
+                await self.sessions.areplace(session, messages)
+        return len(records)
+
+    async def close(self, timeout: Optional[float] = None):
+        """
+        关闭服务: 等待在途的 Bedrock 调用完成 (最多 timeout 秒), 然后释放线程池和存储
+
+        Args:
+            timeout: 最长等待时间 (秒), 默认读取 SHUTDOWN_TIMEOUT
+        """
+        if timeout is None:
+            timeout = self.settings.shutdown_timeout
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        executor = self.claude.executor
+        while executor.in_flight and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if executor.in_flight:
+            logging.warning(f"Shutting down with {executor.in_flight} Bedrock calls still in flight")
+
+        executor.shutdown(wait=False)
+        if self.response_cache is not None:
+            self.response_cache.close()
+        if isinstance(self.sessions, SqliteSessionStore):
+            self.sessions.close()
+        self.registry.close()
+        if self.conversations is not None:
+            # 写完队列中剩余的对话记录 (阻塞操作, 放到线程中)
+            await asyncio.to_thread(self.conversations.close)
+        logging.info("AI Service closed")
+
+    async def _moderated(self, user_message: str, generation: Awaitable[Tuple[str, bool]]) -> Tuple[str, bool]:
+        """
+        生成回复, 同时审核用户消息; 生成完成后审核回复
+
+        用户消息的审核与模型调用并发进行, 先返回拒绝结果时取消模型调用。
+        总延迟约为 max(审核, 生成) + 回复审核 (命中缓存时接近 0)。
+
+        Raises:
+            ContentBlockedError: 用户消息或回复未通过审核
+        """
+        if self.moderator is None:
+            return await generation
+
+        verdict_task = asyncio.ensure_future(self.moderator.check(user_message, "input"))
+        generate_task = asyncio.ensure_future(generation)
+        try:
+            done, _ = await asyncio.wait({verdict_task, generate_task}, return_when=asyncio.FIRST_COMPLETED)
+            if verdict_task in done and not verdict_task.result().allowed:
+                raise ContentBlockedError("input", verdict_task.result())
+
+            response, cached = await generate_task
+            verdict = await verdict_task
+            if not verdict.allowed:
+                raise ContentBlockedError("input", verdict)
+
+            if self.settings.moderation_check_output:
+                verdict = await self.moderator.check(response, "output")
+                if not verdict.allowed:
+                    raise ContentBlockedError("output", verdict)
+            return response, cached
+        finally:
+            for task in (verdict_task, generate_task):
+                if not task.done():
+                    task.cancel()
+                    # 标记取消后的异常已读取
+                    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _moderate_stream(self, user_message: str, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """
+        审核流式输出
+
+        用户消息的审核与模型调用并发进行: 审核结果返回前收到的片段先暂存, 通过后再输出,
+        拒绝时立即关闭模型的流 (停止生成)。已生成的内容每新增 MODERATION_STREAM_INTERVAL 个字符
+        在后台审核一次, 不阻塞输出; 结束时审核完整回复。输出审核不通过时停止输出并抛出异常,
+        API 层发送 error 事件, 客户端应撤回已显示的内容。
+
+        Raises:
+            ContentBlockedError: 用户消息或回复未通过审核
+        """
+        if self.moderator is None:
+            async for chunk in chunks:
+                yield chunk
+            return
+
+        check_output = self.settings.moderation_check_output
+        interval = self.settings.moderation_stream_interval
+        input_task: Optional[asyncio.Future] = asyncio.ensure_future(self.moderator.check(user_message, "input"))
+        output_task: Optional[asyncio.Future] = None
+        next_task: Optional[asyncio.Future] = None
+        held: List[str] = []
+        parts: List[str] = []
+        checked = 0
+
+        def raise_if_blocked():
+            """处理已完成的审核"""
+            nonlocal input_task, output_task
+            if input_task is not None and input_task.done():
+                verdict = input_task.result()
+                if not verdict.allowed:
+                    raise ContentBlockedError("input", verdict)
+                input_task = None
+            if output_task is not None and output_task.done():
+                verdict = output_task.result()
+                if not verdict.allowed:
+                    raise ContentBlockedError("output", verdict)
+                output_task = None
+
+        try:
+            iterator = chunks.__aiter__()
+            while True:
+                next_task = asyncio.ensure_future(iterator.__anext__())
+                # 等待下一个片段, 期间返回的审核结果立即处理
+                while not next_task.done():
+                    waiting = {task for task in (next_task, input_task, output_task) if task is not None}
+                    await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                    raise_if_blocked()
+                try:
+                    chunk = next_task.result()
+                except StopAsyncIteration:
+                    next_task = None
+                    break
+                next_task = None
+
+                parts.append(chunk)
+                if input_task is None:
+                    for part in held:
+                        yield part
+                    held.clear()
+                    yield chunk
+                else:
+                    held.append(chunk)
+
+                length = sum(map(len, parts))
+                if check_output and output_task is None and length - checked >= interval:
+                    checked = length
+                    output_task = asyncio.ensure_future(self.moderator.check("".join(parts), "output"))
+
+            # 结束: 等待用户消息审核, 审核完整回复
+            if input_task is not None:
+                await input_task
+                raise_if_blocked()
+            if check_output:
+                verdict = await self.moderator.check("".join(parts), "output")
+                if not verdict.allowed:
+                    raise ContentBlockedError("output", verdict)
+            for part in held:
+                yield part
+
+        finally:
+            for task in (next_task, input_task, output_task):
+                if task is not None and not task.done():
+                    task.cancel()
+                    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            if next_task is not None:
+                # 等待取消完成后才能关闭生成器
+                await asyncio.wait({next_task})
+            # 关闭模型的流 (提前结束时停止生成)
+            await chunks.aclose()
+
+    async def _generate(self,
+                        system_prompt: Optional[str],
+                        user_message: str,
+                        history: List[Dict[str, str]],
+                        use_cache: bool = True,
+                        usage: Optional[Dict[str, Any]] = None) -> Tuple[str, bool]:
+        """
+        生成回复 (启用缓存时先查缓存, 启用合并时相同的在途请求只调用一次模型)
+
+        usage 只在本次实际调用了模型时回填 (命中缓存或合并到其他请求时为空)
+
+        Returns:
+            Tuple[str, bool]: (回复, 是否来自缓存)
+        """
+        cache = self.response_cache if use_cache else None
+        if cache is None and self.coalescer is None:
+            return await self._call_model(system_prompt, user_message, history, usage), False
+
+        key = ResponseCache.make_key(
+            self.claude.model_id, system_prompt, history, user_message, self.claude.sampling
+        )
+        if cache is not None:
+            with stage("cache"):
+                cached = await cache.aget(key)
+            if cached is not None:
+                return cached, True
+
+        async def generate() -> str:
+            start = time.perf_counter()
+            response = await self._call_model(system_prompt, user_message, history, usage)
+            # 合并时只有实际调用模型的一方写缓存, 避免回复池里出现重复回复
+            if cache is not None:
+                cache.put(key, response, time.perf_counter() - start)
+            return response
+
+        if self.coalescer is not None:
+            return await self.coalescer.run(key, generate), False
+        return await generate(), False
+
+    async def _call_model(self,
+                          system_prompt: Optional[str],
+                          user_message: str,
+                          history: List[Dict[str, str]],
+                          usage: Optional[Dict[str, Any]] = None) -> str:
+        """调用 Claude"""
+        return await self.claude.chat(
+            system_prompt=system_prompt,
+            user_message=user_message,
+            messages=history,
+            usage=usage
+        )
+
+    async def _session_history(self,
+                               session: Session,
+                               messages: Optional[List[Dict[str, str]]] = None,
+                               clear_history: bool = False) -> List[Dict[str, str]]:
+        """取得会话历史 (客户端提供历史时覆盖服务端历史)"""
+        if clear_history:
+            await self.sessions.areplace(session, [])
+        if messages:
+            await self.sessions.areplace(session, messages)
+        return session.messages
+
+    async def _window(self,
+                      history: List[Dict[str, str]],
+                      system_prompt: Optional[str],
+                      user_message: str,
+                      max_input_tokens: Optional[int] = None) -> Tuple[List[Dict[str, str]], int]:
+        """
+        按输入 token 预算截取历史 (分词器未加载时先在线程中加载, 不阻塞事件循环)
+
+        Returns:
+            Tuple[List[Dict[str, str]], int]: (截取后的历史, 请求的输入 token 总数)
+        """
+        if not self.token_counter.loaded:
+            await asyncio.to_thread(self.token_counter.load)
+        with stage("window"):
+            budget = max_input_tokens or self.settings.max_input_tokens
+            reserved = self.token_counter.count(system_prompt or "") + self.token_counter.count_message(
+                {"role": "user", "content": user_message}
+            )
+            window, history_tokens = window_history(history, budget, self.token_counter, reserved)
+        return window, reserved + history_tokens
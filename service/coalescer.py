@@ -0,0 +1,121 @@
+# service/coalescer.py
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from core.ai.errors import DeadlineExceededError
+from core.ai.scheduler import RequestContext, current_request, reset_request_context, set_request_context
+
+
+class RequestCoalescer:
+    """
+    相同请求合并 (single-flight)
+
+    同一个键同时只执行一次: 第一个请求 (leader) 启动实际调用,
+    之后到达的相同请求 (follower) 等待同一个结果, 异常同样传给所有等待者。
+    实际调用在独立的任务中运行, 某个等待者 (包括 leader) 被取消时不会影响其他人;
+    只有所有等待者都取消后才取消实际调用。
+
+    实际调用使用 leader 调度信息的副本 (租户、优先级), 截止时间取所有等待者中最晚的
+    (有等待者没有截止时间时不限)。实际调用因为其他等待者而失败时 (最后的等待者离开后被取消,
+    或按其他等待者的截止时间被丢弃), 仍在等待的请求重新选出 leader 再调用一次。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self._contexts: Dict[str, RequestContext] = {}
+
+        self.leaders = 0
+        self.followers = 0
+        self.cancelled = 0
+        self.reelected = 0
+
+    @property
+    def in_flight(self) -> int:
+        """正在执行的不同请求数"""
+        return len(self._inflight)
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行 (或加入正在执行的) 请求
+
+        Args:
+            key: 请求键, 相同键的请求被视为相同
+            factory: 创建实际调用的函数, 只有 leader 会调用
+
+        Returns:
+            Any: 调用结果
+        """
+        context = current_request()
+        while True:
+            task = self._inflight.get(key)
+            if task is None or task.done():
+                # 没有在途调用, 或在途调用已被取消但还没移除
+                task = self._start(key, factory, context)
+                self.leaders += 1
+            else:
+                self._join(key, context)
+                self.followers += 1
+
+            self._waiters[key] += 1
+            try:
+                return await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    # 本等待者被取消
+                    if not task.done() and self._waiters.get(key) == 1:
+                        # 最后一个等待者也离开了, 取消实际调用
+                        task.cancel()
+                        self.cancelled += 1
+                    raise
+                # 实际调用在本等待者加入时已被取消 (之前的等待者都离开了), 重新调用
+            except DeadlineExceededError:
+                remaining = context.remaining()
+                if remaining is not None and remaining <= 0:
+                    raise
+                # 按其他等待者的截止时间被丢弃, 本请求还没到截止时间, 重新调用
+            finally:
+                if key in self._waiters and self._inflight.get(key) is task:
+                    self._waiters[key] -= 1
+            self.reelected += 1
+
+    def stats(self) -> Dict[str, int]:
+        """合并指标"""
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "cancelled": self.cancelled,
+            "reelected": self.reelected
+        }
+
+    def _start(self, key: str, factory: Callable[[], Awaitable[Any]], context: RequestContext) -> asyncio.Task:
+        """以 leader 身份启动实际调用 (使用 leader 调度信息的副本, 之后的等待者可以放宽截止时间)"""
+        shared = context.replace()
+        token = set_request_context(shared)
+        try:
+            task = asyncio.ensure_future(factory())
+        finally:
+            reset_request_context(token)
+        self._inflight[key] = task
+        self._waiters[key] = 0
+        self._contexts[key] = shared
+        task.add_done_callback(lambda _: self._finish(key, task))
+        return task
+
+    def _join(self, key: str, context: RequestContext):
+        """follower 加入: 截止时间放宽到所有等待者中最晚的"""
+        shared = self._contexts[key]
+        if shared.deadline is not None:
+            shared.deadline = None if context.deadline is None else max(shared.deadline, context.deadline)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        """调用结束后移除记录 (之后的相同请求会重新调用)"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+            del self._contexts[key]
+        if not task.cancelled():
+            # 异常已传给等待者, 这里标记为已读取
+            task.exception()
@@ -0,0 +1,297 @@
+# service/conversation_log.py
+
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, Optional
+
+from utils import json_codec
+
+# 结束标记
+_STOP = object()
+
+
+class ConversationLog:
+    """
+    只追加的对话记录 (SQLite WAL)
+
+    每轮对话 (请求参数、用户消息、回复、token 数、耗时) 记为一行, 用于恢复会话、分析和回放压测。
+    append 只把记录放入有界队列, 不做任何 I/O; 后台线程一次取出队列中积压的所有记录
+    (最多 batch_size 条), 在一个事务中批量写入。队列满时丢弃新记录并计数, 不阻塞事件循环。
+    close 时写完队列中剩余的记录; 进程退出时 (atexit) 也会执行。
+    写入线程和连接在首次使用时按进程创建 (gunicorn fork 之后各 worker 独立写入同一个文件);
+    写入线程意外退出时, 下一次 append/flush 重新启动它并继续写入队列中的记录。
+    """
+
+    COLUMNS = ("id", "session_id", "created_at", "message", "response",
+               "prompt_tokens", "cached", "latency_ms", "request")
+
+    def __init__(self,
+                 path: str,
+                 queue_size: int = 10000,
+                 batch_size: int = 256):
+        """
+        Args:
+            path: SQLite 文件路径
+            queue_size: 等待写入的最大记录数, 超出时丢弃
+            batch_size: 单个事务写入的最大记录数
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._writer: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._reader: Optional[sqlite3.Connection] = None
+        self._reader_pid: Optional[int] = None
+        self._read_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+        self.appended = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self.writer_restarts = 0
+
+        _instances.add(self)
+
+    def append(self,
+               session_id: Optional[str],
+               message: str,
+               response: str,
+               prompt_tokens: Optional[int] = None,
+               cached: bool = False,
+               latency: float = 0.0,
+               request: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        记录一轮对话 (只入队, 在后台线程写入)
+
+        Args:
+            session_id: 会话 ID
+            message: 用户消息
+            response: 回复
+            prompt_tokens: 输入 token 数
+            cached: 是否来自回复缓存
+            latency: 耗时 (秒)
+            request: 请求参数 (角色/场景等, 回放时使用), 调用后不应再修改
+
+        Returns:
+            bool: 是否入队 (队列满时为 False)
+        """
+        self._ensure_writer()
+        record = (session_id, time.time(), message, response, prompt_tokens,
+                  int(cached), round(latency * 1000, 3), request)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logging.warning(f"Conversation log queue full, {self.dropped} records dropped so far")
+            return False
+        self.appended += 1
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待此前入队的记录全部写入
+
+        Returns:
+            bool: 是否在 timeout 内完成
+        """
+        if self._writer is None or self._pid != os.getpid():
+            return True
+        self._ensure_writer()
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def read(self,
+             session_id: Optional[str] = None,
+             after_id: int = 0,
+             since: Optional[float] = None,
+             until: Optional[float] = None,
+             limit: int = 1000,
+             latest: bool = False) -> List[Dict[str, Any]]:
+        """
+        按范围读取记录 (按 id 升序)
+
+        会执行 SQLite 查询, 在事件循环中需通过 asyncio.to_thread 调用;
+        各线程共用一个读连接, 查询按顺序执行
+
+        Args:
+            session_id: 只读取该会话
+            after_id: 只读取 id 大于该值的记录 (分页时传入上一页最后一条的 id)
+            since: 起始时间 (Unix 时间戳, 含)
+            until: 结束时间 (不含)
+            limit: 最多条数
+            latest: 为 true 时取范围内最新的 limit 条 (仍按 id 升序返回), 用于恢复会话
+
+        Returns:
+            List[Dict[str, Any]]: 记录
+        """
+        conditions = ["id > ?"]
+        params: List[Any] = [after_id]
+        if session_id is not None:
+            conditions.append("session_id = ?")
+            params.append(session_id)
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("created_at < ?")
+            params.append(until)
+
+        order = "DESC" if latest else "ASC"
+        with self._read_lock:
+            rows = self._read_conn().execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM conversation_log "
+                f"WHERE {' AND '.join(conditions)} ORDER BY id {order} LIMIT ?",
+                (*params, limit)
+            ).fetchall()
+        if latest:
+            rows.reverse()
+
+        records = []
+        for row in rows:
+            record = dict(zip(self.COLUMNS, row))
+            record["cached"] = bool(record["cached"])
+            record["request"] = json_codec.loads(record["request"]) if record["request"] else None
+            records.append(record)
+        return records
+
+    def stats(self) -> Dict[str, Any]:
+        """写入指标"""
+        return {
+            "queued": self._queue.qsize(),
+            "appended": self.appended,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "errors": self.errors,
+            "writer_alive": self._writer is not None and self._pid == os.getpid() and self._writer.is_alive(),
+            "writer_restarts": self.writer_restarts
+        }
+
+    def close(self, timeout: Optional[float] = 10.0):
+        """写完队列中的记录并停止写入线程"""
+        writer = self._writer
+        if writer is not None and self._pid == os.getpid() and writer.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                logging.warning("Conversation log queue still full at shutdown")
+            writer.join(timeout)
+        self._writer = None
+        if self._reader is not None and self._reader_pid == os.getpid():
+            self._reader.close()
+        self._reader = None
+
+    def _ensure_writer(self):
+        """启动当前进程的写入线程 (线程已退出时重新启动)"""
+        writer = self._writer
+        if writer is not None and self._pid == os.getpid() and writer.is_alive():
+            return
+        with self._start_lock:
+            writer = self._writer
+            if writer is None or self._pid != os.getpid() or not writer.is_alive():
+                if writer is not None and self._pid == os.getpid():
+                    self.writer_restarts += 1
+                    logging.error(f"Conversation log writer thread died, restarting "
+                                  f"({self._queue.qsize()} records queued)")
+                self._pid = os.getpid()
+                self._writer = threading.Thread(target=self._run, name="conversation-log", daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        """写入线程"""
+        try:
+            self._drain()
+        except Exception as e:
+            logging.error(f"Conversation log writer thread stopped: {str(e)}", exc_info=True)
+
+    def _drain(self):
+        """每次取出积压的记录批量写入, 直到收到结束标记"""
+        db = self._connect()
+        stop = False
+        while not stop:
+            items = [self._queue.get()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            batch = []
+            markers = []
+            for item in items:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+
+            if batch:
+                self._write(db, batch)
+            for marker in markers:
+                marker.set()
+        db.close()
+
+    def _write(self, db: sqlite3.Connection, batch: List[tuple]):
+        """在一个事务中写入一批记录"""
+        rows = [
+            (*record[:-1], json_codec.dumps_str(record[-1]) if record[-1] is not None else None)
+            for record in batch
+        ]
+        try:
+            with db:
+                db.executemany(
+                    "INSERT INTO conversation_log (session_id, created_at, message, response, "
+                    "prompt_tokens, cached, latency_ms, request) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+            self.written += len(rows)
+            self.batches += 1
+        except sqlite3.Error as e:
+            self.errors += 1
+            logging.error(f"Failed to write {len(rows)} conversation log records: {str(e)}")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_log ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, created_at REAL NOT NULL, "
+            "message TEXT NOT NULL, response TEXT NOT NULL, prompt_tokens INTEGER, "
+            "cached INTEGER NOT NULL, latency_ms REAL NOT NULL, request TEXT)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_conversation_log_session ON conversation_log (session_id, id)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_conversation_log_created ON conversation_log (created_at)")
+        db.commit()
+        return db
+
+    def _read_conn(self) -> sqlite3.Connection:
+        """读取使用的连接 (与写入线程分开, WAL 下读写互不阻塞)"""
+        if self._reader is None or self._reader_pid != os.getpid():
+            self._reader = self._connect()
+            self._reader_pid = os.getpid()
+        return self._reader
+
+
+# 进程退出时写完所有实例队列中的记录
+_instances: "weakref.WeakSet[ConversationLog]" = weakref.WeakSet()
+
+
+@atexit.register
+def _close_all():
+    for log in list(_instances):
+        log.close()
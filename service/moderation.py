@@ -0,0 +1,243 @@
+# service/moderation.py
+
+import abc
+import asyncio
+import json
+import logging
+import re
+from typing import Any, Dict, Iterable, Optional
+
+from utils.lru_cache import LRUCache
+
+
+class Verdict:
+    """审核结果"""
+
+    __slots__ = ("allowed", "label", "backend")
+
+    def __init__(self, allowed: bool, label: str = "", backend: str = ""):
+        self.allowed = allowed
+        # 命中的类别 (关键词规则或审核服务返回的标签)
+        self.label = label
+        self.backend = backend
+
+    def __repr__(self) -> str:
+        return f"Verdict(allowed={self.allowed}, label={self.label!r}, backend={self.backend!r})"
+
+
+ALLOWED = Verdict(True)
+
+
+class ContentBlockedError(Exception):
+    """用户消息或模型输出未通过审核, API 层返回 status_code"""
+
+    status_code = 400
+
+    def __init__(self, kind: str, verdict: Verdict):
+        super().__init__(f"Content blocked by moderation ({kind}: {verdict.label or 'unspecified'})")
+        self.kind = kind
+        self.verdict = verdict
+
+
+class ModerationBackend(abc.ABC):
+    """审核后端接口"""
+
+    name = "base"
+
+    @abc.abstractmethod
+    async def check(self, text: str, kind: str) -> Verdict:
+        """
+        审核一段文本
+
+        Args:
+            text: 文本
+            kind: "input" (用户消息) 或 "output" (模型输出)
+
+        Returns:
+            Verdict: 审核结果
+        """
+
+
+class KeywordModerationBackend(ModerationBackend):
+    """本地关键词/正则审核 (不依赖外部服务, 也用于测试)"""
+
+    name = "keyword"
+
+    def __init__(self, patterns: Iterable[str], delay: float = 0.0):
+        """
+        Args:
+            patterns: 正则表达式 (不区分大小写), 任意一个匹配即拒绝
+            delay: 模拟远程审核的延迟 (秒)
+        """
+        self.patterns = [re.compile(pattern, re.IGNORECASE) for pattern in patterns if pattern]
+        self.delay = delay
+
+    async def check(self, text: str, kind: str) -> Verdict:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        for pattern in self.patterns:
+            if pattern.search(text):
+                return Verdict(False, pattern.pattern, self.name)
+        return Verdict(True, "", self.name)
+
+
+class AliyunGreenBackend(ModerationBackend):
+    """
+    阿里云内容安全 (文本审核增强版, alibabacloud-green20220302)
+
+    SDK 是同步的, 调用放在线程中执行。返回的 labels 非空时视为拒绝。
+    """
+
+    name = "aliyun"
+
+    def __init__(self,
+                 access_key_id: str,
+                 access_key_secret: str,
+                 region: str = "cn-shanghai",
+                 input_service: str = "chat_detection",
+                 output_service: str = "chat_detection"):
+        """
+        Args:
+            access_key_id: 阿里云 AccessKey ID
+            access_key_secret: 阿里云 AccessKey Secret
+            region: 服务区域
+            input_service: 审核用户消息使用的 service
+            output_service: 审核模型输出使用的 service
+        """
+        from alibabacloud_green20220302.client import Client
+        from alibabacloud_tea_openapi.models import Config
+
+        self.services = {"input": input_service, "output": output_service}
+        self._client = Client(Config(
+            access_key_id=access_key_id,
+            access_key_secret=access_key_secret,
+            region_id=region,
+            endpoint=f"green-cip.{region}.aliyuncs.com",
+            connect_timeout=3000,
+            read_timeout=6000
+        ))
+
+    async def check(self, text: str, kind: str) -> Verdict:
+        return await asyncio.to_thread(self._check, text, kind)
+
+    def _check(self, text: str, kind: str) -> Verdict:
+        from alibabacloud_green20220302 import models
+
+        request = models.TextModerationRequest(
+            service=self.services[kind],
+            service_parameters=json.dumps({"content": text}, ensure_ascii=False)
+        )
+        body = self._client.text_moderation(request).body
+        if body.code != 200:
+            raise RuntimeError(f"Aliyun green error {body.code}: {body.message}")
+        labels = body.data.labels if body.data else ""
+        return Verdict(not labels, labels or "", self.name)
+
+
+class Moderator:
+    """
+    带缓存和超时的审核
+
+    相同文本的审核结果按 (类型, 文本) 缓存; 审核服务出错或超时时按 fail_open 放行或拒绝。
+    """
+
+    def __init__(self,
+                 backend: ModerationBackend,
+                 timeout: float = 2.0,
+                 fail_open: bool = True,
+                 cache_size: int = 10000,
+                 cache_ttl_seconds: float = 3600):
+        """
+        Args:
+            backend: 审核后端
+            timeout: 单次审核的超时时间 (秒)
+            fail_open: 审核失败时是否放行
+            cache_size: 缓存的审核结果条数
+            cache_ttl_seconds: 审核结果缓存时间 (秒)
+        """
+        self.backend = backend
+        self.timeout = timeout
+        self.fail_open = fail_open
+        self._cache = LRUCache(max_size=cache_size, ttl_seconds=cache_ttl_seconds)
+
+        self.checks = 0
+        self.blocked = 0
+        self.errors = 0
+
+    async def check(self, text: str, kind: str) -> Verdict:
+        """
+        审核文本 (不抛出异常, 出错时按 fail_open 返回结果)
+
+        Args:
+            text: 文本
+            kind: "input" 或 "output"
+
+        Returns:
+            Verdict: 审核结果
+        """
+        if not text.strip():
+            return ALLOWED
+        key = (kind, text)
+        verdict = self._cache.get(key)
+        if verdict is None:
+            self.checks += 1
+            try:
+                verdict = await asyncio.wait_for(self.backend.check(text, kind), self.timeout)
+                self._cache.put(key, verdict)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logging.warning(f"Moderation {kind} check failed ({type(e).__name__}): {str(e)}")
+                # 失败的结果不缓存
+                verdict = ALLOWED if self.fail_open else Verdict(False, "moderation_unavailable", self.backend.name)
+
+        if not verdict.allowed:
+            self.blocked += 1
+        return verdict
+
+    def stats(self) -> Dict[str, Any]:
+        """审核指标"""
+        cache = self._cache.stats()
+        return {
+            "backend": self.backend.name,
+            "checks": self.checks,
+            "blocked": self.blocked,
+            "errors": self.errors,
+            "cache_hits": cache["hits"],
+            "cache_hit_rate": cache["hit_rate"]
+        }
+
+
+def create_moderator(settings) -> Optional[Moderator]:
+    """
+    按配置创建审核 (MODERATION_BACKEND 为空时不审核)
+
+    Args:
+        settings: Settings
+
+    Returns:
+        Optional[Moderator]: 审核, 未启用时为 None
+    """
+    name = settings.moderation_backend
+    if not name or name == "none":
+        return None
+    if name == "keyword":
+        backend: ModerationBackend = KeywordModerationBackend(settings.moderation_patterns)
+    elif name == "aliyun":
+        backend = AliyunGreenBackend(
+            settings.aliyun_access_key_id,
+            settings.aliyun_access_key_secret,
+            region=settings.aliyun_green_region
+        )
+    else:
+        raise ValueError(f"Unknown moderation backend: {name}")
+
+    logging.info(f"Moderation enabled ({backend.name})")
+    return Moderator(
+        backend,
+        timeout=settings.moderation_timeout,
+        fail_open=settings.moderation_fail_open,
+        cache_size=settings.moderation_cache_size,
+        cache_ttl_seconds=settings.moderation_cache_ttl_seconds
+    )
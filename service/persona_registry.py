@@ -0,0 +1,349 @@
+# service/persona_registry.py
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from api.models import Character, Scene
+from prompts.chat.dialogue_control import DialogueControl
+from utils import json_codec
+from utils.lru_cache import LRUCache
+
+
+class RegistryError(Exception):
+    """注册表操作失败, API 层返回 status_code"""
+
+    status_code = 400
+
+
+class RegistryNotFoundError(RegistryError):
+    """角色/场景 (或指定版本) 不存在"""
+
+    status_code = 404
+
+
+class RegistryConflictError(RegistryError):
+    """创建时 ID 已存在"""
+
+    status_code = 409
+
+
+class RegistryPreconditionError(RegistryError):
+    """If-Match 与当前最新版本的 ETag 不一致"""
+
+    status_code = 412
+
+
+class RegistryEntry:
+    """注册表中某个角色/场景的一个版本 (不可变)"""
+
+    __slots__ = ("kind", "entry_id", "version", "data", "fragment", "etag", "created_at")
+
+    def __init__(self, kind: str, entry_id: str, version: int, data: Dict[str, Any],
+                 fragment: str, etag: str, created_at: float):
+        self.kind = kind
+        self.entry_id = entry_id
+        self.version = version
+        self.data = data
+        # 预先渲染好的提示词片段 (角色信息或场景描述), 热路径直接使用
+        self.fragment = fragment
+        self.etag = etag
+        self.created_at = created_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        """接口返回内容"""
+        return {
+            "id": self.entry_id,
+            "version": self.version,
+            "etag": self.etag,
+            "created_at": self.created_at,
+            **self.data
+        }
+
+
+class PersonaRegistry:
+    """
+    角色和场景注册表
+
+    每次写入生成一个新版本 (版本号递增, 旧版本保留, 可按版本读取),
+    同时保存渲染好的提示词片段, 请求只需引用 ID, 不再携带和渲染完整的角色文本。
+    ETag 由内容和版本号计算。
+
+    两级存储:
+    - SQLite 文件 (WAL, 多个 worker 共享), 连接在首次使用时按进程打开;
+      未指定文件时使用进程内的内存数据库 (每个进程各自一份, 不持久化)
+    - 进程内的读穿 LRU 缓存; 指定版本的记录不会改变, 最新版本的映射最多延迟 cache_ttl_seconds
+      看到其他 worker 的写入 (本进程的写入立即可见)
+
+    数据库操作都在注册表线程中按顺序执行 (每个进程一个线程, 与会话存储相同):
+    事件循环中使用 aget / acreate / aput / alist, 缓存命中时 aget 不切换线程;
+    同步接口同样交给注册表线程并等待结果, 用于启动时写入预设和测试。
+    """
+
+    KINDS = ("character", "scene")
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 cache_size: int = 1024,
+                 cache_ttl_seconds: float = 5.0,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            path: SQLite 文件路径, 为空时使用内存数据库
+            cache_size: 进程内缓存的条数
+            cache_ttl_seconds: 缓存过期时间 (秒)
+            clock: 时钟函数 (创建时间)
+        """
+        self.path = path or ":memory:"
+        self._clock = clock
+        self._cache = LRUCache(max_size=cache_size, ttl_seconds=cache_ttl_seconds)
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        self.reads = 0
+        self.writes = 0
+
+    def create(self, kind: str, data: Dict[str, Any], entry_id: Optional[str] = None) -> RegistryEntry:
+        """
+        创建新的角色/场景 (版本 1)
+
+        Args:
+            kind: "character" 或 "scene"
+            data: 内容 (Character/Scene 的字段, 角色可带 greeting)
+            entry_id: ID, 默认随机生成
+
+        Returns:
+            RegistryEntry: 新记录
+
+        Raises:
+            RegistryConflictError: ID 已存在 (包括其他 worker 同时创建了同一 ID)
+        """
+        return self._call(self._create, kind, data, entry_id)
+
+    def put(self, kind: str, entry_id: str, data: Dict[str, Any],
+            if_match: Optional[str] = None) -> RegistryEntry:
+        """
+        写入新版本 (不存在时创建版本 1)
+
+        Args:
+            kind: "character" 或 "scene"
+            entry_id: ID
+            data: 内容
+            if_match: 期望的当前最新版本 ETag, 不一致时拒绝写入 (乐观并发控制)
+
+        Returns:
+            RegistryEntry: 新版本
+
+        Raises:
+            RegistryPreconditionError: if_match 不一致
+        """
+        return self._call(self._put, kind, entry_id, data, if_match)
+
+    def get(self, kind: str, entry_id: str, version: Optional[int] = None) -> RegistryEntry:
+        """
+        读取记录 (先查进程内缓存)
+
+        Args:
+            kind: "character" 或 "scene"
+            entry_id: ID
+            version: 版本号, 默认最新版本
+
+        Raises:
+            RegistryNotFoundError: 不存在
+        """
+        entry = self._cache.get((kind, entry_id, version))
+        if entry is not None:
+            return entry
+        return self._call(self._load, kind, entry_id, version)
+
+    def list(self, kind: str) -> List[RegistryEntry]:
+        """所有 ID 的最新版本 (按 ID 排序)"""
+        return self._call(self._list, kind)
+
+    async def acreate(self, kind: str, data: Dict[str, Any], entry_id: Optional[str] = None) -> RegistryEntry:
+        """create 的异步版本 (在注册表线程中执行)"""
+        return await self._run(self._create, kind, data, entry_id)
+
+    async def aput(self, kind: str, entry_id: str, data: Dict[str, Any],
+                   if_match: Optional[str] = None) -> RegistryEntry:
+        """put 的异步版本 (在注册表线程中执行)"""
+        return await self._run(self._put, kind, entry_id, data, if_match)
+
+    async def aget(self, kind: str, entry_id: str, version: Optional[int] = None) -> RegistryEntry:
+        """get 的异步版本, 缓存未命中时才在注册表线程中读取文件"""
+        entry = self._cache.get((kind, entry_id, version))
+        if entry is not None:
+            return entry
+        return await self._run(self._load, kind, entry_id, version)
+
+    async def alist(self, kind: str) -> List[RegistryEntry]:
+        """list 的异步版本 (在注册表线程中执行)"""
+        return await self._run(self._list, kind)
+
+    def seed(self, kind: str, entries: Iterable[Dict[str, Any]]):
+        """
+        写入预设记录 (已存在的 ID 不覆盖, 多个 worker 同时启动时只有一个写入成功)
+
+        Args:
+            kind: "character" 或 "scene"
+            entries: 带 id 字段的内容
+        """
+        for item in entries:
+            data = dict(item)
+            entry_id = data.pop("id")
+            try:
+                self.create(kind, data, entry_id)
+            except RegistryConflictError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """注册表指标"""
+        cache = self._cache.stats()
+        return {
+            "reads": self.reads,
+            "writes": self.writes,
+            "cache_size": cache["size"],
+            "cache_hits": cache["hits"],
+            "cache_misses": cache["misses"],
+            "cache_hit_rate": cache["hit_rate"]
+        }
+
+    def close(self):
+        """关闭当前进程的连接和注册表线程"""
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=True)
+        self._executor = None
+        if self._db is not None and self._pid == os.getpid():
+            self._db.close()
+        self._db = None
+
+    @staticmethod
+    def render_fragment(kind: str, data: Dict[str, Any]) -> str:
+        """渲染提示词片段 (写入时调用一次)"""
+        if kind == "character":
+            return DialogueControl.build_character_info(
+                Character(name=data["name"], background=data["background"], personality=data["personality"])
+            )
+        return DialogueControl.build_context(Scene(description=data["description"], mood=data.get("mood")))
+
+    async def _run(self, func: Callable, *args):
+        """在注册表线程中执行"""
+        return await asyncio.get_running_loop().run_in_executor(self._thread(), func, *args)
+
+    def _call(self, func: Callable, *args):
+        """在注册表线程中执行并等待结果 (同步接口使用, 不能在注册表线程中调用)"""
+        return self._thread().submit(func, *args).result()
+
+    def _thread(self) -> ThreadPoolExecutor:
+        """当前进程的注册表线程 (fork 之后重新创建)"""
+        if self._executor is None or self._pid != os.getpid():
+            self._db = None
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="registry")
+        return self._executor
+
+    def _create(self, kind: str, data: Dict[str, Any], entry_id: Optional[str]) -> RegistryEntry:
+        entry_id = entry_id or hashlib.sha256(os.urandom(16)).hexdigest()[:16]
+        if self._latest_row(kind, entry_id) is not None:
+            raise RegistryConflictError(f"{kind} already exists: {entry_id}")
+        try:
+            return self._insert(kind, entry_id, 1, data)
+        except RegistryPreconditionError:
+            raise RegistryConflictError(f"{kind} already exists: {entry_id}") from None
+
+    def _put(self, kind: str, entry_id: str, data: Dict[str, Any], if_match: Optional[str]) -> RegistryEntry:
+        latest = self._latest_row(kind, entry_id)
+        if if_match is not None and if_match != "*":
+            if latest is None or latest.etag != if_match.strip():
+                raise RegistryPreconditionError(f"ETag mismatch for {kind} {entry_id}")
+        version = latest.version + 1 if latest is not None else 1
+        return self._insert(kind, entry_id, version, data)
+
+    def _load(self, kind: str, entry_id: str, version: Optional[int]) -> RegistryEntry:
+        """从文件读取并写入缓存"""
+        self.reads += 1
+        if version is None:
+            entry = self._latest_row(kind, entry_id)
+        else:
+            row = self._conn().execute(
+                "SELECT version, data, fragment, etag, created_at FROM registry "
+                "WHERE kind = ? AND entry_id = ? AND version = ?",
+                (kind, entry_id, version)
+            ).fetchone()
+            entry = self._entry(kind, entry_id, row) if row is not None else None
+
+        if entry is None:
+            suffix = f" (version {version})" if version is not None else ""
+            raise RegistryNotFoundError(f"{kind} not found: {entry_id}{suffix}")
+        self._cache.put((kind, entry_id, version), entry)
+        return entry
+
+    def _list(self, kind: str) -> List[RegistryEntry]:
+        self.reads += 1
+        rows = self._conn().execute(
+            "SELECT r.entry_id, r.version, r.data, r.fragment, r.etag, r.created_at FROM registry r "
+            "JOIN (SELECT entry_id, MAX(version) AS version FROM registry WHERE kind = ? GROUP BY entry_id) m "
+            "ON r.entry_id = m.entry_id AND r.version = m.version WHERE r.kind = ? ORDER BY r.entry_id",
+            (kind, kind)
+        ).fetchall()
+        return [self._entry(kind, row[0], row[1:]) for row in rows]
+
+    def _insert(self, kind: str, entry_id: str, version: int, data: Dict[str, Any]) -> RegistryEntry:
+        """写入一个版本并更新缓存 (在注册表线程中执行, 同一进程的写入按顺序进行)"""
+        if kind not in self.KINDS:
+            raise RegistryError(f"Unknown kind: {kind}")
+        body = json_codec.dumps_str(data)
+        etag = '"' + hashlib.sha256(f"{kind}\x1f{entry_id}\x1f{version}\x1f{body}".encode("utf-8")).hexdigest()[:32] + '"'
+        entry = RegistryEntry(kind, entry_id, version, data, self.render_fragment(kind, data),
+                              etag, self._clock())
+
+        db = self._conn()
+        try:
+            with db:
+                db.execute(
+                    "INSERT INTO registry (kind, entry_id, version, data, fragment, etag, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (kind, entry_id, version, body, entry.fragment, etag, entry.created_at)
+                )
+        except sqlite3.IntegrityError:
+            # 其他 worker 同时写入了同一版本
+            raise RegistryPreconditionError(f"Concurrent update of {kind} {entry_id}")
+
+        self.writes += 1
+        self._cache.put((kind, entry_id, version), entry)
+        self._cache.put((kind, entry_id, None), entry)
+        return entry
+
+    def _latest_row(self, kind: str, entry_id: str) -> Optional[RegistryEntry]:
+        """从文件读取最新版本"""
+        row = self._conn().execute(
+            "SELECT version, data, fragment, etag, created_at FROM registry "
+            "WHERE kind = ? AND entry_id = ? ORDER BY version DESC LIMIT 1",
+            (kind, entry_id)
+        ).fetchone()
+        return self._entry(kind, entry_id, row) if row is not None else None
+
+    @staticmethod
+    def _entry(kind: str, entry_id: str, row: tuple) -> RegistryEntry:
+        version, data, fragment, etag, created_at = row
+        return RegistryEntry(kind, entry_id, version, json_codec.loads(data), fragment, etag, created_at)
+
+    def _conn(self) -> sqlite3.Connection:
+        """当前进程的连接 (只在注册表线程中使用, fork 之后由 _thread 重置)"""
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS registry ("
+                "kind TEXT NOT NULL, entry_id TEXT NOT NULL, version INTEGER NOT NULL, "
+                "data TEXT NOT NULL, fragment TEXT NOT NULL, etag TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (kind, entry_id, version))"
+            )
+            self._db.commit()
+        return self._db
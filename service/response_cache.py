@@ -0,0 +1,244 @@
+# service/response_cache.py
+
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from utils.lru_cache import LRUCache
+
+
+class ResponseCache:
+    """
+    模型回复的精确匹配缓存
+
+    缓存键由模型、系统提示词、历史消息、当前消息和采样参数共同决定。
+    每个键保存一个回复池 (最多 variants 条): 池未满时视为未命中, 新生成的回复加入池中;
+    池满后随机返回其中一条, 避免相同输入总是得到一模一样的回复。
+
+    两级存储:
+    - 内存 LRU (有界, 带过期时间)
+    - 可选的 SQLite 文件 (进程重启或多进程间共享), 内存未命中时读取并回填内存
+
+    SQLite 操作在专用的单个线程中执行: 写入在后台进行 (put 不等待),
+    请求路径上的读取使用 aget / apool_size, 不阻塞事件循环。
+    过期记录按 purge_interval 周期删除 (created_at 有索引), 而不是每次写入都删除。
+    """
+
+    def __init__(self,
+                 max_size: int = 10000,
+                 ttl_seconds: float = 3600,
+                 variants: int = 3,
+                 sqlite_path: Optional[str] = None,
+                 purge_interval: float = 60.0,
+                 rng: Optional[random.Random] = None):
+        """
+        Args:
+            max_size: 内存中缓存的键数上限
+            ttl_seconds: 缓存过期时间 (秒)
+            variants: 每个键保存的回复条数
+            sqlite_path: SQLite 文件路径, None 表示只使用内存
+            purge_interval: 两次删除过期记录之间的最小间隔 (秒)
+            rng: 随机数生成器, 便于测试
+        """
+        self.ttl_seconds = ttl_seconds
+        self.variants = variants
+        self._memory = LRUCache(max_size=max_size, ttl_seconds=ttl_seconds)
+        self._rng = rng or random.Random()
+        self.purge_interval = purge_interval
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._last_purge = float("-inf")
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.latency_saved = 0.0
+
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT NOT NULL, response TEXT NOT NULL, "
+                "latency REAL NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_response_cache_key ON response_cache (key)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_response_cache_created_at ON response_cache (created_at)"
+            )
+            self._db.commit()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response-cache")
+
+    @staticmethod
+    def make_key(model_id: str,
+                 system_prompt: Optional[str],
+                 messages: List[Dict[str, str]],
+                 user_message: str,
+                 sampling: Dict[str, Any]) -> str:
+        """
+        计算缓存键
+
+        Args:
+            model_id: 模型 ID
+            system_prompt: 系统提示词
+            messages: 历史消息
+            user_message: 当前用户消息
+            sampling: 采样参数
+
+        Returns:
+            str: 缓存键 (sha256)
+        """
+        digest = hashlib.sha256()
+        for part in (model_id, system_prompt or "", user_message):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x1f")
+        for msg in messages:
+            digest.update(msg["role"].encode("utf-8"))
+            digest.update(b"\x1e")
+            digest.update(msg["content"].encode("utf-8"))
+            digest.update(b"\x1f")
+        digest.update(json.dumps(sampling, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        读取缓存
+
+        Returns:
+            Optional[str]: 回复池已满时返回其中一条, 否则返回 None
+        """
+        return self._choose(self._load(key))
+
+    async def aget(self, key: str) -> Optional[str]:
+        """get 的异步版本 (内存未命中时在 SQLite 线程中读取)"""
+        return self._choose(await self._aload(key))
+
+    def pool_size(self, key: str) -> int:
+        """键的回复池中已有的回复条数 (不计入命中统计)"""
+        entry = self._load(key)
+        return len(entry["responses"]) if entry is not None else 0
+
+    async def apool_size(self, key: str) -> int:
+        """pool_size 的异步版本"""
+        entry = await self._aload(key)
+        return len(entry["responses"]) if entry is not None else 0
+
+    def put(self, key: str, response: str, latency: float):
+        """
+        把新生成的回复加入回复池 (SQLite 在后台线程中写入)
+
+        Args:
+            key: 缓存键
+            response: 回复内容
+            latency: 生成耗时 (秒), 用于统计命中节省的时间
+        """
+        entry = self._memory.get(key) or {"responses": [], "latency": 0.0}
+        if len(entry["responses"]) >= self.variants:
+            return
+
+        count = len(entry["responses"])
+        entry["latency"] = (entry["latency"] * count + latency) / (count + 1)
+        entry["responses"].append(response)
+        self._memory.put(key, entry)
+
+        if self._executor is not None:
+            self._executor.submit(self._write, key, response, latency)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存指标"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "disk_hits": self.disk_hits,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+            "memory": self._memory.stats(),
+            "sqlite": self._db is not None
+        }
+
+    def close(self):
+        """等待后台写入完成并关闭 SQLite 连接"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _choose(self, entry: Optional[Dict[str, Any]]) -> Optional[str]:
+        """回复池已满时随机返回一条并计入命中"""
+        if entry is None or len(entry["responses"]) < self.variants:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.latency_saved += entry["latency"]
+        return self._rng.choice(entry["responses"])
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        """先查内存, 未命中时从 SQLite 回填"""
+        entry = self._memory.get(key)
+        if entry is not None or self._db is None:
+            return entry
+        return self._fill(key, self._read(key))
+
+    async def _aload(self, key: str) -> Optional[Dict[str, Any]]:
+        """_load 的异步版本"""
+        entry = self._memory.get(key)
+        if entry is not None or self._executor is None:
+            return entry
+        rows = await asyncio.get_running_loop().run_in_executor(self._executor, self._read, key)
+        # 等待期间可能已有新生成的回复写入内存
+        return self._memory.get(key) or self._fill(key, rows)
+
+    def _fill(self, key: str, rows: List[Tuple[str, float]]) -> Optional[Dict[str, Any]]:
+        """用 SQLite 中读取的记录回填内存"""
+        if not rows:
+            return None
+
+        entry = {
+            "responses": [row[0] for row in rows],
+            "latency": sum(row[1] for row in rows) / len(rows)
+        }
+        if len(entry["responses"]) >= self.variants:
+            self.disk_hits += 1
+        self._memory.put(key, entry)
+        return entry
+
+    def _read(self, key: str) -> List[Tuple[str, float]]:
+        """读取键未过期的记录"""
+        try:
+            return self._db.execute(
+                "SELECT response, latency FROM response_cache "
+                "WHERE key = ? AND created_at >= ? ORDER BY created_at LIMIT ?",
+                (key, time.time() - self.ttl_seconds, self.variants)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to read response cache: {str(e)}")
+            return []
+
+    def _write(self, key: str, response: str, latency: float):
+        """写入一条回复, 按 purge_interval 周期删除过期记录 (在 SQLite 线程中执行)"""
+        try:
+            now = time.time()
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO response_cache (key, response, latency, created_at) VALUES (?, ?, ?, ?)",
+                    (key, response, latency, now)
+                )
+                if now - self._last_purge >= self.purge_interval:
+                    self._last_purge = now
+                    self._db.execute(
+                        "DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+                    )
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to write response cache: {str(e)}")
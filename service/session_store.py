@@ -0,0 +1,532 @@
+# service/session_store.py
+
+import asyncio
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from utils import json_codec
+
+
+class Session:
+    """单个会话: 服务端保存的对话历史及其锁"""
+
+    def __init__(self, session_id: str, now: float):
+        self.session_id = session_id
+        self.messages: List[Dict[str, str]] = []
+        self.size_bytes = 0
+        self.last_access = now
+        # 同一会话的请求串行执行, 保证历史顺序
+        self.lock = asyncio.Lock()
+
+
+class SessionStore:
+    """
+    有界会话存储
+
+    按最近访问顺序保存会话 (OrderedDict), 通过以下规则回收内存:
+    - 空闲超过 ttl_seconds 的会话过期删除
+    - 会话数超过 max_sessions 或总大小超过 max_bytes 时淘汰最久未访问的会话
+    """
+
+    def __init__(self,
+                 max_sessions: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: float = 1800,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            max_sessions: 最大会话数
+            max_bytes: 所有会话消息内容的总大小上限 (字节)
+            ttl_seconds: 空闲过期时间 (秒)
+            clock: 时钟函数, 便于测试
+        """
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.lru_evictions = 0
+        self.ttl_evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """获取会话 (不存在或已过期返回 None)"""
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_access = self._clock()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def get_or_create(self, session_id: str) -> Session:
+        """获取会话, 不存在时创建"""
+        session = self.get(session_id)
+        if session is not None:
+            self.hits += 1
+            return session
+
+        self.misses += 1
+        session = Session(session_id, self._clock())
+        self._sessions[session_id] = session
+        self._evict(keep=session_id)
+        return session
+
+    def append(self, session: Session, messages: List[Dict[str, str]]):
+        """
+        向会话追加消息
+
+        如果会话在请求处理期间已被淘汰, 会重新放回存储, 避免丢失正在进行的对话。
+        """
+        if session.session_id not in self._sessions:
+            self._sessions[session.session_id] = session
+            self._total_bytes += session.size_bytes
+
+        added = sum(self._message_size(m) for m in messages)
+        session.messages.extend(messages)
+        session.size_bytes += added
+        session.last_access = self._clock()
+        self._total_bytes += added
+        self._sessions.move_to_end(session.session_id)
+        self._evict(keep=session.session_id)
+
+    def replace(self, session: Session, messages: List[Dict[str, str]]):
+        """用客户端提供的历史覆盖会话历史"""
+        self._total_bytes -= session.size_bytes
+        session.messages = []
+        session.size_bytes = 0
+        self.append(session, messages)
+
+    # 异步接口 (与 SqliteSessionStore 一致; 内存操作不阻塞, 直接执行)
+    @contextlib.asynccontextmanager
+    async def alocked(self, session_id: str) -> AsyncIterator[Session]:
+        """取得会话 (不存在时创建) 并持有会话锁, 同一会话的请求串行执行"""
+        session = await self.aget_or_create(session_id)
+        async with session.lock:
+            yield session
+
+    async def aget(self, session_id: str) -> Optional[Session]:
+        return self.get(session_id)
+
+    async def aget_or_create(self, session_id: str) -> Session:
+        return self.get_or_create(session_id)
+
+    async def aappend(self, session: Session, messages: List[Dict[str, str]]):
+        self.append(session, messages)
+
+    async def areplace(self, session: Session, messages: List[Dict[str, str]]):
+        self.replace(session, messages)
+
+    async def adelete(self, session_id: str) -> bool:
+        return self.delete(session_id)
+
+    async def astats(self) -> Dict[str, int]:
+        return self.stats()
+
+    def delete(self, session_id: str) -> bool:
+        """删除会话"""
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._total_bytes -= session.size_bytes
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        """存储指标"""
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "lru_evictions": self.lru_evictions,
+            "ttl_evictions": self.ttl_evictions
+        }
+
+    def _expire(self):
+        """删除空闲过期的会话 (最久未访问的在最前面)"""
+        deadline = self._clock() - self.ttl_seconds
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access > deadline:
+                break
+            self.delete(session_id)
+            self.ttl_evictions += 1
+
+    def _evict(self, keep: str):
+        """超出数量或大小上限时淘汰最久未访问的会话 (不淘汰 keep)"""
+        self._expire()
+        while len(self._sessions) > 1 and (
+                len(self._sessions) > self.max_sessions or self._total_bytes > self.max_bytes):
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                self._sessions.move_to_end(keep)
+                session_id = next(iter(self._sessions))
+            self.delete(session_id)
+            self.lru_evictions += 1
+
+    @staticmethod
+    def _message_size(message: Dict[str, str]) -> int:
+        return len(message["content"].encode("utf-8"))
+
+
+class SqliteSessionStore:
+    """
+    多进程共享的会话存储 (SQLite WAL)
+
+    与 SessionStore 接口相同, 会话历史保存在 SQLite 文件中, 同一台机器上的所有 worker
+    看到同样的会话; 每次 get_or_create 都从文件读取最新历史。
+    同一进程内同一会话的请求共享一把锁 (串行执行); 跨进程不加锁。
+    过期和淘汰在写入时按 maintenance_interval 周期执行, 避免每次写入都扫描全表;
+    读取时的访问时间先记在内存中, 同样按 maintenance_interval 批量写入, 读取本身不写文件。
+    连接在首次使用时按进程打开 (gunicorn 预加载后 fork 出的 worker 不共用连接)。
+
+    所有数据库操作都在本存储专用的单个线程中按顺序执行 (共用一个连接, 事务不会交错)。
+    请求路径上使用异步接口 (alocked / aget / aappend / areplace / adelete / astats),
+    其他 worker 长时间占用写锁时 (最多等待 5 秒) 也不会阻塞事件循环; 同步接口在存储线程中执行并等待结果,
+    只用于测试和脚本。stats() 不访问文件, 返回最近一次维护或 astats() 得到的共享计数
+    (可以在 /metrics 的 collector 中调用)。
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_sessions: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: float = 1800,
+                 maintenance_interval: float = 1.0,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            path: SQLite 文件路径
+            max_sessions: 最大会话数
+            max_bytes: 所有会话消息内容的总大小上限 (字节)
+            ttl_seconds: 空闲过期时间 (秒)
+            maintenance_interval: 两次过期/淘汰检查之间的最小间隔 (秒)
+            clock: 时钟函数 (跨进程比较, 使用墙上时间)
+        """
+        self.path = path
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.maintenance_interval = maintenance_interval
+        self._clock = clock
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._last_maintenance = float("-inf")
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        # 所有 worker 共享的会话数和总大小 (维护时或 astats() 时更新)
+        self._shared_counts: Tuple[int, int] = (0, 0)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # 读取过但还没有写入文件的访问时间
+        self._touched: Dict[str, float] = {}
+        self._touch_lock = threading.Lock()
+        self._last_flush = float("-inf")
+
+        self.hits = 0
+        self.misses = 0
+        self.lru_evictions = 0
+        self.ttl_evictions = 0
+
+    def __len__(self) -> int:
+        return self._call(self._count)[0]
+
+    def __contains__(self, session_id: str) -> bool:
+        return self._call(self._load, session_id) is not None
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """获取会话 (不存在或已过期返回 None)"""
+        messages = self._call(self._load, session_id)
+        if messages is None:
+            return None
+        return self._session(session_id, messages)
+
+    def get_or_create(self, session_id: str) -> Session:
+        """获取会话, 不存在时创建"""
+        return self._session(session_id, self._call(self._load_or_create, session_id))
+
+    def append(self, session: Session, messages: List[Dict[str, str]]):
+        """向会话追加消息 (会话已被删除时重新创建)"""
+        self._apply_append(session, messages, *self._call(self._write_append, session.session_id, messages))
+
+    def replace(self, session: Session, messages: List[Dict[str, str]]):
+        """用客户端提供的历史覆盖会话历史"""
+        self._apply_replace(session, messages, *self._call(self._write_replace, session.session_id, messages))
+
+    def delete(self, session_id: str) -> bool:
+        """删除会话"""
+        return self._call(self._delete, session_id)
+
+    @contextlib.asynccontextmanager
+    async def alocked(self, session_id: str) -> AsyncIterator[Session]:
+        """
+        取得会话 (不存在时创建) 并持有会话锁
+
+        先取得本进程内该会话的锁, 再在锁内读取历史: 同一会话上排队的请求读到的是
+        前一个请求写入之后的历史。
+        """
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        async with lock:
+            yield await self.aget_or_create(session_id)
+
+    async def aget(self, session_id: str) -> Optional[Session]:
+        """get 的异步版本 (在存储线程中读取)"""
+        messages = await self._run(self._load, session_id)
+        if messages is None:
+            return None
+        return self._session(session_id, messages)
+
+    async def aget_or_create(self, session_id: str) -> Session:
+        """get_or_create 的异步版本 (在存储线程中读取)"""
+        return self._session(session_id, await self._run(self._load_or_create, session_id))
+
+    async def aappend(self, session: Session, messages: List[Dict[str, str]]):
+        """append 的异步版本 (在存储线程中写入)"""
+        self._apply_append(session, messages, *await self._run(self._write_append, session.session_id, messages))
+
+    async def areplace(self, session: Session, messages: List[Dict[str, str]]):
+        """replace 的异步版本 (在存储线程中写入)"""
+        self._apply_replace(session, messages, *await self._run(self._write_replace, session.session_id, messages))
+
+    async def adelete(self, session_id: str) -> bool:
+        """delete 的异步版本 (在存储线程中删除)"""
+        return await self._run(self._delete, session_id)
+
+    async def astats(self) -> Dict[str, int]:
+        """读取最新的共享计数后返回 stats()"""
+        await self._run(self._count)
+        return self.stats()
+
+    def stats(self) -> Dict[str, int]:
+        """存储指标 (会话数和总大小为所有 worker 共享的值, 取最近一次读取的结果; 不访问文件)"""
+        count, total = self._shared_counts
+        return {
+            "sessions": count,
+            "bytes": total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "lru_evictions": self.lru_evictions,
+            "ttl_evictions": self.ttl_evictions
+        }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._db is not None:
+            self._flush_touched(force=True)
+            self._db.close()
+            self._db = None
+
+    async def _run(self, func: Callable, *args):
+        """在存储线程中执行 (每个进程一个线程, 数据库操作按顺序执行)"""
+        if self._executor is None or self._pid != os.getpid():
+            self._conn()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _call(self, func: Callable, *args):
+        """在存储线程中执行并等待结果 (同步接口使用, 不能在存储线程中调用)"""
+        if self._executor is None or self._pid != os.getpid():
+            self._conn()
+        return self._executor.submit(func, *args).result()
+
+    def _count(self) -> Tuple[int, int]:
+        """读取共享的会话数和总大小"""
+        self._shared_counts = tuple(self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM sessions"
+        ).fetchone())
+        return self._shared_counts
+
+    def _delete(self, session_id: str) -> bool:
+        db = self._conn()
+        with db:
+            deleted = db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+            db.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+        return deleted > 0
+
+    def _conn(self) -> sqlite3.Connection:
+        """当前进程的连接 (fork 之后重新打开)"""
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sessions")
+            self._touched = {}
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, size_bytes INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS session_messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, message TEXT NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_session_messages ON session_messages (session_id, id)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions (last_access)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _load(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        """读取会话历史 (不存在或已过期返回 None), 访问时间稍后批量写入"""
+        db = self._conn()
+        now = self._clock()
+        row = db.execute("SELECT last_access FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        with self._touch_lock:
+            last_access = max(row[0], self._touched.get(session_id, row[0]))
+        if last_access < now - self.ttl_seconds:
+            self._delete(session_id)
+            self.ttl_evictions += 1
+            return None
+
+        rows = db.execute(
+            "SELECT message FROM session_messages WHERE session_id = ? ORDER BY id", (session_id,)
+        ).fetchall()
+        with self._touch_lock:
+            self._touched[session_id] = now
+        self._flush_touched()
+        return [json_codec.loads(message) for (message,) in rows]
+
+    def _load_or_create(self, session_id: str) -> List[Dict[str, str]]:
+        """读取会话历史, 不存在时创建空会话"""
+        messages = self._load(session_id)
+        if messages is not None:
+            self.hits += 1
+            return messages
+
+        self.misses += 1
+        db = self._conn()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, size_bytes, last_access) VALUES (?, 0, ?)",
+                (session_id, self._clock())
+            )
+            db.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+        return []
+
+    def _write_append(self, session_id: str, messages: List[Dict[str, str]]) -> Tuple[int, float]:
+        """写入追加的消息, 返回 (增加的字节数, 访问时间)"""
+        added = sum(SessionStore._message_size(m) for m in messages)
+        now = self._clock()
+        db = self._conn()
+        with db:
+            db.execute(
+                "INSERT INTO sessions (session_id, size_bytes, last_access) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET "
+                "size_bytes = size_bytes + excluded.size_bytes, last_access = excluded.last_access",
+                (session_id, added, now)
+            )
+            db.executemany(
+                "INSERT INTO session_messages (session_id, message) VALUES (?, ?)",
+                [(session_id, json_codec.dumps_str(m)) for m in messages]
+            )
+        with self._touch_lock:
+            self._touched.pop(session_id, None)
+        self._maintain(keep=session_id)
+        return added, now
+
+    def _write_replace(self, session_id: str, messages: List[Dict[str, str]]) -> Tuple[int, float]:
+        """清空历史后写入新的消息 (一个事务), 返回 (字节数, 访问时间)"""
+        db = self._conn()
+        with db:
+            db.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            db.execute("UPDATE sessions SET size_bytes = 0 WHERE session_id = ?", (session_id,))
+        return self._write_append(session_id, messages)
+
+    @staticmethod
+    def _apply_append(session: Session, messages: List[Dict[str, str]], added: int, now: float):
+        session.messages.extend(messages)
+        session.size_bytes += added
+        session.last_access = now
+
+    @staticmethod
+    def _apply_replace(session: Session, messages: List[Dict[str, str]], added: int, now: float):
+        session.messages = list(messages)
+        session.size_bytes = added
+        session.last_access = now
+
+    def _flush_touched(self, force: bool = False):
+        """把读取时记录的访问时间批量写入 (按 maintenance_interval 周期)"""
+        now = self._clock()
+        if not force and now - self._last_flush < self.maintenance_interval:
+            return
+        self._last_flush = now
+        with self._touch_lock:
+            touched, self._touched = self._touched, {}
+        if touched:
+            db = self._conn()
+            with db:
+                db.executemany(
+                    "UPDATE sessions SET last_access = MAX(last_access, ?) WHERE session_id = ?",
+                    [(last_access, session_id) for session_id, last_access in touched.items()]
+                )
+
+    def _session(self, session_id: str, messages: List[Dict[str, str]]) -> Session:
+        """创建 Session 对象, 同一进程内同一会话共享锁"""
+        session = Session(session_id, self._clock())
+        session.messages = messages
+        session.size_bytes = sum(SessionStore._message_size(m) for m in messages)
+        lock = self._locks.get(session_id)
+        if lock is None:
+            self._locks[session_id] = session.lock
+        else:
+            session.lock = lock
+        return session
+
+    def _maintain(self, keep: str):
+        """过期和淘汰 (按 maintenance_interval 周期执行)"""
+        now = self._clock()
+        if now - self._last_maintenance < self.maintenance_interval:
+            return
+        self._last_maintenance = now
+        # 先写入读取时记录的访问时间, 避免淘汰刚读取过的会话
+        self._flush_touched(force=True)
+
+        db = self._conn()
+        rows = db.execute(
+            "SELECT session_id, size_bytes, last_access FROM sessions WHERE session_id != ? ORDER BY last_access",
+            (keep,)
+        ).fetchall()
+        count = len(rows) + 1
+        total = sum(size for _, size, _ in rows) + db.execute(
+            "SELECT COALESCE(SUM(size_bytes), 0) FROM sessions WHERE session_id = ?", (keep,)
+        ).fetchone()[0]
+
+        # 从最久未访问的开始: 先删除过期的, 再删除到满足数量和大小上限
+        removed = []
+        for session_id, size, last_access in rows:
+            if last_access < now - self.ttl_seconds:
+                self.ttl_evictions += 1
+            elif count > self.max_sessions or total > self.max_bytes:
+                self.lru_evictions += 1
+            else:
+                break
+            removed.append((session_id,))
+            count -= 1
+            total -= size
+
+        if removed:
+            with db:
+                db.executemany("DELETE FROM sessions WHERE session_id = ?", removed)
+                db.executemany("DELETE FROM session_messages WHERE session_id = ?", removed)
+        self._shared_counts = (count, total)
@@ -0,0 +1,67 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.ai.fake_bedrock import FakeBedrockRuntime  # noqa: E402
+
+
+class FakeBedrock(FakeBedrockRuntime):
+    """固定延迟、固定回复的离线 Bedrock; 最后一条消息以 "boom" 结尾时调用失败"""
+
+    CHUNK_SIZE = 3
+
+    def __init__(self, latency: float = 0.2, text: str = "hey there 😉"):
+        super().__init__(latency=latency, text=text)
+
+    def invoke_model(self, body, modelId, accept="application/json", contentType="application/json"):
+        response = super().invoke_model(body, modelId, accept, contentType)
+        content = json.loads(body)["messages"][-1]["content"]
+        if isinstance(content, list):
+            content = content[-1]["text"]
+        if content.endswith("boom"):
+            raise RuntimeError("model exploded")
+        return response
+
+
+@pytest.fixture
+def fake_bedrock():
+    """创建 FakeBedrock 的工厂"""
+    return FakeBedrock
+
+
+@pytest.fixture(scope="session")
+def api_main(tmp_path_factory):
+    """导入 api.main (使用临时 .env 中的假凭证)"""
+    env_dir = tmp_path_factory.mktemp("env")
+    env_file = env_dir / ".env"
+    env_file.write_text(
+        "AWS_ACCESS_KEY_ID=AKIAFAKEFAKEFAKE0000\n"
+        "AWS_SECRET_ACCESS_KEY=fakefakefakefakefakefake\n"
+        "AWS_REGION=us-west-2\n"
+        f"REGISTRY_SQLITE_PATH={env_dir / 'registry.db'}\n"
+    )
+    os.environ["ENV_FILE"] = str(env_file)
+
+    import api.main
+    # 测试不经过 lifespan, 直接创建服务对象
+    api.main.init_services()
+    return api.main
+
+
+@pytest.fixture
+def chat_payload():
+    return {
+        "character": {
+            "name": "Jake",
+            "background": "Bass player in a local band",
+            "personality": "Spontaneous, flirty"
+        },
+        "scene": {"description": "a quiet lab", "mood": "calm"},
+        "message": "hi",
+        "message_history": []
+    }
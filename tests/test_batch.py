@@ -0,0 +1,52 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from core.ai.claude_client import ClaudeClient
+
+
+def _batch(chat_payload, n, **options):
+    items = []
+    for i in range(n):
+        items.append(dict(chat_payload, message="boom" if i == 3 else f"message {i}"))
+    return dict(options, requests=items)
+
+
+async def _post(app, path, payload):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        start = time.perf_counter()
+        response = await client.post(path, json=payload)
+        return time.perf_counter() - start, response
+
+
+def test_batch_returns_results_in_order_with_bounded_fan_out(api_main, chat_payload, fake_bedrock, monkeypatch):
+    latency = 0.2
+    fake = fake_bedrock(latency=latency)
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=64))
+
+    elapsed, response = asyncio.run(
+        _post(api_main.app, "/chat/batch", _batch(chat_payload, 20, max_concurrency=10))
+    )
+    results = response.json()["results"]
+
+    assert [r["index"] for r in results] == list(range(20))
+    assert "model exploded" in results[3]["error"]
+    assert all(r["response"] == fake.text for i, r in enumerate(results) if i != 3)
+    # 20 项, 并发 10 -> 约两轮模型延迟
+    assert latency * 2 <= elapsed < latency * 5
+
+
+def test_batch_streams_ndjson(api_main, chat_payload, fake_bedrock, monkeypatch):
+    fake = fake_bedrock(latency=0.01)
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=8))
+
+    _, response = asyncio.run(
+        _post(api_main.app, "/chat/batch", _batch(chat_payload, 6, stream=True))
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert sorted(line["index"] for line in lines) == list(range(6))
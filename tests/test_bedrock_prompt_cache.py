@@ -0,0 +1,107 @@
+import asyncio
+
+import httpx
+
+from core.ai.claude_client import CACHE_CHECKPOINT, ClaudeClient
+from utils.metrics import CACHE_READ_TOKENS
+
+
+def checkpoints(body):
+    blocks = list(body["system"]) if isinstance(body.get("system"), list) else []
+    for message in body["messages"]:
+        if isinstance(message["content"], list):
+            blocks.extend(message["content"])
+    return [block for block in blocks if block.get("cache_control") == CACHE_CHECKPOINT]
+
+
+def test_checkpoints_on_system_history_and_current_message(api_main, fake_bedrock):
+    client = ClaudeClient(bedrock=fake_bedrock(), max_concurrency=1)
+    history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hey"}]
+
+    body = client.build_body("persona", "what's up", history, prompt_caching=True)
+
+    assert body["system"] == [{"type": "text", "text": "persona", "cache_control": CACHE_CHECKPOINT}]
+    assert body["messages"][0] is history[0]
+    assert body["messages"][1]["content"][0]["text"] == "hey"
+    assert body["messages"][2]["content"][0]["text"] == "what's up"
+    assert len(checkpoints(body)) == 3
+    # 会话中保存的历史不被修改
+    assert history[1] == {"role": "assistant", "content": "hey"}
+
+    plain = client.build_body("persona", "what's up", history)
+    assert plain["system"] == "persona" and not checkpoints(plain)
+
+
+def test_prompt_caching_follows_model_support(api_main, fake_bedrock, monkeypatch):
+    client = ClaudeClient(bedrock=fake_bedrock(), max_concurrency=1)
+
+    assert not client.supports_prompt_caching("anthropic.claude-3-haiku-20240307-v1:0")
+    assert client.supports_prompt_caching("us.anthropic.claude-3-5-haiku-20241022-v1:0")
+    assert client.supports_prompt_caching("anthropic.claude-sonnet-4-20250514-v1:0")
+    monkeypatch.setenv("PROMPT_CACHING", "false")
+    assert not client.supports_prompt_caching("anthropic.claude-sonnet-4-20250514-v1:0")
+
+
+def test_session_turns_read_previous_prefix_from_cache(api_main, chat_payload, fake_bedrock, monkeypatch):
+    monkeypatch.setenv("PROMPT_CACHING", "true")
+    fake = fake_bedrock(latency=0)
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=4))
+    payload = dict(chat_payload, session_id="prompt-cache", use_cache=False)
+    model = api_main.ai_service.claude.model_id
+    before = CACHE_READ_TOKENS.value(model=model)
+
+    async def run():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = (await client.post("/chat", json=payload)).json()
+            second = (await client.post("/chat", json=dict(payload, message="and you?"))).json()
+            stream = await client.post("/chat/stream", json=dict(payload, message="tell me more"))
+            return first, second, stream.text
+
+    first, second, stream = asyncio.run(run())
+
+    assert first["usage"]["cache_read_input_tokens"] == 0
+    assert first["usage"]["cache_creation_input_tokens"] > 0
+    # 第二轮的前缀 (系统提示词 + 第一轮) 已在缓存中
+    assert second["usage"]["cache_read_input_tokens"] > first["usage"]["cache_creation_input_tokens"] // 2
+    assert '"cache_read_input_tokens"' in stream
+    assert CACHE_READ_TOKENS.value(model=model) > before
+    assert "The role you play is Jake" in fake.last_body["system"][0]["text"]
+    assert "The role you play" not in str(fake.last_body["messages"])
+    api_main.ai_service.sessions.delete("prompt-cache")
+
+
+def test_turn_after_history_trim_reads_cache(api_main, chat_payload, fake_bedrock, monkeypatch):
+    monkeypatch.setenv("PROMPT_CACHING", "true")
+    fake = fake_bedrock(latency=0)
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=4))
+    payload = dict(chat_payload, session_id="prompt-cache-trim", use_cache=False)
+
+    async def run():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def turn(i, **extra):
+                return (await client.post("/chat", json=dict(payload, message=f"turn {i:02d}", **extra))).json()
+
+            first, second = await turn(0), await turn(1)
+            per_turn = second["prompt_tokens"] - first["prompt_tokens"]
+            # 历史最多放得下约 6 轮
+            budget = first["prompt_tokens"] + per_turn * 6
+            return [first, second] + [await turn(i, max_input_tokens=budget) for i in range(2, 20)]
+
+    turns = asyncio.run(run())
+    api_main.ai_service.sessions.delete("prompt-cache-trim")
+
+    trimmed = [i for i in range(1, len(turns)) if turns[i]["prompt_tokens"] < turns[i - 1]["prompt_tokens"]]
+    # 按块截断 (每次丢弃约一半的历史): 超出预算之后每 3 轮左右才截断一次, 而不是每轮都截断
+    assert 1 <= len(trimmed) <= len(turns) // 3
+    for i in range(2, len(turns)):
+        usage, previous = turns[i]["usage"], turns[i - 1]["usage"]
+        if i in trimmed:
+            # 截断的这一轮前缀改变, 只有系统提示词命中
+            assert 0 < usage["cache_read_input_tokens"] < previous["cache_read_input_tokens"]
+        else:
+            # 包括截断后的下一轮: 读取上一轮写入的整个前缀
+            assert usage["cache_read_input_tokens"] == \
+                previous["cache_read_input_tokens"] + previous["cache_creation_input_tokens"]
+    assert any(i + 1 < len(turns) and i + 1 not in trimmed for i in trimmed)
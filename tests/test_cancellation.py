@@ -0,0 +1,137 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from core.ai.claude_client import ClaudeClient
+from core.ai.executor import BoundedExecutor
+
+
+async def abandoned_post(app, path, payload, disconnect: asyncio.Event):
+    """直接调用 ASGI 应用: 发送请求体后, 在 disconnect 被设置时断开, 返回 (状态码, 是否已返回)"""
+    body = json.dumps(payload).encode()
+    body_sent = False
+    status = None
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"test"), (b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 12345),
+        "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+    return status
+
+
+def test_abandoned_requests_release_slots(api_main, chat_payload, fake_bedrock, monkeypatch):
+    latency, n = 0.4, 40
+    fake = fake_bedrock(latency=latency)
+    claude = ClaudeClient(bedrock=fake, max_concurrency=2)
+    monkeypatch.setattr(api_main.ai_service, "claude", claude)
+
+    async def scenario():
+        disconnect = asyncio.Event()
+        # 不同的消息, 避免合并和缓存
+        requests = [
+            asyncio.ensure_future(abandoned_post(
+                api_main.app, "/chat", dict(chat_payload, message=f"flood {i}"), disconnect
+            ))
+            for i in range(n)
+        ]
+        await asyncio.sleep(0.05)
+        assert claude.resilience.limiter.stats()["queued"] == n - 2
+
+        # 所有客户端同时离开
+        start = time.perf_counter()
+        disconnect.set()
+        statuses = await asyncio.gather(*requests)
+        handlers_done = time.perf_counter() - start
+
+        # 排队中的调用立即移出队列, 逻辑名额立即归还
+        stats = claude.resilience.limiter.stats()
+        assert stats["in_flight"] == 0 and stats["queued"] == 0
+
+        # 已经发出的调用无法中断, 线程名额在 Bedrock 返回后归还
+        while claude.executor.in_flight:
+            await asyncio.sleep(0.01)
+        released = time.perf_counter() - start
+
+        # 释放后的新请求立即得到处理
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/chat", json=dict(chat_payload, message="after the flood"))
+        return statuses, handlers_done, released, response
+
+    statuses, handlers_done, released, response = asyncio.run(scenario())
+
+    assert statuses == [499] * n
+    assert handlers_done < 0.1
+    assert released < latency
+    # 只有断开前已经发出的 2 个调用到达了 Bedrock
+    assert fake.calls == 3
+    assert response.status_code == 200
+
+
+def test_request_deadline_returns_504(api_main, chat_payload, fake_bedrock, monkeypatch):
+    fake = fake_bedrock(latency=0.5)
+    claude = ClaudeClient(bedrock=fake, max_concurrency=2)
+    monkeypatch.setattr(api_main.ai_service, "claude", claude)
+
+    async def post():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            start = time.perf_counter()
+            response = await client.post(
+                "/chat", json=dict(chat_payload, message="deadline"), headers={"X-Request-Timeout": "0.1"}
+            )
+            return response, time.perf_counter() - start
+
+    response, elapsed = asyncio.run(post())
+
+    assert response.status_code == 504
+    assert elapsed < 0.3
+    assert claude.resilience.limiter.in_flight == 0
+
+
+def test_executor_holds_slot_until_thread_returns():
+    executor = BoundedExecutor(1)
+
+    async def scenario():
+        running = asyncio.ensure_future(executor.run(time.sleep, 0.2))
+        waiting = asyncio.ensure_future(executor.run(time.sleep, 0))
+        await asyncio.sleep(0.05)
+
+        running.cancel()
+        waiting.cancel()
+        await asyncio.wait({running, waiting})
+        # 线程仍在执行, 名额没有提前归还
+        assert executor.in_flight == 1
+
+        await asyncio.sleep(0.25)
+        assert executor.in_flight == 0
+        assert await executor.run(lambda: "ok") == "ok"
+
+    asyncio.run(scenario())
+    executor.shutdown()
@@ -0,0 +1,89 @@
+import asyncio
+import random
+
+from core.ai.claude_client import ClaudeClient
+from core.ai.client_pool import ClientPool, Endpoint
+
+
+def _client(endpoints, **pool_options):
+    client = ClaudeClient(endpoints=endpoints, max_concurrency=64)
+    for name, value in pool_options.items():
+        setattr(client.pool, name, value)
+    return client
+
+
+def test_routes_to_lowest_latency_endpoint(fake_bedrock):
+    slow, fast = fake_bedrock(latency=0.05), fake_bedrock(latency=0.005)
+    client = _client([Endpoint(slow, "us-west-2", "m"), Endpoint(fast, "us-east-1", "m")],
+                     explore_ratio=0)
+
+    async def run():
+        for _ in range(20):
+            await client.chat(user_message="hi")
+
+    asyncio.run(run())
+
+    # 每个端点至少尝试一次, 之后都路由到更快的端点
+    assert slow.calls == 1
+    assert fast.calls == 19
+    stats = client.pool.stats()["endpoints"]
+    assert stats[0]["latency_ewma"] > stats[1]["latency_ewma"]
+
+
+def test_failing_endpoint_is_avoided():
+    calls = {"us-west-2": 0, "us-east-1": 0}
+
+    async def call(endpoint):
+        calls[endpoint.region] += 1
+        if endpoint.region == "us-west-2":
+            raise RuntimeError("region down")
+        return "ok"
+
+    pool = ClientPool(
+        [Endpoint(None, "us-west-2", "m"), Endpoint(None, "us-east-1", "m")],
+        explore_ratio=0
+    )
+
+    async def run():
+        results = []
+        for _ in range(10):
+            try:
+                results.append(await pool.call(call))
+            except RuntimeError:
+                results.append("error")
+        return results
+
+    results = asyncio.run(run())
+
+    assert results.count("error") == 1
+    assert calls == {"us-west-2": 1, "us-east-1": 9}
+
+
+def test_hedges_to_second_endpoint_after_p95():
+    latencies = {"slow": 0.3, "fast": 0.01}
+
+    async def call(endpoint):
+        await asyncio.sleep(latencies[endpoint.region])
+        return endpoint.region
+
+    slow = Endpoint(None, "slow", "m")
+    fast = Endpoint(None, "fast", "m")
+    # 首选端点平时很快 (p95 = 20ms), 但这次变慢了
+    for _ in range(50):
+        slow.record_success(0.02)
+        fast.record_success(0.05)
+    pool = ClientPool([slow, fast], hedge=True, hedge_min_delay=0.01,
+                      explore_ratio=0, rng=random.Random(0))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await pool.call(call)
+        return result, loop.time() - start
+
+    result, elapsed = asyncio.run(run())
+
+    assert result == "fast"
+    assert elapsed < 0.2
+    assert pool.stats()["hedged"] == 1
+    assert pool.stats()["hedge_wins"] == 1
@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+import pytest
+
+from core.ai.claude_client import ClaudeClient
+from core.ai.errors import DeadlineExceededError
+from core.ai.scheduler import RequestContext, current_request, set_request_context
+from service.coalescer import RequestCoalescer
+
+
+def test_identical_concurrent_requests_make_one_backend_call(api_main, fake_bedrock, monkeypatch):
+    fake = fake_bedrock(latency=0.2)
+    service = api_main.ai_service
+    monkeypatch.setattr(service, "claude", ClaudeClient(bedrock=fake, max_concurrency=128))
+    monkeypatch.setattr(service, "coalescer", RequestCoalescer())
+
+    async def run():
+        return await asyncio.gather(*[
+            service.chat("你好", system_prompt="persona", messages=[]) for _ in range(100)
+        ])
+
+    results = asyncio.run(run())
+
+    assert fake.calls == 1
+    assert all(r["response"] == fake.text for r in results)
+    assert service.coalescer.stats() == {
+        "in_flight": 0, "leaders": 1, "followers": 99, "cancelled": 0, "reelected": 0
+    }
+
+
+def test_errors_propagate_to_all_waiters():
+    coalescer = RequestCoalescer()
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        raise RuntimeError("throttled")
+
+    async def run():
+        return await asyncio.gather(
+            *[coalescer.run("key", failing) for _ in range(5)], return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+
+    assert calls == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_leader_cancellation_does_not_affect_followers():
+    coalescer = RequestCoalescer()
+
+    async def slow():
+        await asyncio.sleep(0.1)
+        return "reply"
+
+    async def run():
+        leader = asyncio.ensure_future(coalescer.run("key", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(coalescer.run("key", slow))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "reply"
+    assert coalescer.cancelled == 0
+
+
+def test_backend_call_cancelled_when_all_waiters_leave():
+    coalescer = RequestCoalescer()
+    finished = False
+
+    async def slow():
+        nonlocal finished
+        await asyncio.sleep(0.2)
+        finished = True
+
+    async def run():
+        waiters = [asyncio.ensure_future(coalescer.run("key", slow)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0.3)
+
+    asyncio.run(run())
+
+    assert finished is False
+    assert coalescer.cancelled == 1
+    assert coalescer.in_flight == 0
+
+
+def test_followers_retry_when_shared_call_is_cancelled_under_them():
+    coalescer = RequestCoalescer()
+    calls = 0
+
+    async def slow():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "reply"
+
+    async def run():
+        leader = asyncio.ensure_future(coalescer.run("key", slow))
+        await asyncio.sleep(0.01)
+        # leader 是唯一的等待者, 离开时取消实际调用; follower 在调用结束取消之前加入
+        leader.cancel()
+        follower = asyncio.ensure_future(coalescer.run("key", slow))
+        await asyncio.gather(leader, return_exceptions=True)
+        return await follower
+
+    assert asyncio.run(run()) == "reply"
+    assert calls == 2
+    assert coalescer.stats()["reelected"] == 1
+
+
+def test_followers_are_not_bound_by_the_leader_deadline():
+    coalescer = RequestCoalescer()
+    contexts = []
+
+    async def queued():
+        # 与限流器相同: 开始排队时按当前的截止时间计算最长等待时间
+        context = current_request()
+        contexts.append(context)
+        remaining = context.remaining()
+        await asyncio.sleep(0.05)
+        if remaining is not None and remaining < 0.05:
+            raise DeadlineExceededError("dropped in queue")
+        return context.tenant
+
+    async def waiter(tenant, timeout):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        set_request_context(RequestContext(tenant=tenant, deadline=deadline))
+        return await coalescer.run("key", queued)
+
+    async def run():
+        leader = asyncio.ensure_future(waiter("leader", 0.02))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(waiter("follower", None))
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    leader, follower = asyncio.run(run())
+
+    assert isinstance(leader, DeadlineExceededError)
+    # follower 重新选为 leader, 按自己的调度信息再调用一次
+    assert follower == "follower"
+    assert [context.tenant for context in contexts] == ["leader", "follower"]
+    # follower 加入后, 实际调用的截止时间放宽为不限 (使用的是 leader 调度信息的副本)
+    assert contexts[0].deadline is None
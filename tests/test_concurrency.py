@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+import httpx
+
+from core.ai.claude_client import ClaudeClient
+
+
+async def _post_many(app, payload, n):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[client.post("/chat", json=payload) for _ in range(n)])
+        return time.perf_counter() - start, responses
+
+
+def test_concurrent_chats_take_one_model_latency(api_main, chat_payload, fake_bedrock, monkeypatch):
+    latency, n = 0.3, 50
+    fake = fake_bedrock(latency=latency)
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=64))
+
+    elapsed, responses = asyncio.run(_post_many(api_main.app, chat_payload, n))
+
+    assert all(r.status_code == 200 for r in responses)
+    assert fake.calls == n
+    # 串行需要 n * latency = 15s, 并发应接近一次模型延迟
+    assert elapsed < latency * 4
+
+
+def test_concurrency_limit_is_respected(api_main, chat_payload, fake_bedrock, monkeypatch):
+    latency = 0.2
+    fake = fake_bedrock(latency=latency)
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=4))
+
+    elapsed, responses = asyncio.run(_post_many(api_main.app, chat_payload, 8))
+
+    assert all(r.status_code == 200 for r in responses)
+    # 8 个请求, 上限 4 -> 两轮
+    assert latency * 2 <= elapsed < latency * 4
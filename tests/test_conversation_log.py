@@ -0,0 +1,115 @@
+import asyncio
+
+import httpx
+
+from core.ai.claude_client import ClaudeClient
+from service.conversation_log import ConversationLog
+
+
+def test_batched_writes_and_range_reads(tmp_path):
+    path = str(tmp_path / "log.db")
+    log = ConversationLog(path, batch_size=16)
+    for i in range(100):
+        log.append(f"s{i % 2}", f"msg {i}", f"reply {i}", prompt_tokens=i, latency=0.01,
+                   request={"character_id": "jake"})
+    log.close()
+
+    # close 之后所有记录都已写入, 且是批量写入的
+    stats = log.stats()
+    assert stats["written"] == 100 and stats["dropped"] == 0
+    assert stats["batches"] < 100
+
+    reader = ConversationLog(path)
+    first = reader.read(limit=10)
+    assert [r["message"] for r in first] == [f"msg {i}" for i in range(10)]
+    page = reader.read(session_id="s1", after_id=first[-1]["id"], limit=5)
+    assert [r["message"] for r in page] == ["msg 11", "msg 13", "msg 15", "msg 17", "msg 19"]
+    latest = reader.read(session_id="s0", limit=2, latest=True)
+    assert [r["message"] for r in latest] == ["msg 96", "msg 98"]
+    assert latest[0]["request"] == {"character_id": "jake"}
+    reader.close()
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    log = ConversationLog(str(tmp_path / "log.db"), queue_size=2)
+    # 不启动写入线程, 模拟写入跟不上
+    log._ensure_writer = lambda: None
+
+    results = [log.append("s", "m", "r") for _ in range(3)]
+
+    assert results == [True, True, False]
+    assert log.stats()["dropped"] == 1
+
+
+def test_restore_session_from_log(api_main, chat_payload, fake_bedrock, monkeypatch, tmp_path):
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake_bedrock(latency=0), max_concurrency=4))
+    log = ConversationLog(str(tmp_path / "log.db"))
+    monkeypatch.setattr(api_main.ai_service, "conversations", log)
+    payload = dict(chat_payload, session_id="logged")
+
+    async def run():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for message in ("one", "two", "three"):
+                assert (await client.post("/chat", json=dict(payload, message=message))).status_code == 200
+            log.flush(timeout=5)
+
+            items = (await client.get("/conversations", params={"session_id": "logged"})).json()["items"]
+            assert [item["message"] for item in items] == ["one", "two", "three"]
+            assert items[0]["request"]["character"]["name"] == "Jake"
+
+            assert (await client.delete("/sessions/logged")).status_code == 200
+            restored = await client.post("/sessions/logged/restore", params={"max_turns": 2})
+            assert restored.json()["restored_turns"] == 2
+
+    asyncio.run(run())
+    history = api_main.ai_service.sessions.get("logged").messages
+    assert [m["content"] for m in history if m["role"] == "user"] == ["two", "three"]
+    api_main.ai_service.sessions.delete("logged")
+    log.close()
+
+
+def test_restore_waits_for_the_session_lock(api_main, monkeypatch, tmp_path):
+    log = ConversationLog(str(tmp_path / "log.db"))
+    log.append("busy", "hello", "hi")
+    log.flush(timeout=5)
+    monkeypatch.setattr(api_main.ai_service, "conversations", log)
+    sessions = api_main.ai_service.sessions
+
+    async def run():
+        async with sessions.alocked("busy") as session:
+            restore = asyncio.ensure_future(api_main.ai_service.restore_session("busy"))
+            await asyncio.sleep(0.1)
+            # 正在进行的对话持有会话锁, 恢复等它结束后才替换历史
+            assert not restore.done()
+            await sessions.aappend(session, [{"role": "user", "content": "in flight"}])
+        assert await restore == 1
+
+    asyncio.run(run())
+    assert [m["content"] for m in sessions.get("busy").messages] == ["hello", "hi"]
+    sessions.delete("busy")
+    log.close()
+
+
+def test_dead_writer_is_restarted(tmp_path):
+    log = ConversationLog(str(tmp_path / "log.db"))
+    connect = log._connect
+    failures = [RuntimeError("disk gone")]
+
+    def flaky_connect():
+        if failures:
+            raise failures.pop()
+        return connect()
+
+    log._connect = flaky_connect
+    log.append("s", "first", "r")
+    log._writer.join(5)
+    assert log.stats()["writer_alive"] is False
+
+    # 下一条记录重新启动写入线程, 积压的记录一起写入
+    log.append("s", "second", "r")
+    assert log.flush(timeout=5)
+    stats = log.stats()
+    assert stats["writer_alive"] and stats["writer_restarts"] == 1
+    assert [r["message"] for r in log.read(session_id="s")] == ["first", "second"]
+    log.close()
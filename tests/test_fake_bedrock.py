@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from core.ai.claude_client import ClaudeClient
+from core.ai.fake_bedrock import FakeBedrockRuntime
+from core.ai.resilience import is_throttling_error
+
+
+def _body(message="hi"):
+    return json.dumps({"messages": [{"role": "user", "content": message}]})
+
+
+def test_throttle_rate_raises_throttling_exception():
+    fake = FakeBedrockRuntime(latency=0, throttle_rate=1.0)
+
+    with pytest.raises(ClientError) as info:
+        fake.invoke_model(body=_body(), modelId="m")
+
+    assert is_throttling_error(info.value)
+    assert fake.throttled == 1
+
+
+def test_latency_distribution_is_seeded_lognormal():
+    a = FakeBedrockRuntime(latency=0.5, latency_sigma=0.5, seed=1)
+    b = FakeBedrockRuntime(latency=0.5, latency_sigma=0.5, seed=1)
+
+    samples = [a._begin(_body())[1] for _ in range(200)]
+
+    assert samples == [b._begin(_body())[1] for _ in range(200)]
+    assert len(set(samples)) > 100
+    assert 0.3 < sorted(samples)[100] < 0.8
+
+
+def test_claude_client_uses_fake_backend_from_settings(api_main, monkeypatch):
+    monkeypatch.setenv("BEDROCK_BACKEND", "fake")
+    monkeypatch.setenv("FAKE_BEDROCK_LATENCY", "0")
+    monkeypatch.setenv("FAKE_BEDROCK_TOKEN_DELAY", "0")
+    client = ClaudeClient(max_concurrency=4)
+    assert isinstance(client.bedrock, FakeBedrockRuntime)
+
+    async def run():
+        reply = await client.chat(user_message="hi")
+        chunks = [c async for c in client.chat_stream(user_message="hi")]
+        return reply, chunks
+
+    reply, chunks = asyncio.run(run())
+
+    assert reply in FakeBedrockRuntime.REPLIES
+    assert "".join(chunks) in FakeBedrockRuntime.REPLIES
+    assert client.bedrock.calls == 2
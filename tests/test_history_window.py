@@ -0,0 +1,98 @@
+from prompts.chat.history_window import window_history
+from utils.token_counter import MESSAGE_OVERHEAD_TOKENS, TokenCounter
+
+
+class CountingTokenCounter(TokenCounter):
+    """每个字符算一个 token, 并记录实际分词次数"""
+
+    def __init__(self):
+        super().__init__()
+        self.tokenized = 0
+
+    def _tokenize(self, text):
+        self.tokenized += 1
+        return len(text)
+
+
+def _turns(n):
+    history = []
+    for i in range(n):
+        history.append({"role": "user", "content": f"user message {i:04d}"})
+        history.append({"role": "assistant", "content": f"reply {i:04d}"})
+    return history
+
+
+PER_TURN = len("user message 0000") + len("reply 0000") + 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+def test_keeps_whole_history_within_budget():
+    counter = CountingTokenCounter()
+    history = _turns(3)
+
+    window, tokens = window_history(history, budget=PER_TURN * 3, counter=counter)
+
+    assert window == history
+    assert tokens == PER_TURN * 3
+
+
+def test_trims_history_in_blocks():
+    counter = CountingTokenCounter()
+    history = _turns(50)
+
+    # 每次丢弃约半个预算 (2 轮), 保留的历史在预算以内
+    window, tokens = window_history(history, budget=PER_TURN * 3 + 5, counter=counter)
+
+    assert window == history[-4:]
+    assert tokens == PER_TURN * 2
+
+
+def test_window_start_is_stable_between_trims():
+    counter = CountingTokenCounter()
+    budget = PER_TURN * 10
+    all_turns = _turns(40)
+    starts = []
+    for turn in range(1, 41):
+        history = all_turns[:turn * 2]
+        window, tokens = window_history(history, budget=budget, counter=counter)
+        assert tokens <= budget
+        starts.append(history.index(window[0]) // 2)
+
+    # 前 10 轮放得下; 之后每超出一次预算丢弃 5 轮, 其余轮次窗口开头不变
+    assert starts == [0] * 10 + [turn for turn in range(5, 31, 5) for _ in range(5)]
+
+
+def test_window_starts_with_user_message():
+    counter = CountingTokenCounter()
+    history = _turns(5)
+    budget = counter.count_message(history[-1]) + counter.count_message(history[-2]) \
+        + counter.count_message(history[-3])
+
+    window, _ = window_history(history, budget=budget, counter=counter)
+
+    assert window == history[-2:]
+
+
+def test_only_new_messages_are_tokenized():
+    counter = CountingTokenCounter()
+    history = _turns(100)
+    window_history(history, budget=100000, counter=counter)
+    first_pass = counter.tokenized
+
+    history.append({"role": "user", "content": "a brand new message"})
+    window_history(history, budget=100000, counter=counter)
+
+    assert first_pass == 200
+    assert counter.tokenized == first_pass + 1
+
+
+def test_cache_evicts_least_recently_used():
+    counter = CountingTokenCounter()
+    counter.cache_size = 2
+    counter.count("system prompt")
+    counter.count("old message")
+    # 每轮都会用到的系统提示词不会因为写入较早而被淘汰
+    counter.count("system prompt")
+    counter.count("new message")
+    counter.count("system prompt")
+
+    assert counter.tokenized == 3
@@ -0,0 +1,38 @@
+import pytest
+
+from core.ai.claude_client import ClaudeClient
+from utils import json_codec
+
+DOC = {"messages": [{"role": "user", "content": "你好 😉"}], "max_tokens": 52, "top_p": 0.9}
+
+
+@pytest.mark.parametrize("backend", ["default", "json"])
+def test_round_trip_matches_across_backends(backend, monkeypatch):
+    if backend == "json":
+        monkeypatch.setattr(json_codec, "orjson", None)
+
+    data = json_codec.dumps(DOC)
+
+    assert isinstance(data, bytes)
+    assert "你好 😉".encode("utf-8") in data
+    assert json_codec.loads(data) == DOC
+    assert json_codec.dumps_str(DOC) == data.decode("utf-8")
+
+
+def test_fast_json_response_keeps_non_ascii():
+    response = json_codec.FastJSONResponse({"response": "嗨 ✨"})
+
+    assert response.body.decode("utf-8") == '{"response":"嗨 ✨"}'
+    assert response.headers["content-type"] == "application/json"
+
+
+def test_build_body_references_history_without_copying(api_main, fake_bedrock):
+    client = ClaudeClient(bedrock=fake_bedrock(), max_concurrency=1)
+    history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hey"}]
+
+    body = client.build_body("persona", "what's up", history)
+
+    assert body["messages"][0] is history[0]
+    assert body["messages"][1] is history[1]
+    assert body["messages"][2] == {"role": "user", "content": "what's up"}
+    assert body["system"] == "persona"
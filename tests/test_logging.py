@@ -0,0 +1,89 @@
+import io
+import json
+import logging
+import queue
+import random
+
+from config import configure_logging
+from utils.logging_pipeline import (
+    DeferredQueueHandler,
+    JsonFormatter,
+    LazyJson,
+    PayloadLogger,
+    setup_logging,
+    shutdown_logging,
+)
+
+
+class _Exploding:
+    def __str__(self):
+        raise AssertionError("payload was formatted")
+
+
+def _logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def test_payload_is_sampled_per_category_and_truncated():
+    log_queue = queue.Queue()
+    logger = _logger("test.payload", DeferredQueueHandler(log_queue))
+    payloads = PayloadLogger(sample_rates={"request": 0.0}, max_chars=10,
+                             logger=logger, rng=random.Random(0))
+
+    payloads.log("request", "Request body", {"messages": ["x" * 100]})
+    payloads.log("response", "Full response", {"content": "y" * 100})
+
+    assert log_queue.qsize() == 1
+    record = log_queue.get_nowait()
+    assert record.category == "response"
+    assert record.getMessage().startswith('Full response: {"content"')
+    assert "[truncated" in record.getMessage()
+
+
+def test_disabled_level_does_not_format_payload():
+    log_queue = queue.Queue()
+    logger = _logger("test.disabled", DeferredQueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+
+    PayloadLogger(logger=logger).log("request", "Request body", _Exploding())
+
+    assert log_queue.empty()
+
+
+def test_full_queue_drops_records_without_blocking():
+    handler = DeferredQueueHandler(queue.Queue(maxsize=2))
+    logger = _logger("test.full", handler)
+
+    for i in range(5):
+        logger.info("record %d", i)
+
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+
+def test_json_formatter_includes_extra_fields():
+    record = logging.LogRecord("api", logging.INFO, __file__, 1, "hello %s", ("world",), None)
+    record.category = "request"
+    record.payload = LazyJson({"a": 1})
+
+    data = json.loads(JsonFormatter().format(record))
+
+    assert data["message"] == "hello world"
+    assert data["category"] == "request"
+    assert data["payload"] == '{"a": 1}'
+
+
+def test_setup_logging_writes_from_background_thread():
+    stream = io.StringIO()
+    try:
+        setup_logging(level="INFO", fmt="json", stream=stream)
+        logging.getLogger("test.pipeline").info("queued %s", "message")
+        shutdown_logging()
+
+        assert json.loads(stream.getvalue())["message"] == "queued message"
+    finally:
+        configure_logging()
@@ -0,0 +1,103 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from api.middleware import MetricsMiddleware
+from core.ai.claude_client import ClaudeClient
+from utils.metrics import MetricsRegistry, STAGE_SECONDS, flatten_stats, stage
+
+
+async def _post(app, path, payload):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post(path, json=payload)
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "test", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, stage="bedrock")
+
+    text = registry.render()
+
+    assert 'latency_seconds_bucket{stage="bedrock",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{stage="bedrock",le="1"} 2' in text
+    assert 'latency_seconds_bucket{stage="bedrock",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{stage="bedrock"} 3' in text
+
+
+def test_flatten_stats_labels_nested_values():
+    samples = flatten_stats("pool", {
+        "hedge": False,
+        "breaker": {"state": "open"},
+        "endpoints": [{"region": "us-west-2", "requests": 3, "latency_p95": None}]
+    })
+
+    assert ("pool_hedge", {}, 0) in samples
+    assert ("pool_breaker_state", {"state": "open"}, 1) in samples
+    assert ("pool_endpoints_requests", {"region": "us-west-2"}, 3) in samples
+    name, labels, value = next(sample for sample in samples if sample[0] == "pool_endpoints_latency_p95")
+    assert labels == {"region": "us-west-2"} and value != value
+
+
+def test_collector_families_are_contiguous():
+    registry = MetricsRegistry()
+    registry.register_collector(lambda: flatten_stats("pool", {"endpoints": [
+        {"region": "us-west-2", "requests": 3, "latency_p95": None},
+        {"region": "us-east-1", "requests": 5, "latency_p95": 0.25},
+    ]}))
+    registry.register_collector(lambda: [("pool_endpoints_requests", {"region": "eu-west-1"}, 1)])
+
+    lines = registry.render().splitlines()
+    families = [line.split()[2] for line in lines if line.startswith("# TYPE")]
+    names = [line.split("{")[0].split()[0] for line in lines if not line.startswith("#")]
+
+    # 每个指标只有一组 HELP/TYPE, 样本紧跟在自己的 TYPE 之后
+    assert families == ["pool_endpoints_requests", "pool_endpoints_latency_p95"]
+    assert sum(line.startswith("# HELP") for line in lines) == 2
+    assert names == ["pool_endpoints_requests"] * 3 + ["pool_endpoints_latency_p95"] * 2
+    assert 'pool_endpoints_latency_p95{region="us-west-2"} NaN' in lines
+
+
+def test_chat_records_stages_tokens_and_status(api_main, chat_payload, fake_bedrock, monkeypatch):
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake_bedrock(latency=0), max_concurrency=4))
+    before = STAGE_SECONDS.value(stage="bedrock")
+
+    response = asyncio.run(_post(api_main.app, "/chat", chat_payload))
+    assert response.status_code == 200
+
+    async def scrape():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/metrics")
+
+    text = asyncio.run(scrape()).text
+
+    assert STAGE_SECONDS.value(stage="bedrock") == before + 1
+    for name in ("prompt", "window", "serialize", "queue", "parse"):
+        assert f'chat_stage_duration_seconds_count{{stage="{name}"}}' in text
+    assert "bedrock_input_tokens_total{model=" in text
+    assert "bedrock_output_tokens_total{model=" in text
+    assert 'http_requests_total{path="/chat",status="200"}' in text
+    assert "http_requests_in_flight 1" in text
+    assert "bedrock_limiter_limit 4" in text
+    assert "sessions_" in text
+
+
+def test_server_timing_header_lists_stages():
+    app = FastAPI()
+
+    @app.post("/work")
+    async def work():
+        with stage("prompt"):
+            pass
+        await asyncio.sleep(0)
+        return {"ok": True}
+
+    app.add_middleware(MetricsMiddleware, server_timing=True)
+
+    response = asyncio.run(_post(app, "/work", {}))
+
+    assert response.headers["server-timing"].startswith("prompt;dur=")
@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from core.ai.claude_client import ClaudeClient
+from service.moderation import KeywordModerationBackend, ModerationBackend, Moderator
+
+
+class CountingBackend(KeywordModerationBackend):
+    def __init__(self, patterns, delay=0.0):
+        super().__init__(patterns, delay)
+        self.calls = 0
+
+    async def check(self, text, kind):
+        self.calls += 1
+        return await super().check(text, kind)
+
+
+def client_for(api_main):
+    transport = httpx.ASGITransport(app=api_main.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+def test_blocked_input_cancels_generation(api_main, chat_payload, fake_bedrock, monkeypatch):
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake_bedrock(latency=0.5), max_concurrency=4))
+    monkeypatch.setattr(api_main.ai_service, "moderator", Moderator(KeywordModerationBackend([r"forbidden"], delay=0.02)))
+
+    async def run():
+        async with client_for(api_main) as client:
+            start = time.perf_counter()
+            response = await client.post("/chat", json=dict(chat_payload, message="a forbidden word",
+                                                            session_id="moderated"))
+            return response, time.perf_counter() - start
+
+    response, elapsed = asyncio.run(run())
+
+    assert response.status_code == 400
+    assert "forbidden" in response.json()["detail"]
+    # 不等模型返回
+    assert elapsed < 0.4
+    assert api_main.ai_service.sessions.get("moderated").messages == []
+    api_main.ai_service.sessions.delete("moderated")
+
+
+def test_input_check_runs_concurrently_with_model(api_main, chat_payload, fake_bedrock, monkeypatch):
+    monkeypatch.setenv("MODERATION_CHECK_OUTPUT", "false")
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake_bedrock(latency=0.3), max_concurrency=4))
+    monkeypatch.setattr(api_main.ai_service, "moderator", Moderator(KeywordModerationBackend([r"forbidden"], delay=0.2)))
+
+    async def run():
+        async with client_for(api_main) as client:
+            start = time.perf_counter()
+            response = await client.post("/chat", json=dict(chat_payload, use_cache=False))
+            return response, time.perf_counter() - start
+
+    response, elapsed = asyncio.run(run())
+
+    assert response.status_code == 200
+    # 串行需要 0.5 秒
+    assert elapsed < 0.45
+
+
+def test_stream_output_blocked(api_main, chat_payload, fake_bedrock, monkeypatch):
+    monkeypatch.setenv("MODERATION_STREAM_INTERVAL", "3")
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake_bedrock(latency=0), max_concurrency=4))
+    monkeypatch.setattr(api_main.ai_service, "moderator", Moderator(KeywordModerationBackend([r"there"])))
+
+    async def run():
+        async with client_for(api_main) as client:
+            response = await client.post("/chat/stream", json=dict(chat_payload, session_id="stream-moderated"))
+            return response.text
+
+    body = asyncio.run(run())
+
+    assert "event: error" in body and '"blocked":true' in body
+    assert "event: end" not in body
+    assert api_main.ai_service.sessions.get("stream-moderated").messages == []
+    api_main.ai_service.sessions.delete("stream-moderated")
+
+
+def test_verdicts_are_cached():
+    backend = CountingBackend([r"bad"])
+    moderator = Moderator(backend)
+
+    async def run():
+        first = await moderator.check("this is bad", "input")
+        second = await moderator.check("this is bad", "input")
+        other_kind = await moderator.check("this is bad", "output")
+        return first, second, other_kind
+
+    first, second, other_kind = asyncio.run(run())
+
+    assert not first.allowed and first.label == "bad"
+    assert second is first
+    assert backend.calls == 2
+    assert moderator.stats()["blocked"] == 3
+
+
+def test_backend_must_implement_check():
+    class IncompleteBackend(ModerationBackend):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        IncompleteBackend()
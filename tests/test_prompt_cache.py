@@ -0,0 +1,42 @@
+from api.models import Character, Scene
+from prompts.chat.dialogue_control import DialogueControl
+from prompts.chat.templates import PromptTemplates, ROLEPLAY_SYSTEM_TEMPLATE
+
+
+CHARACTER = Character(name="Emma", background="Part-time model", personality="Confident")
+SCENE = Scene(description="a rooftop bar", mood=None)
+
+
+def test_compiled_prompt_matches_template_rendering():
+    prompt_data = DialogueControl.build_prompt(character=CHARACTER, scene=SCENE)
+    expected = ROLEPLAY_SYSTEM_TEMPLATE.format(
+        character_info=prompt_data["character_info"],
+        context=prompt_data["context"]
+    )
+
+    assert DialogueControl.compile_system_prompt(CHARACTER, SCENE) == expected
+    assert "vibe: normal" in expected
+
+
+def test_repeated_persona_hits_cache():
+    cache = DialogueControl.prompt_cache()
+    character = Character(name="Cache Test", background="b", personality="p")
+    hits = cache.hits
+
+    first = DialogueControl.compile_system_prompt(character, SCENE)
+    same_persona = Character(name="Cache Test", background="b", personality="p")
+    second = DialogueControl.compile_system_prompt(same_persona, SCENE)
+
+    assert first is second
+    assert cache.hits == hits + 1
+
+
+def test_reregistering_template_invalidates_compiled_prompts():
+    PromptTemplates.register("test_template", "v1 {character_info} {context}")
+    key_v1 = DialogueControl.persona_key(CHARACTER, SCENE, "test_template")
+    assert DialogueControl.compile_system_prompt(CHARACTER, SCENE, "test_template").startswith("v1")
+
+    PromptTemplates.register("test_template", "v2 {character_info} {context}")
+
+    assert DialogueControl.persona_key(CHARACTER, SCENE, "test_template") != key_v1
+    assert DialogueControl.compile_system_prompt(CHARACTER, SCENE, "test_template").startswith("v2")
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+from core.ai.claude_client import ClaudeClient
+from prompts.chat.dialogue_control import DialogueControl
+from service.persona_registry import (
+    PersonaRegistry, RegistryConflictError, RegistryNotFoundError, RegistryPreconditionError
+)
+
+CHARACTER = {"name": "Mia", "background": "Barista", "personality": "Witty"}
+
+
+def test_versions_etags_and_fragments(tmp_path):
+    registry = PersonaRegistry(str(tmp_path / "registry.db"))
+    v1 = registry.create("character", CHARACTER, "mia")
+    v2 = registry.put("character", "mia", dict(CHARACTER, personality="Shy"), if_match=v1.etag)
+
+    assert (v1.version, v2.version) == (1, 2)
+    assert v1.etag != v2.etag
+    assert "personality: Shy" in v2.fragment
+    assert registry.get("character", "mia").version == 2
+    assert registry.get("character", "mia", version=1).data == CHARACTER
+    with pytest.raises(RegistryPreconditionError):
+        registry.put("character", "mia", CHARACTER, if_match=v1.etag)
+    with pytest.raises(RegistryNotFoundError):
+        registry.get("character", "mia", version=3)
+
+    # 另一个进程 (新的实例) 从文件读取同样的记录
+    other = PersonaRegistry(str(tmp_path / "registry.db"))
+    assert other.get("character", "mia").etag == v2.etag
+    assert [entry.entry_id for entry in other.list("character")] == ["mia"]
+
+
+def test_seed_tolerates_concurrent_workers(tmp_path, monkeypatch):
+    path = str(tmp_path / "registry.db")
+    first, second = PersonaRegistry(path), PersonaRegistry(path)
+    first.seed("character", [dict(CHARACTER, id="mia")])
+    # 第二个 worker 在检查之后、写入之前被抢先 (检查时还看不到对方的记录)
+    monkeypatch.setattr(second, "_latest_row", lambda kind, entry_id: None)
+    second.seed("character", [dict(CHARACTER, id="mia")])
+
+    with pytest.raises(RegistryConflictError):
+        second.create("character", CHARACTER, "mia")
+    assert first.get("character", "mia").version == 1
+
+
+def test_in_memory_registry_without_path():
+    registry = PersonaRegistry()
+    registry.seed("character", [dict(CHARACTER, id="mia")])
+
+    assert registry.path == ":memory:"
+    assert registry.get("character", "mia").data == CHARACTER
+
+
+def test_async_api_reads_file_in_registry_thread(tmp_path, monkeypatch):
+    registry = PersonaRegistry(str(tmp_path / "registry.db"), cache_ttl_seconds=60)
+    threads = []
+    latest_row = registry._latest_row
+
+    def recording_latest_row(kind, entry_id):
+        threads.append(threading.current_thread().name)
+        return latest_row(kind, entry_id)
+
+    monkeypatch.setattr(registry, "_latest_row", recording_latest_row)
+
+    async def run():
+        created = await registry.acreate("character", CHARACTER, "mia")
+        updated = await registry.aput("character", "mia", dict(CHARACTER, personality="Shy"), if_match=created.etag)
+        registry._cache.clear()
+        assert (await registry.aget("character", "mia")).etag == updated.etag
+        # 第二次读取命中缓存, 不再切换到注册表线程
+        assert (await registry.aget("character", "mia")) is not None
+        assert [entry.version for entry in await registry.alist("character")] == [2]
+
+    asyncio.run(run())
+    assert len(threads) == 3
+    assert all(name.startswith("registry") for name in threads)
+    registry.close()
+
+
+def test_chat_by_id_matches_inline_prompt(api_main, chat_payload, fake_bedrock, monkeypatch):
+    fake = fake_bedrock(latency=0)
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=4))
+
+    async def run():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            created = await client.post("/characters", json=dict(chat_payload["character"], id="jake-test"))
+            assert created.status_code == 201
+            etag = created.headers["ETag"]
+
+            cached = await client.get("/characters/jake-test", headers={"If-None-Match": etag})
+            assert cached.status_code == 304
+            assert (await client.post("/characters", json=dict(CHARACTER, id="jake-test"))).status_code == 409
+
+            response = await client.post("/chat", json=dict(chat_payload, character=None, character_id="jake-test"))
+            assert response.status_code == 200
+            by_id = fake.last_body["system"]
+
+            response = await client.post("/chat", json=chat_payload)
+            assert response.status_code == 200
+            assert fake.last_body["system"] == by_id
+
+            missing = await client.post("/chat", json=dict(chat_payload, character=None, character_id="nobody"))
+            assert missing.status_code == 404
+            neither = await client.post("/chat", json=dict(chat_payload, character=None))
+            assert neither.status_code == 422
+
+            presets = await client.get("/characters")
+            assert {"jake", "emma", "alex", "sophia"} <= {item["id"] for item in presets.json()["items"]}
+
+    asyncio.run(run())
+
+
+def test_registry_prompt_is_not_reformatted(api_main, monkeypatch):
+    registry = api_main.ai_service.registry
+    registry.put("scene", "rooftop", {"description": "a rooftop bar", "mood": None})
+    request = api_main.ChatRequest(character_id="emma", scene_id="rooftop", message="hi")
+    first = asyncio.run(api_main.compile_prompt(request))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("fragment rendered on the hot path")
+
+    monkeypatch.setattr(DialogueControl, "build_character_info", fail)
+    monkeypatch.setattr(DialogueControl, "build_context", fail)
+    assert asyncio.run(api_main.compile_prompt(request)) is first
+    assert "The role you play is Emma" in first and "vibe: normal" in first
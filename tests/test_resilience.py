@@ -0,0 +1,147 @@
+import asyncio
+import random
+import time
+
+import httpx
+import pytest
+from botocore.exceptions import ClientError
+
+from core.ai.claude_client import ClaudeClient
+from core.ai.errors import CircuitOpenError, DeadlineExceededError, QueueFullError, ThrottledError
+from core.ai.resilience import AdaptiveLimiter, CircuitBreaker, ResilientInvoker
+from core.ai.scheduler import RequestContext, set_request_context
+
+
+def _client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "InvokeModel")
+
+
+def _invoker(limit=8, max_retries=3, **limiter_options):
+    return ResilientInvoker(
+        limiter=AdaptiveLimiter(initial_limit=limit, **limiter_options),
+        breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60),
+        max_retries=max_retries,
+        base_delay=0.001,
+        max_delay=0.01,
+        rng=random.Random(0)
+    )
+
+
+def test_throttling_is_retried_and_shrinks_limit():
+    invoker = _invoker(limit=8)
+    failures = iter([_client_error("ThrottlingException")] * 2)
+
+    async def call():
+        error = next(failures, None)
+        if error:
+            raise error
+        return "ok"
+
+    assert asyncio.run(invoker.call(call)) == "ok"
+    assert invoker.retries == 2
+    # 同一波限流只减半一次
+    assert invoker.limiter.stats()["limit"] == 4
+    assert invoker.limiter.throttles == 2
+
+
+def test_limit_grows_back_on_success():
+    limiter = AdaptiveLimiter(initial_limit=4, max_limit=8)
+
+    async def run():
+        for _ in range(40):
+            await limiter.acquire()
+            limiter.release("success")
+
+    asyncio.run(run())
+    assert limiter.stats()["limit"] == 8
+
+
+def test_persistent_throttling_raises_throttled_error():
+    invoker = _invoker(max_retries=2)
+
+    async def call():
+        raise _client_error("ThrottlingException")
+
+    with pytest.raises(ThrottledError):
+        asyncio.run(invoker.call(call))
+    assert invoker.breaker.state == "closed"
+
+
+def test_retries_stop_at_the_deadline():
+    invoker = _invoker(max_retries=3)
+    invoker.base_delay = invoker.max_delay = 10
+
+    async def call():
+        raise _client_error("ThrottlingException")
+
+    async def run():
+        set_request_context(RequestContext(deadline=time.monotonic() + 1))
+        await invoker.call(call)
+
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(run())
+    assert invoker.retries == 0
+    assert invoker.limiter.in_flight == 0
+
+
+def test_non_retryable_errors_are_not_retried():
+    invoker = _invoker()
+
+    async def call():
+        raise _client_error("ValidationException")
+
+    with pytest.raises(ClientError):
+        asyncio.run(invoker.call(call))
+    assert invoker.retries == 0
+
+
+def test_circuit_opens_after_repeated_failures():
+    invoker = _invoker(max_retries=0)
+
+    async def call():
+        raise _client_error("ServiceUnavailableException")
+
+    async def run():
+        for _ in range(3):
+            with pytest.raises(ClientError):
+                await invoker.call(call)
+        with pytest.raises(CircuitOpenError) as info:
+            await invoker.call(call)
+        return info.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 503
+    assert error.retry_after > 0
+
+
+def test_queue_full_is_rejected():
+    invoker = _invoker(limit=1, max_queue=1)
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def run():
+        return await asyncio.gather(*[invoker.call(slow) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert results[:2] == ["ok", "ok"]
+    assert isinstance(results[2], QueueFullError)
+
+
+def test_chat_returns_429_with_retry_after_when_queue_is_full(api_main, chat_payload, fake_bedrock, monkeypatch):
+    client = ClaudeClient(bedrock=fake_bedrock(latency=0.2), max_concurrency=1)
+    client.resilience.limiter.max_queue = 0
+    monkeypatch.setattr(api_main.ai_service, "claude", client)
+
+    async def run():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*[http.post("/chat", json=chat_payload) for _ in range(2)])
+
+    responses = asyncio.run(run())
+    statuses = sorted(r.status_code for r in responses)
+
+    assert statuses == [200, 429]
+    rejected = next(r for r in responses if r.status_code == 429)
+    assert rejected.headers["Retry-After"] == "1"
@@ -0,0 +1,86 @@
+import asyncio
+import random
+import sqlite3
+import time
+
+from core.ai.claude_client import ClaudeClient
+from service.response_cache import ResponseCache
+
+SAMPLING = {"max_tokens": 52, "temperature": 0.7}
+
+
+def _key(message="你好", history=()):
+    return ResponseCache.make_key("model", "system", list(history), message, SAMPLING)
+
+
+def test_key_depends_on_every_input():
+    base = _key()
+    assert base == _key()
+    assert base != _key(message="hi")
+    assert base != _key(history=[{"role": "assistant", "content": "hey"}])
+    assert base != ResponseCache.make_key("model", "system", [], "你好", {"max_tokens": 100})
+
+
+def test_pool_fills_before_serving_variants():
+    cache = ResponseCache(variants=2, rng=random.Random(0))
+    key = _key()
+
+    assert cache.get(key) is None
+    cache.put(key, "hey 😉", latency=0.5)
+    assert cache.get(key) is None
+    cache.put(key, "hi cutie ✨", latency=0.7)
+
+    served = {cache.get(key) for _ in range(20)}
+    assert served == {"hey 😉", "hi cutie ✨"}
+    assert cache.stats()["hits"] == 20
+    assert cache.stats()["latency_saved_seconds"] == 12.0
+
+
+def test_sqlite_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "responses.db")
+    cache = ResponseCache(variants=1, sqlite_path=path)
+    cache.put(_key(), "hey there 😉", latency=0.4)
+    cache.close()
+
+    reopened = ResponseCache(variants=1, sqlite_path=path)
+    assert reopened.get(_key()) == "hey there 😉"
+    assert reopened.stats()["disk_hits"] == 1
+
+
+def test_service_serves_repeated_opening_turn_from_cache(api_main, fake_bedrock, monkeypatch):
+    fake = fake_bedrock(latency=0)
+    service = api_main.ai_service
+    monkeypatch.setattr(service, "claude", ClaudeClient(bedrock=fake, max_concurrency=4))
+    monkeypatch.setattr(service, "response_cache", ResponseCache(variants=1))
+
+    async def run():
+        results = [await service.chat("你好", system_prompt="persona") for _ in range(5)]
+        bypass = await service.chat("你好", system_prompt="persona", use_cache=False)
+        return results, bypass
+
+    results, bypass = asyncio.run(run())
+
+    assert fake.calls == 2
+    assert [r["cached"] for r in results] == [False, True, True, True, True]
+    assert bypass["cached"] is False
+
+
+def test_sqlite_tier_reads_off_the_loop_and_purges_on_interval(tmp_path):
+    path = str(tmp_path / "responses.db")
+    cache = ResponseCache(variants=1, ttl_seconds=0.05, sqlite_path=path, purge_interval=3600)
+    cache.put("old", "stale", latency=0.1)
+    time.sleep(0.1)
+    cache.put("new", "fresh", latency=0.1)
+    cache.close()
+
+    db = sqlite3.connect(path)
+    # 第一次写入时已清理过, 间隔内不再每次写入都删除
+    assert db.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] == 2
+    indexes = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert "idx_response_cache_created_at" in indexes
+    db.close()
+
+    reopened = ResponseCache(variants=1, ttl_seconds=60, sqlite_path=path)
+    assert asyncio.run(reopened.aget("new")) == "fresh"
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
@@ -0,0 +1,160 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from api.middleware import SchedulingMiddleware
+from core.ai.claude_client import ClaudeClient
+from core.ai.errors import DeadlineExceededError, QueueFullError
+from core.ai.resilience import AdaptiveLimiter
+from core.ai.scheduler import FairQueue, RequestContext, reset_request_context, set_request_context
+from utils.metrics import QUEUE_WAIT_SECONDS
+
+
+def drain(queue, waiters):
+    names = {id(waiter): name for name, waiter in waiters}
+    order = []
+    while len(queue):
+        order.append(names[id(queue.pop())])
+    return order
+
+
+def test_fair_queue_interleaves_tenants_by_weight():
+    async def run():
+        loop = asyncio.get_running_loop()
+        queue = FairQueue()
+        waiters = []
+        # bulk 先提交了一大批, web 的权重是 bulk 的两倍
+        for i in range(6):
+            waiters.append(("bulk", loop.create_future()))
+            queue.push(waiters[-1][1], RequestContext(tenant="bulk"))
+        for i in range(4):
+            waiters.append(("web", loop.create_future()))
+            queue.push(waiters[-1][1], RequestContext(tenant="web", weight=2))
+        return drain(queue, waiters)
+
+    order = asyncio.run(run())
+
+    # 后到的 web 不用等 bulk 的积压, 按 2:1 分得名额
+    assert order[:6].count("web") == 4
+    assert order[-2:] == ["bulk", "bulk"]
+
+
+def test_interactive_before_batch():
+    async def run():
+        loop = asyncio.get_running_loop()
+        queue = FairQueue()
+        waiters = [("batch", loop.create_future()), ("interactive", loop.create_future())]
+        queue.push(waiters[0][1], RequestContext(priority="batch"))
+        queue.push(waiters[1][1], RequestContext(priority="interactive"))
+        removed = loop.create_future()
+        queue.push(removed, RequestContext())
+        assert queue.remove(removed) and queue.depth("interactive") == 1
+        return drain(queue, waiters)
+
+    assert asyncio.run(run()) == ["interactive", "batch"]
+
+
+def test_batch_is_shed_first_and_deadlines_drop_queued_calls():
+    limiter = AdaptiveLimiter(initial_limit=1, max_queue=2, batch_max_queue=1)
+    waits = QUEUE_WAIT_SECONDS.value(priority="interactive")
+
+    async def queued(context):
+        token = set_request_context(context)
+        try:
+            await limiter.acquire()
+            limiter.release("neutral")
+        finally:
+            reset_request_context(token)
+
+    async def run():
+        await limiter.acquire()
+        batch = asyncio.ensure_future(queued(RequestContext(priority="batch")))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await queued(RequestContext(priority="batch"))
+        # interactive 仍可排队
+        interactive = asyncio.ensure_future(queued(RequestContext(deadline=time.monotonic() + 0.05)))
+        await asyncio.sleep(0)
+        assert limiter.queued == 2
+
+        with pytest.raises(DeadlineExceededError):
+            await interactive
+        assert limiter.queued == 1
+        with pytest.raises(DeadlineExceededError):
+            await queued(RequestContext(deadline=time.monotonic() - 1))
+
+        limiter.release("neutral")
+        await batch
+
+    asyncio.run(run())
+    assert limiter.in_flight == 0
+    assert limiter.stats()["expired"] == 2 and limiter.stats()["rejected"] == 1
+    assert QUEUE_WAIT_SECONDS.value(priority="interactive") > waits
+
+
+def scheduling_middleware(app):
+    """应用中的 SchedulingMiddleware 实例"""
+    layer = app.middleware_stack
+    while not isinstance(layer, SchedulingMiddleware):
+        layer = layer.app
+    return layer
+
+
+def test_middleware_resolves_tenants_once():
+    class Settings:
+        reads = 0
+
+        @property
+        def tenant_weights(self):
+            self.reads += 1
+            return {"web": 4.0}
+
+    class Security:
+        reads = 0
+
+        @property
+        def api_keys(self):
+            self.reads += 1
+            return {"key-web": "web"}
+
+    settings, security = Settings(), Security()
+    middleware = SchedulingMiddleware(None, settings, security_config=security)
+    contexts = [
+        middleware.context({"type": "http", "headers": [(b"x-api-key", key)]})
+        for key in (b"key-web", b"key-web", b"unknown", b"")
+    ]
+
+    assert [(c.tenant, c.weight) for c in contexts] == [("web", 4.0), ("web", 4.0), ("anonymous", 1.0), ("anonymous", 1.0)]
+    assert settings.reads == security.reads == 1
+
+
+def test_tenant_is_not_starved_by_bulk_tenant(api_main, chat_payload, fake_bedrock, monkeypatch):
+    monkeypatch.setenv("API_KEYS", "bulk:key-bulk,web:key-web")
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake_bedrock(latency=0.02), max_concurrency=1))
+    payload = dict(chat_payload, use_cache=False)
+    finished = []
+
+    async def send(client, key, index):
+        response = await client.post("/chat", json=payload, headers={"X-API-Key": key})
+        assert response.status_code == 200
+        finished.append((key, index))
+
+    async def run():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            # 租户映射在第一个请求时解析并缓存, 修改 API_KEYS 后重新解析
+            await client.get("/api/v1/health")
+            monkeypatch.setattr(scheduling_middleware(api_main.app), "_tenants", None)
+            bulk = [asyncio.ensure_future(send(client, "key-bulk", i)) for i in range(12)]
+            await asyncio.sleep(0.05)
+            await send(client, "key-web", 0)
+            await asyncio.gather(*bulk)
+
+            expired = await client.post("/chat", json=payload, headers={"X-Request-Timeout": "0"})
+            assert expired.status_code == 504
+
+    asyncio.run(run())
+    # 排在 bulk 的积压后面需要等 10 个调用, 公平排队只需等 1~2 个
+    assert finished.index(("key-web", 0)) <= 5
@@ -0,0 +1,204 @@
+import asyncio
+import json
+
+import httpx
+
+from core.ai.claude_client import ClaudeClient
+from service.session_store import SessionStore, SqliteSessionStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_request_size_is_constant_over_long_conversation(api_main, chat_payload, fake_bedrock, monkeypatch):
+    fake = fake_bedrock(latency=0)
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=4))
+    payload = dict(chat_payload, session_id="long-conversation")
+    turns = 200
+
+    async def run():
+        sizes = []
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for _ in range(turns):
+                body = json.dumps(payload).encode("utf-8")
+                sizes.append(len(body))
+                response = await client.post(
+                    "/chat", content=body, headers={"Content-Type": "application/json"}
+                )
+                assert response.status_code == 200
+        return sizes
+
+    sizes = asyncio.run(run())
+
+    assert len(set(sizes)) == 1
+    # 服务端保存了完整历史: 最后一轮发给模型的是 2 * 199 条历史 + 当前消息
+    assert len(fake.last_body["messages"]) == 2 * (turns - 1) + 1
+    assert len(api_main.ai_service.sessions.get("long-conversation").messages) == 2 * turns
+    api_main.ai_service.sessions.delete("long-conversation")
+
+
+def test_clear_history_on_chat_and_stream(api_main, chat_payload, fake_bedrock, monkeypatch):
+    fake = fake_bedrock(latency=0)
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=4))
+    payload = dict(chat_payload, session_id="clear-history", use_cache=False)
+
+    async def run():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for _ in range(3):
+                assert (await client.post("/chat", json=payload)).status_code == 200
+            stream = await client.post("/chat/stream", json=dict(payload, message="start over", clear_history=True))
+            stream_messages = len(fake.last_body["messages"])
+            await client.post("/chat", json=payload)
+            await client.post("/chat", json=dict(payload, message="again", clear_history=True))
+            return stream, stream_messages
+
+    stream, stream_messages = asyncio.run(run())
+
+    assert stream.status_code == 200 and "event: end" in stream.text
+    # 清除之后模型只收到当前消息
+    assert stream_messages == 1
+    assert len(fake.last_body["messages"]) == 1
+    history = api_main.ai_service.sessions.get("clear-history").messages
+    assert [message["content"] for message in history if message["role"] == "user"] == ["again"]
+    api_main.ai_service.sessions.delete("clear-history")
+
+
+def test_lru_eviction_by_count():
+    store = SessionStore(max_sessions=2)
+    store.get_or_create("a")
+    store.get_or_create("b")
+    store.get("a")
+    store.get_or_create("c")
+
+    assert "a" in store and "c" in store and "b" not in store
+    assert store.stats()["lru_evictions"] == 1
+
+
+def test_eviction_by_size_keeps_active_session():
+    store = SessionStore(max_bytes=10)
+    a = store.get_or_create("a")
+    store.append(a, [{"role": "user", "content": "123456"}])
+    b = store.get_or_create("b")
+    store.append(b, [{"role": "user", "content": "123456"}])
+
+    assert "a" not in store and "b" in store
+    assert store.stats()["bytes"] == 6
+
+
+def test_idle_sessions_expire():
+    clock = FakeClock()
+    store = SessionStore(ttl_seconds=60, clock=clock)
+    store.get_or_create("old")
+    clock.now = 30
+    store.get_or_create("recent")
+    clock.now = 61
+
+    assert store.get("old") is None
+    assert store.get("recent") is not None
+    assert store.stats()["ttl_evictions"] == 1
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    worker_a, worker_b = SqliteSessionStore(path), SqliteSessionStore(path)
+
+    session = worker_a.get_or_create("s1")
+    worker_a.append(session, [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hey"}])
+    other = worker_b.get_or_create("s1")
+    worker_b.append(other, [{"role": "user", "content": "again"}])
+
+    assert [m["content"] for m in worker_a.get("s1").messages] == ["hi", "hey", "again"]
+    assert asyncio.run(worker_a.astats())["bytes"] == 10
+    # stats() 不访问文件, 返回最近一次读取的共享计数
+    assert worker_a.stats()["sessions"] == 1
+    assert worker_b.delete("s1")
+    assert worker_a.get("s1") is None
+
+
+def test_sqlite_store_evicts_and_expires(tmp_path):
+    clock = FakeClock()
+    store = SqliteSessionStore(str(tmp_path / "sessions.db"), max_sessions=2, ttl_seconds=60,
+                               maintenance_interval=0, clock=clock)
+
+    for session_id in ("a", "b", "c"):
+        clock.now += 1
+        store.append(store.get_or_create(session_id), [{"role": "user", "content": "x"}])
+
+    assert "a" not in store and "b" in store and "c" in store
+    assert store.lru_evictions == 1
+
+    clock.now += 120
+    assert store.get("b") is None
+    assert store.ttl_evictions == 1
+
+
+def test_sqlite_store_shares_lock_within_process(tmp_path):
+    store = SqliteSessionStore(str(tmp_path / "sessions.db"))
+
+    first = store.get_or_create("s1")
+    second = store.get_or_create("s1")
+
+    assert first.lock is second.lock
+
+
+def test_overlapping_turns_on_sqlite_session_see_each_other(api_main, chat_payload, fake_bedrock, monkeypatch, tmp_path):
+    fake = fake_bedrock(latency=0.2)
+    store = SqliteSessionStore(str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=4))
+    monkeypatch.setattr(api_main.ai_service, "sessions", store)
+    payload = dict(chat_payload, session_id="overlap", use_cache=False)
+    sizes = []
+    invoke_model = fake.invoke_model
+
+    def recording_invoke(body, modelId, **kwargs):
+        sizes.append(len(json.loads(body)["messages"]))
+        return invoke_model(body, modelId, **kwargs)
+
+    monkeypatch.setattr(fake, "invoke_model", recording_invoke)
+
+    async def run():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.ensure_future(client.post("/chat", json=dict(payload, message="first")))
+            await asyncio.sleep(0.05)
+            second = await client.post("/chat/stream", json=dict(payload, message="second"))
+            return (await first).status_code, second.status_code
+
+    assert asyncio.run(run()) == (200, 200)
+    # 第二轮等第一轮写入后才读取历史: 第一轮的 2 条 + 当前消息
+    assert len(fake.last_body["messages"]) == 3
+    assert sizes == [1]
+    assert [m["content"] for m in store.get("overlap").messages if m["role"] == "user"] == ["first", "second"]
+    store.close()
+
+
+def test_sqlite_store_async_api_shares_file_without_writing_on_reads(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    worker_a = SqliteSessionStore(path, maintenance_interval=60)
+    worker_b = SqliteSessionStore(path, maintenance_interval=60)
+
+    async def run():
+        session = await worker_a.aget_or_create("s1")
+        await worker_a.aappend(session, [{"role": "user", "content": "hi"}])
+        other = await worker_b.aget_or_create("s1")
+        await worker_b.areplace(other, [{"role": "user", "content": "reset"}])
+
+        # 读取只在内存中记录访问时间, 不写文件
+        writes = worker_a._conn().total_changes
+        for _ in range(5):
+            session = await worker_a.aget_or_create("s1")
+        assert worker_a._conn().total_changes == writes
+        return session
+
+    session = asyncio.run(run())
+    assert [m["content"] for m in session.messages] == ["reset"]
+    assert worker_b.get("s1").size_bytes == 5
+    worker_a.close()
+    worker_b.close()
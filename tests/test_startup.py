@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from config.security import get_security_config
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_import_is_lazy(tmp_path):
+    """导入 api.main 不需要 .env, 不导入 boto3 和 Web 界面的依赖, 不创建服务对象"""
+    env = {k: v for k, v in os.environ.items() if k not in ("ENV_FILE", "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY")}
+    env["ENV_FILE"] = str(tmp_path / "missing.env")
+    script = (
+        "import json, sys\n"
+        "import api.main\n"
+        "print(json.dumps({'boto3': 'boto3' in sys.modules, 'gradio': 'gradio' in sys.modules,\n"
+        "                  'ai_service': api.main.ai_service is not None}))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == {
+        "boto3": False, "gradio": False, "ai_service": False
+    }
+
+
+def test_security_config_is_shared(api_main):
+    assert api_main.ai_service.claude.security_config is get_security_config()
@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+import httpx
+
+from core.ai.claude_client import ClaudeClient
+from core.ai.fake_bedrock import FakeBedrockRuntime
+from core.ai.streaming import StopSequenceFilter
+
+
+def _filter_all(chunks):
+    stop_filter = StopSequenceFilter("[END]")
+    output = "".join(stop_filter.feed(c) for c in chunks)
+    return output + stop_filter.flush()
+
+
+def test_stop_sequence_split_across_chunks():
+    assert _filter_all(["hey ", "there [E", "ND] ignored"]) == "hey there"
+    assert _filter_all(["hey", " [", "END]"]) == "hey"
+
+
+def test_partial_prefix_is_released_when_not_stop_sequence():
+    assert _filter_all(["a [E", "xtra"]) == "a [Extra"
+    assert _filter_all(["ends with [EN"]) == "ends with [EN"
+
+
+def test_stream_ending_in_whitespace_matches_non_stream():
+    assert _filter_all(["hey there ", "\n"]) == "hey there"
+    assert _filter_all(["ends with [EN", " \n"]) == "ends with [EN"
+
+    async def run(text):
+        claude = ClaudeClient(bedrock=FakeBedrockRuntime(latency=0, text=text), max_concurrency=4)
+        streamed = "".join([chunk async for chunk in claude.chat_stream(user_message="hi")])
+        return streamed, await claude.chat(user_message="hi")
+
+    for text in ("hey there \n", "hey there [EN \n", "hey there \n[END]"):
+        streamed, complete = asyncio.run(run(text))
+        assert streamed == complete
+
+
+def test_chat_stream_endpoint_emits_sse(api_main, chat_payload, fake_bedrock, monkeypatch):
+    fake = fake_bedrock(latency=0.01, text="hey cutie ✨[END]")
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=4))
+
+    async def run():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/chat/stream", json=chat_payload)
+            return response.text
+
+    events = [e for e in asyncio.run(run()).split("\n\n") if e]
+    deltas = [json.loads(e[len("data: "):])["delta"] for e in events if e.startswith("data: ")]
+
+    assert "".join(deltas) == "hey cutie ✨"
+    assert events[-1].startswith("event: end")
+    end = json.loads(events[-1].split("data: ", 1)[1])
+    assert end["response"] == "hey cutie ✨"
+    assert end["prompt_tokens"] > 0
+
+
+def test_streams_hold_limiter_permit_until_drained():
+    claude = ClaudeClient(bedrock=FakeBedrockRuntime(latency=0.02, token_delay=0.01, text="a b c d e f g h"),
+                          max_concurrency=8)
+    limiter = claude.resilience.limiter
+    limiter.limit = limiter.max_limit = 2
+    peak = 0
+
+    async def consume(i):
+        chunks = []
+        async for text in claude.chat_stream(user_message=f"stream {i}"):
+            chunks.append(text)
+        return "".join(chunks)
+
+    async def sample(done: asyncio.Event):
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, limiter.in_flight, claude.executor.in_flight)
+            await asyncio.sleep(0.002)
+
+    async def scenario():
+        done = asyncio.Event()
+        sampler = asyncio.ensure_future(sample(done))
+        texts = await asyncio.gather(*(consume(i) for i in range(6)))
+        done.set()
+        await sampler
+        return texts, limiter.stats()
+
+    texts, stats = asyncio.run(scenario())
+
+    assert texts == ["a b c d e f g h"] * 6
+    # 同时读取的流不超过并发上限, 其余的流在公平队列中等待名额
+    assert peak == 2
+    assert stats["in_flight"] == 0 and stats["queued"] == 0
+    assert claude.executor.in_flight == 0
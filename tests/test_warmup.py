@@ -0,0 +1,44 @@
+import asyncio
+
+import httpx
+
+from core.ai.claude_client import ClaudeClient
+from prompts.chat.presets import PRESET_CHARACTERS, PRESET_SCENES
+from service.response_cache import ResponseCache
+
+
+def test_warmup_readiness_and_pregenerated_greetings(api_main, fake_bedrock, monkeypatch):
+    monkeypatch.setenv("WARMUP_GREETINGS", "true")
+    monkeypatch.setenv("WARMUP_CONNECTIONS", "3")
+    fake = fake_bedrock(latency=0.05)
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=8))
+    monkeypatch.setattr(api_main.ai_service, "response_cache", ResponseCache(variants=2))
+    registry = api_main.ai_service.registry
+    combinations = len(registry.list("character")) * len(registry.list("scene"))
+    jake, lab = PRESET_CHARACTERS[0], PRESET_SCENES[0]
+
+    async def run():
+        transport = httpx.ASGITransport(app=api_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await api_main.startup()
+            assert (await client.get("/health")).status_code == 503
+
+            await api_main.warmup_task
+            health = await client.get("/health")
+            assert health.status_code == 200
+            report = health.json()["warmup"]
+            assert report["connections"] == 3
+            assert report["prompts"] == combinations
+            assert report["greetings"] == 2 * combinations
+
+            calls = fake.calls
+            by_id = await client.post("/chat", json={"character_id": "jake", "scene_id": "lab", "message": "你好"})
+            inline = await client.post("/chat", json={
+                "character": {k: jake[k] for k in ("name", "background", "personality")},
+                "scene": {"description": lab["description"], "mood": lab["mood"]},
+                "message": "你好"
+            })
+            assert by_id.json()["cached"] and inline.json()["cached"]
+            assert fake.calls == calls
+
+    asyncio.run(run())
@@ -0,0 +1,121 @@
+import pytest
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from core.ai.claude_client import ClaudeClient
+
+
+def receive_reply(ws):
+    """读取一条消息的回复, 返回 (delta 列表, 结束帧)"""
+    deltas = []
+    while True:
+        frame = ws.receive_json()
+        if frame["type"] == "delta":
+            deltas.append(frame["delta"])
+        elif frame["type"] != "ping":
+            return deltas, frame
+
+
+def test_bind_once_then_stream_messages(api_main, fake_bedrock, monkeypatch):
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake_bedrock(latency=0), max_concurrency=4))
+
+    client = TestClient(api_main.app)
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"type": "bind", "character_id": "jake", "scene_id": "lab"})
+        bound = ws.receive_json()
+        assert bound["type"] == "bound" and bound["session_id"]
+
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+
+        for i, message in enumerate(("hi", "how are you")):
+            ws.send_json({"type": "message", "id": i, "content": message})
+            deltas, end = receive_reply(ws)
+            assert end["type"] == "end" and end["id"] == i
+            assert len(deltas) > 1 and "".join(deltas) == end["response"] == "hey there 😉"
+
+    # 只发送了新消息, 历史保存在服务端
+    session = api_main.ai_service.sessions.get(bound["session_id"])
+    assert [m["content"] for m in session.messages if m["role"] == "user"] == ["hi", "how are you"]
+    api_main.ai_service.sessions.delete(bound["session_id"])
+
+
+def test_bind_history_survives_a_failed_first_turn(api_main, fake_bedrock, monkeypatch):
+    fake = fake_bedrock(latency=0)
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake, max_concurrency=4))
+    sessions = api_main.ai_service.sessions
+    aget_or_create = sessions.aget_or_create
+    failures = [RuntimeError("database is locked")]
+
+    async def flaky_get_or_create(session_id):
+        # 第一轮在写入会话之前失败
+        if failures:
+            raise failures.pop()
+        return await aget_or_create(session_id)
+
+    monkeypatch.setattr(sessions, "aget_or_create", flaky_get_or_create)
+    history = [{"role": "user", "content": "remember me"}, {"role": "assistant", "content": "always"}]
+
+    client = TestClient(api_main.app)
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"type": "bind", "character_id": "jake", "scene_id": "lab", "message_history": history})
+        session_id = ws.receive_json()["session_id"]
+
+        ws.send_json({"type": "message", "id": 0, "content": "first try"})
+        _, failed = receive_reply(ws)
+        ws.send_json({"type": "message", "id": 1, "content": "second try"})
+        _, end = receive_reply(ws)
+
+    assert failed["type"] == "error" and end["type"] == "end"
+    # 第一轮失败后, 绑定时的历史仍然用于下一条消息
+    assert "remember me" in str(fake.last_body["messages"])
+    session = sessions.get(session_id)
+    assert [m["content"] for m in session.messages if m["role"] == "user"] == ["remember me", "second try"]
+    sessions.delete(session_id)
+
+
+def test_bind_errors_close_the_connection(api_main):
+    client = TestClient(api_main.app)
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"type": "bind", "character_id": "nobody", "scene_id": "lab"})
+        error = ws.receive_json()
+        assert error["type"] == "error" and error["status"] == 404
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+        assert closed.value.code == 1008
+
+
+def test_pending_messages_are_bounded(api_main, fake_bedrock, monkeypatch):
+    monkeypatch.setenv("WS_MAX_PENDING", "1")
+    monkeypatch.setattr(api_main.ai_service, "claude", ClaudeClient(bedrock=fake_bedrock(latency=0.3), max_concurrency=4))
+
+    client = TestClient(api_main.app)
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"type": "bind", "character_id": "jake", "scene_id": "lab"})
+        session_id = ws.receive_json()["session_id"]
+        # 第一条在生成, 第二条排队, 第三条被拒绝
+        for i in range(3):
+            ws.send_json({"type": "message", "id": i, "content": f"message {i}"})
+
+        frames = []
+        while len([f for f in frames if f["type"] in ("end", "error")]) < 3:
+            frames.append(ws.receive_json())
+
+    results = {f["id"]: f for f in frames if f["type"] in ("end", "error")}
+    assert results[0]["type"] == results[1]["type"] == "end"
+    assert results[2]["status"] == 429
+    api_main.ai_service.sessions.delete(session_id)
+
+
+def test_connection_cap(api_main, monkeypatch):
+    monkeypatch.setenv("WS_MAX_CONNECTIONS", "1")
+
+    client = TestClient(api_main.app)
+    with client.websocket_connect("/ws/chat") as first:
+        first.send_json({"type": "bind", "character_id": "jake", "scene_id": "lab"})
+        assert first.receive_json()["type"] == "bound"
+        with client.websocket_connect("/ws/chat") as second:
+            assert second.receive_json()["status"] == 503
+            with pytest.raises(WebSocketDisconnect) as closed:
+                second.receive_json()
+            assert closed.value.code == 1013
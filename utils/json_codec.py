@@ -0,0 +1,47 @@
+# utils/json_codec.py
+
+import json
+import os
+from typing import Any, Union
+
+from starlette.responses import JSONResponse
+
+# 可选的快速 JSON 实现: 安装了 orjson 时使用, 否则退回标准库;
+# JSON_BACKEND=json 可强制使用标准库 (便于对比)
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于运行环境
+    orjson = None
+
+if os.getenv("JSON_BACKEND", "").lower() == "json":
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumps(obj: Any) -> bytes:
+    """序列化为 UTF-8 字节 (紧凑格式, 不转义非 ASCII 字符)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(obj: Any) -> str:
+    """序列化为字符串"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data: Union[bytes, bytearray, str]) -> Any:
+    """反序列化"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """使用 dumps 的 JSON 响应 (FastAPI 的默认响应类)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
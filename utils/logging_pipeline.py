@@ -0,0 +1,221 @@
+# utils/logging_pipeline.py
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+from typing import Any, Dict, IO, Optional
+
+# LogRecord 的标准属性, 其余属性视为通过 extra 传入的结构化字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def truncate(text: str, max_chars: int) -> str:
+    """截断过长的文本, 保留开头并注明原长度"""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}...[truncated {len(text) - max_chars} chars]"
+
+
+class LazyJson:
+    """在真正输出时才序列化的对象 (用作日志参数, 被过滤或丢弃时没有开销)"""
+
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value: Any, max_chars: int = 0):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        try:
+            text = json.dumps(self.value, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            text = repr(self.value)
+        return truncate(text, self.max_chars)
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出为一行 JSON, extra 传入的字段原样附加"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    把记录放入有界队列, 由后台线程格式化和输出
+
+    标准 QueueHandler 会在调用方线程里先格式化消息; 这里保留原始的 msg/args,
+    格式化 (包括 LazyJson 的序列化) 全部在后台线程进行。队列满时丢弃记录并计数,
+    不阻塞调用方 (事件循环)。
+    """
+
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """停止时阻塞等待放入结束标记 (队列满时 put_nowait 会失败)"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class PayloadLogger:
+    """
+    请求体/响应等大段内容的日志
+
+    按类别采样 (例如 request=0.01 只记录 1% 的请求体), 内容在后台线程序列化并截断。
+    DEBUG 未开启时只有一次级别判断的开销。
+    """
+
+    def __init__(self,
+                 sample_rates: Optional[Dict[str, float]] = None,
+                 default_rate: float = 1.0,
+                 max_chars: int = 2000,
+                 logger: Optional[logging.Logger] = None,
+                 rng: Optional[random.Random] = None):
+        """
+        Args:
+            sample_rates: 各类别的采样比例
+            default_rate: 未配置类别的采样比例
+            max_chars: 内容的最大字符数
+            logger: 输出使用的 logger, 默认 root
+            rng: 随机数生成器, 便于测试
+        """
+        self.sample_rates = sample_rates or {}
+        self.default_rate = default_rate
+        self.max_chars = max_chars
+        self.logger = logger or logging.getLogger()
+        self._rng = rng or random.Random()
+
+    def log(self, category: str, message: str, payload: Any, level: int = logging.DEBUG):
+        """
+        记录一段内容
+
+        Args:
+            category: 类别 (用于采样和结构化字段)
+            message: 说明文字
+            payload: 内容 (任意可 JSON 序列化的对象), 调用后不应再修改
+            level: 日志级别
+        """
+        if not self.logger.isEnabledFor(level):
+            return
+        rate = self.sample_rates.get(category, self.default_rate)
+        if rate < 1.0 and self._rng.random() >= rate:
+            return
+        self.logger.log(level, "%s: %s", message, LazyJson(payload, self.max_chars),
+                        extra={"category": category})
+
+
+_listener: Optional[_QueueListener] = None
+_handler: Optional[DeferredQueueHandler] = None
+_lock = threading.Lock()
+
+# 默认的内容日志 (setup_logging 按配置替换)
+payload_logger = PayloadLogger()
+
+
+def log_payload(category: str, message: str, payload: Any, level: int = logging.DEBUG):
+    """使用全局配置记录一段内容, 见 PayloadLogger.log"""
+    payload_logger.log(category, message, payload, level)
+
+
+def setup_logging(level: str = "INFO",
+                  fmt: str = "text",
+                  queue_size: int = 10000,
+                  payload_max_chars: int = 2000,
+                  payload_sampling: Optional[Dict[str, float]] = None,
+                  payload_default_rate: float = 1.0,
+                  stream: Optional[IO] = None) -> DeferredQueueHandler:
+    """
+    配置 root logger: 队列 + 后台线程输出
+
+    可以重复调用 (例如加载 .env 之后), 会先停止之前的后台线程并输出剩余记录。
+
+    Args:
+        level: 日志级别
+        fmt: "text" 或 "json"
+        queue_size: 队列长度, 满时丢弃新记录
+        payload_max_chars: 内容日志的最大字符数
+        payload_sampling: 内容日志各类别的采样比例
+        payload_default_rate: 未配置类别的采样比例
+        stream: 输出流, 默认 stderr
+
+    Returns:
+        DeferredQueueHandler: 安装到 root logger 的 handler
+    """
+    global _listener, _handler, payload_logger
+
+    with _lock:
+        shutdown_logging()
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        if fmt == "json":
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+        log_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        _handler = DeferredQueueHandler(log_queue)
+        _listener = _QueueListener(log_queue, output, respect_handler_level=False)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(level.upper())
+
+        payload_logger = PayloadLogger(
+            sample_rates=payload_sampling,
+            default_rate=payload_default_rate,
+            max_chars=payload_max_chars
+        )
+        _listener.start()
+        return _handler
+
+
+def shutdown_logging():
+    """停止后台线程 (输出队列中剩余的记录)"""
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+
+
+def dropped_records() -> int:
+    """因队列满而丢弃的记录数"""
+    return _handler.dropped if _handler is not None else 0
+
+
+atexit.register(shutdown_logging)
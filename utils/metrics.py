@@ -0,0 +1,304 @@
+# utils/metrics.py
+
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 默认的延迟分桶 (秒)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 当前请求各阶段的耗时 (用于 Server-Timing 响应头), 未开启时为 None
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("server_timings", default=None)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """指标基类: 按标签值分别记录, 记录操作加锁 (可能在工作线程中调用)"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+    def value(self, **labels) -> float:
+        """读取当前值 (测试和调试用)"""
+        return self._values.get(self._key(labels), 0)
+
+
+class Counter(Metric):
+    """只增计数"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """可增可减的当前值"""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """分桶直方图 (桶内计数, 输出时累加)"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [各桶计数 (最后一个为 +Inf), 总和, 总数]
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def value(self, **labels) -> float:
+        """观测次数"""
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+
+        samples = []
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    指标注册表, 以 Prometheus 文本格式输出
+
+    除了直接记录的指标, 还可以注册 collector: 在每次输出时调用,
+    返回 (名称, 标签, 值) 列表, 作为 gauge 输出 (用于汇总各组件已有的 stats)。
+    collector 的样本按指标名分组输出, 每个指标只有一组 HELP/TYPE, 同名样本连续排列
+    (文本格式要求同一指标的样本不能被其他指标隔开)。
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], List[Sample]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], List[Sample]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        families: Dict[str, List[Tuple[Dict[str, str], float]]] = {}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                families.setdefault(name, []).append((labels, value))
+        for name, samples in families.items():
+            lines.append(f"# HELP {name} Component stat {name}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: Metric) -> Any:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+
+def flatten_stats(prefix: str, stats: Dict[str, Any], labels: Optional[Dict[str, str]] = None) -> List[Sample]:
+    """
+    把组件的 stats 字典展开为指标
+
+    数值直接输出, 布尔值输出为 0/1, None (例如还没有样本的延迟分位数) 输出为 NaN,
+    字符串输出为带 state 标签的 1, 嵌套字典加前缀展开,
+    字典列表 (例如端点) 以其中的字符串字段作为标签展开。
+    """
+    labels = labels or {}
+    samples: List[Sample] = []
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, bool):
+            samples.append((name, labels, int(value)))
+        elif isinstance(value, (int, float)):
+            samples.append((name, labels, value))
+        elif value is None:
+            samples.append((name, labels, float("nan")))
+        elif isinstance(value, str):
+            samples.append((name, {**labels, "state": value}, 1))
+        elif isinstance(value, dict):
+            samples.extend(flatten_stats(name, value, labels))
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    item_labels = {k: v for k, v in item.items() if isinstance(v, str)}
+                    numbers = {k: v for k, v in item.items() if not isinstance(v, str)}
+                    samples.extend(flatten_stats(name, numbers, {**labels, **item_labels}))
+    return samples
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by route and status", ("path", "status"))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request duration (until the response body ends)", ("path",))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled")
+STAGE_SECONDS = REGISTRY.histogram(
+    "chat_stage_duration_seconds", "Time spent in each stage of a chat request", ("stage",))
+CHAT_ERRORS = REGISTRY.counter(
+    "chat_errors_total", "Failed model calls by error type", ("type",))
+INPUT_TOKENS = REGISTRY.counter(
+    "bedrock_input_tokens_total", "Input tokens reported by Bedrock", ("model",))
+OUTPUT_TOKENS = REGISTRY.counter(
+    "bedrock_output_tokens_total", "Output tokens reported by Bedrock", ("model",))
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "bedrock_queue_wait_seconds", "Time model calls wait for a concurrency slot by priority class", ("priority",))
+SHED_CALLS = REGISTRY.counter(
+    "bedrock_shed_total", "Model calls dropped before reaching Bedrock", ("priority", "reason"))
+CACHE_READ_TOKENS = REGISTRY.counter(
+    "bedrock_cache_read_input_tokens_total", "Input tokens read from the Bedrock prompt cache", ("model",))
+CACHE_WRITE_TOKENS = REGISTRY.counter(
+    "bedrock_cache_write_input_tokens_total", "Input tokens written to the Bedrock prompt cache", ("model",))
+WS_CONNECTIONS = REGISTRY.gauge(
+    "websocket_connections", "Open WebSocket chat connections")
+WS_MESSAGES = REGISTRY.counter(
+    "websocket_messages_total", "WebSocket chat messages by result", ("result",))
+
+
+class stage:
+    """
+    记录一个阶段的耗时 (直方图, 开启时同时计入 Server-Timing)
+
+    用法: with stage("bedrock"): ...
+    (用类实现而不是 contextmanager 生成器, 减少每次进入/退出的开销)
+    """
+
+    __slots__ = ("name", "_start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        STAGE_SECONDS.observe(elapsed, stage=self.name)
+        timings = _timings.get()
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+def record_usage(model_id: str, usage: Optional[Dict[str, Any]]):
+    """累计 Bedrock 返回的 usage 中的 token 数"""
+    if not usage:
+        return
+    if usage.get("input_tokens"):
+        INPUT_TOKENS.inc(usage["input_tokens"], model=model_id)
+    if usage.get("output_tokens"):
+        OUTPUT_TOKENS.inc(usage["output_tokens"], model=model_id)
+    if usage.get("cache_read_input_tokens"):
+        CACHE_READ_TOKENS.inc(usage["cache_read_input_tokens"], model=model_id)
+    if usage.get("cache_creation_input_tokens"):
+        CACHE_WRITE_TOKENS.inc(usage["cache_creation_input_tokens"], model=model_id)
+
+
+def start_timing() -> Tuple[Dict[str, float], Any]:
+    """为当前请求开始收集 Server-Timing, 返回 (耗时字典, 用于 stop_timing 的 token)"""
+    timings: Dict[str, float] = {}
+    return timings, _timings.set(timings)
+
+
+def stop_timing(token: Any):
+    _timings.reset(token)
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """格式化 Server-Timing 响应头 (毫秒)"""
+    return ", ".join(f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in timings.items())
@@ -0,0 +1,100 @@
+# utils/token_counter.py
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# 每条消息在请求中的额外开销 (角色标记等) 的估计值
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """
+    带缓存的 token 计数器
+
+    使用 tiktoken 编码计数 (Claude 没有公开的分词器, cl100k_base 作为近似)。
+    tiktoken 未安装或编码文件无法加载时退化为按 UTF-8 字节数估算。
+    编码在首次计数时加载 (可能需要下载编码文件), 异步调用方应先在线程中调用 load()。
+    计数结果按文本内容缓存, 会话历史中的旧消息不会被重复分词,
+    每轮只需对新消息分词。
+    """
+
+    def __init__(self, encoding_name: str = "cl100k_base", cache_size: int = 100000):
+        """
+        Args:
+            encoding_name: tiktoken 编码名称
+            cache_size: 缓存的文本条数上限
+        """
+        self.encoding_name = encoding_name
+        self.cache_size = cache_size
+        self._encoding = None
+        self._encoding_loaded = False
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        """
+        计算文本的 token 数
+
+        Args:
+            text: 文本
+
+        Returns:
+            int: token 数
+        """
+        if not text:
+            return 0
+
+        with self._lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                return cached
+
+        tokens = self._tokenize(text)
+        with self._lock:
+            self._cache[text] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_message(self, message: Dict[str, str]) -> int:
+        """计算单条消息的 token 数 (含消息开销)"""
+        return self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    @property
+    def loaded(self) -> bool:
+        """编码是否已经加载 (或已确定不可用)"""
+        return self._encoding_loaded
+
+    def load(self) -> bool:
+        """
+        加载 tiktoken 编码 (阻塞, 可能需要下载编码文件; 重复调用无开销)
+
+        Returns:
+            bool: 是否使用 tiktoken (False 表示按字节数估算)
+        """
+        return self._get_encoding() is not None
+
+    def _tokenize(self, text: str) -> int:
+        encoding = self._get_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        # 粗略估算: 英文约 4 字节/token, 中文约 3 字节/token
+        return max(1, len(text.encode("utf-8")) // 3)
+
+    def _get_encoding(self) -> Optional[object]:
+        """延迟加载 tiktoken 编码 (首次加载可能需要下载编码文件)"""
+        if not self._encoding_loaded:
+            with self._load_lock:
+                if not self._encoding_loaded:
+                    try:
+                        import tiktoken
+                        self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    except Exception as e:
+                        logging.warning(f"tiktoken unavailable, falling back to estimation: {str(e)}")
+                        self._encoding = None
+                    self._encoding_loaded = True
+        return self._encoding
@@ -1,13 +1,28 @@
 import gradio as gr
-import requests
+import httpx
 import json
-from typing import List, Dict
+import os
+import uuid
+from typing import AsyncIterator, List, Dict, Optional
 
 
 class RolePlayChat:
-    def __init__(self, api_url: str = "http://localhost:8000/api/v1/chat"):
+    def __init__(self,
+                 api_url: str = "http://localhost:8000/api/v1/chat",
+                 timeout: float = 60.0,
+                 max_connections: int = 100):
+        """
+        Args:
+            api_url: 聊天接口地址 (流式接口为其后加 /stream)
+            timeout: 单次请求的读取超时 (秒)
+            max_connections: 共享连接池的最大连接数
+        """
         self.api_url = api_url
-        self.message_history: List[Dict] = []
+        self.stream_url = f"{api_url}/stream"
+        self.timeout = timeout
+        self.max_connections = max_connections
+        # 对话状态保存在每个用户的 gr.State 中, 这里只有所有用户共享的连接池
+        self._client: Optional[httpx.AsyncClient] = None
 
         # 预设角色列表
         self.preset_characters = {
@@ -40,6 +55,9 @@ class RolePlayChat:
     def create_interface(self):
         """创建 Gradio 界面"""
         with gr.Blocks(theme=gr.themes.Soft()) as interface:
+            # 每个浏览器会话独立的对话状态 (首次发送或开始对话时创建, 不共享 session_id)
+            state = gr.State(None)
+
             with gr.Row():
                 with gr.Column(scale=1):
                     # 角色设置区
@@ -100,22 +118,23 @@ class RolePlayChat:
             start_chat_btn.click(
                 self.start_chat,
                 inputs=[char_name, char_background, char_personality, char_greeting,
-                        scene_desc, scene_mood, chatbot],
-                outputs=[chatbot]
+                        scene_desc, scene_mood, chatbot, state],
+                outputs=[chatbot, state]
             )
 
             send_btn.click(
                 self.send_message,
                 inputs=[
                     msg, char_name, char_background, char_personality,
-                    scene_desc, scene_mood, chatbot
+                    scene_desc, scene_mood, chatbot, state
                 ],
-                outputs=[msg, chatbot]
+                outputs=[msg, chatbot, state]
             )
 
             clear_btn.click(
                 self.clear_history,
-                outputs=[chatbot]
+                inputs=[state],
+                outputs=[chatbot, state]
             )
 
             # 支持按回车发送
@@ -123,9 +142,9 @@ class RolePlayChat:
                 self.send_message,
                 inputs=[
                     msg, char_name, char_background, char_personality,
-                    scene_desc, scene_mood, chatbot
+                    scene_desc, scene_mood, chatbot, state
                 ],
-                outputs=[msg, chatbot]
+                outputs=[msg, chatbot, state]
             )
 
         return interface
@@ -142,67 +161,72 @@ class RolePlayChat:
             ]
         return ["", "", "", ""]
 
-    def start_chat(
+    async def start_chat(
             self, char_name: str, char_background: str,
             char_personality: str, char_greeting: str,
             scene_desc: str, scene_mood: str,
-            chat_history: List
+            chat_history: List, state: Dict
     ):
-        """开始新对话"""
-        self.clear_history()
+        """开始新对话 (逐段显示开场白)"""
+        state = self.new_state()
+        chat_history = []
 
-        # 使用打招呼用语开始对话
-        data = {
-            "character": {
-                "name": char_name,
-                "background": char_background,
-                "personality": char_personality
-            },
-            "scene": {
-                "description": scene_desc,
-                "mood": scene_mood
-            },
-            "message": "你好",
-            "message_history": []
-        }
+        # 如果有自定义打招呼用语，直接使用
+        if char_greeting.strip():
+            chat_history.append((None, char_greeting))
+            state["history"].append({"role": "assistant", "content": char_greeting})
+            yield chat_history, state
+            return
 
-        try:
-            # 如果有自定义打招呼用语，直接使用
-            if char_greeting.strip():
-                chat_history.append((None, char_greeting))
-                self.message_history.append({
-                    "role": "assistant",
-                    "content": char_greeting
-                })
-            else:
-                # 否则调用 API 获取回复
-                response = requests.post(self.api_url, json=data)
-                response.raise_for_status()
-
-                ai_message = response.json()["response"]
-                chat_history.append((None, ai_message))
-                self.message_history.append({
-                    "role": "assistant",
-                    "content": ai_message
-                })
-
-            return chat_history
-
-        except Exception as e:
-            print(f"Error: {e}")
-            return chat_history + [(None, f"发生错误: {str(e)}")]
+        # 否则调用 API 获取开场白: 使用非流式接口, 预设角色的开场白由服务端预先生成并缓存
+        data = self.build_request(
+            "你好", char_name, char_background, char_personality,
+            scene_desc, scene_mood, state
+        )
+        chat_history.append((None, await self.fetch_reply(data, state)))
+        yield chat_history, state
 
-    def send_message(
+    async def send_message(
             self, message: str, char_name: str, char_background: str,
             char_personality: str, scene_desc: str, scene_mood: str,
-            chat_history: List
+            chat_history: List, state: Dict
     ):
-        """发送消息并获取回复"""
+        """发送消息并逐段显示回复"""
         if not message.strip():
-            return "", chat_history
+            yield "", chat_history, state
+            return
 
-        # 准备请求数据
-        data = {
+        state = state or self.new_state()
+        data = self.build_request(
+            message, char_name, char_background, char_personality,
+            scene_desc, scene_mood, state
+        )
+        chat_history = list(chat_history or []) + [(message, "")]
+        async for chat_history in self.stream_reply(data, chat_history, state, message):
+            yield "", chat_history, state
+
+    def clear_history(self, state: Optional[Dict] = None):
+        """清除对话历史 (开始新的服务端会话)"""
+        return None, self.new_state()
+
+    @staticmethod
+    def new_state() -> Dict:
+        """每个浏览器会话独立的状态"""
+        return {
+            # 服务端会话: 同步后每轮只发送新消息
+            "session_id": uuid.uuid4().hex,
+            "synced": False,
+            "history": []
+        }
+
+    @staticmethod
+    def build_request(
+            message: str, char_name: str, char_background: str,
+            char_personality: str, scene_desc: str, scene_mood: str,
+            state: Dict
+    ) -> Dict:
+        """准备请求数据"""
+        return {
             "character": {
                 "name": char_name,
                 "background": char_background,
@@ -213,38 +237,100 @@ class RolePlayChat:
                 "mood": scene_mood
             },
             "message": message,
-            "message_history": self.message_history
+            # 会话已在服务端建立后不再重复发送历史
+            "message_history": [] if state["synced"] else state["history"],
+            "session_id": state["session_id"]
         }
 
+    async def fetch_reply(self, data: Dict, state: Dict) -> str:
+        """调用非流式接口取得完整回复 (可命中服务端的回复缓存), 出错时返回错误提示"""
         try:
-            # 调用 API
-            response = requests.post(self.api_url, json=data)
-            response.raise_for_status()
+            response = await self.get_client().post(self.api_url, json=data)
+            if response.status_code != 200:
+                raise RuntimeError(f"{response.status_code} {response.text}")
+            reply = response.json()["response"]
+        except Exception as e:
+            print(f"Error: {e}")
+            return f"发生错误: {str(e)}"
 
-            # 更新对话历史
-            ai_message = response.json()["response"]
-            self.message_history.append({"role": "user", "content": message})
-            self.message_history.append({"role": "assistant", "content": ai_message})
+        state["history"].append({"role": "assistant", "content": reply})
+        state["synced"] = True
+        return reply
+
+    async def stream_reply(self, data: Dict, chat_history: List, state: Dict,
+                           message: Optional[str]) -> AsyncIterator[List]:
+        """
+        调用流式接口, 每收到一段文本就更新最后一条回复
 
-            # 更新界面对话历史
-            chat_history.append((message, ai_message))
+        Args:
+            data: 请求数据
+            chat_history: 界面对话历史 (最后一条为待填充的回复)
+            state: 会话状态, 完成后追加本轮对话
+            message: 用户消息 (开场白为 None)
+
+        Yields:
+            List: 更新后的界面对话历史
+        """
+        reply = ""
+        try:
+            client = self.get_client()
+            async with client.stream("POST", self.stream_url, json=data) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise RuntimeError(f"{response.status_code} {response.text}")
 
-            return "", chat_history
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif line.startswith("data: "):
+                        payload = json.loads(line[len("data: "):])
+                        if event == "error":
+                            raise RuntimeError(payload.get("detail"))
+                        if event is None:
+                            reply += payload["delta"]
+                            chat_history[-1] = (message, reply)
+                            yield chat_history
+                        event = None
+
+            # 更新对话历史
+            if message is not None:
+                state["history"].append({"role": "user", "content": message})
+            state["history"].append({"role": "assistant", "content": reply})
+            state["synced"] = True
+            chat_history[-1] = (message, reply)
+            yield chat_history
 
         except Exception as e:
             print(f"Error: {e}")
-            return "", chat_history + [(message, f"发生错误: {str(e)}")]
+            chat_history[-1] = (message, f"发生错误: {str(e)}")
+            yield chat_history
 
-    def clear_history(self):
-        """清除对话历史"""
-        self.message_history = []
-        return None
+    def get_client(self) -> httpx.AsyncClient:
+        """所有用户共享的异步 HTTP 客户端 (连接池复用, 在 Gradio 的事件循环中创建)"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        return self._client
 
 
 # 启动应用
 if __name__ == "__main__":
-    chat_app = RolePlayChat()
+    chat_app = RolePlayChat(
+        api_url=os.getenv("WEB_API_URL", "http://localhost:8000/api/v1/chat"),
+        max_connections=int(os.getenv("WEB_MAX_CONNECTIONS", "100"))
+    )
     interface = chat_app.create_interface()
+    # 事件并发处理 (处理函数是异步的, 等待模型时不占用线程); 排队上限防止过载
+    interface.queue(
+        concurrency_count=int(os.getenv("WEB_CONCURRENCY", "64")),
+        max_size=int(os.getenv("WEB_QUEUE_SIZE", "256"))
+    )
     interface.launch(
         server_name="0.0.0.0",
         server_port=7860,